@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+基于asyncio的HTTP引擎
+功能：
+1. 在一个后台线程中运行事件循环，所有请求作为协程并发执行，几百个并发请求不需要几百个线程
+2. 优先使用 httpx（安装了 h2 时启用HTTP/2），其次 aiohttp；连接池大小可调
+3. AsyncExecutor 与 ThreadPoolExecutor 接口相同，返回 concurrent.futures.Future，
+   原有按线程池编写的调度代码（wait / as_completed / cancel）可以直接使用
+4. AsyncHTTPSession 是 requests 会话的替代品：同步调用、按域名限速，请求实际在事件循环中执行
+5. AsyncWaiters 让线程共享的限流器在归还名额时直接唤醒等待中的协程，协程不必定时轮询
+
+httpx 和 aiohttp 都是可选依赖：pip install "httpx[http2]" 或 pip install aiohttp
+"""
+
+import asyncio
+import importlib.util
+from collections import OrderedDict
+from threading import Thread, Event, Lock
+from concurrent.futures import wait as wait_futures
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from rate_limit import RateLimitedSession
+
+
+def available_backend():
+    """返回可用的后端名称（'httpx' 或 'aiohttp'），都未安装时返回None"""
+    for name in ('httpx', 'aiohttp'):
+        if importlib.util.find_spec(name) is not None:
+            return name
+    return None
+
+
+class HTTPStatusError(Exception):
+    """HTTP状态码表示失败（>=400）；与requests的异常一样带有 response.status_code"""
+
+    def __init__(self, response):
+        super().__init__(f"{response.status_code} Error: {response.reason} for url: {response.url}")
+        self.response = response
+
+
+class AsyncHTTPClient:
+    """在后台线程的事件循环中执行HTTP请求
+
+    max_connections: 连接池大小（所有请求共用）；max_keepalive: 保持的空闲连接数
+    http2: 使用httpx且安装了h2时启用HTTP/2
+    """
+
+    def __init__(self, headers=None, max_connections=100, max_keepalive=20, http2=True, timeout=30,
+                 backend=None):
+        self.backend = backend or available_backend()
+        if self.backend is None:
+            raise ImportError("需要安装 httpx 或 aiohttp")
+        self.headers = dict(headers or {})
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.http2 = http2 and self.backend == 'httpx' and importlib.util.find_spec('h2') is not None
+        self.timeout = timeout
+        self.client = None
+        self.loop = None
+        self.thread = None
+        self.lock = Lock()
+
+    def start(self):
+        """启动事件循环线程并创建客户端（首次使用时自动调用）"""
+        with self.lock:
+            if self.loop is not None:
+                return
+            ready = Event()
+            loop = asyncio.new_event_loop()
+
+            def run_loop():
+                asyncio.set_event_loop(loop)
+                ready.set()
+                loop.run_forever()
+
+            self.thread = Thread(target=run_loop, name='async-http', daemon=True)
+            self.thread.start()
+            ready.wait()
+            self.loop = loop
+            asyncio.run_coroutine_threadsafe(self.open_client(), loop).result()
+
+    async def open_client(self):
+        if self.backend == 'httpx':
+            import httpx
+            self.client = httpx.AsyncClient(
+                headers=self.headers,
+                http2=self.http2,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_keepalive),
+                timeout=self.timeout,
+                follow_redirects=True,
+            )
+        else:
+            import aiohttp
+            self.client = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.timeout, sock_read=self.timeout),
+            )
+
+    def run(self, coro):
+        """在事件循环中运行协程，返回 concurrent.futures.Future（可在任意线程中等待或取消）"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def fetch(self, url, params=None, headers=None, on_chunk=None, chunk_size=256 * 1024,
+                    raise_for_status=True, method='GET'):
+        """发出请求，返回 requests.Response
+
+        传入 on_chunk 时响应体按块交给 await on_chunk(chunk) 处理，不在内存中保留，返回的响应没有内容；
+        否则读取完整的响应体
+        """
+        if self.backend == 'httpx':
+            request = self.client.build_request(method, url, params=params, headers=headers)
+            stream = await self.client.send(request, stream=True)
+            try:
+                response = self.build_response(url, str(stream.url), stream.status_code,
+                                               stream.reason_phrase, stream.headers)
+                if raise_for_status and stream.status_code >= 400:
+                    raise HTTPStatusError(response)
+                if on_chunk is None:
+                    response._content = await stream.aread()
+                else:
+                    async for chunk in stream.aiter_bytes(chunk_size):
+                        await on_chunk(chunk)
+            finally:
+                await stream.aclose()
+            return response
+
+        async with self.client.request(method, url, params=params, headers=headers) as stream:
+            response = self.build_response(url, str(stream.url), stream.status, stream.reason, stream.headers)
+            if raise_for_status and stream.status >= 400:
+                raise HTTPStatusError(response)
+            if on_chunk is None:
+                response._content = await stream.read()
+            else:
+                async for chunk in stream.content.iter_chunked(chunk_size):
+                    await on_chunk(chunk)
+        return response
+
+    @staticmethod
+    def build_response(request_url, url, status, reason, headers):
+        """构造 requests.Response，调用方无需区分请求由哪个引擎发出"""
+        response = requests.Response()
+        response.status_code = status
+        response.reason = reason
+        response.url = url or request_url
+        response.headers = CaseInsensitiveDict(dict(headers.items()))
+        response.encoding = get_encoding_from_headers(response.headers)
+        # 响应体已经读完（或交给了on_chunk），没有底层连接需要关闭
+        response._content = b''
+        response._content_consumed = True
+        return response
+
+    def close(self):
+        with self.lock:
+            if self.loop is None:
+                return
+            loop = self.loop
+            self.loop = None
+
+        async def close_client():
+            if self.backend == 'httpx':
+                await self.client.aclose()
+            else:
+                await self.client.close()
+
+        try:
+            asyncio.run_coroutine_threadsafe(close_client(), loop).result(timeout=10)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        self.thread.join(timeout=10)
+
+
+class AsyncWaiters:
+    """在线程共享的限流器（名额、字节预算）上等待的协程
+
+    限流器归还名额时调用 notify() 按先后顺序唤醒一个协程，放行条件整体变化时调用 notify_all()；
+    可以在任意线程中调用
+    """
+
+    def __init__(self):
+        # asyncio.Event -> 所属的事件循环，按登记顺序排列
+        self.waiters = OrderedDict()
+        self.lock = Lock()
+
+    async def wait_for(self, acquire, timeout=None):
+        """等待非阻塞的 acquire() 返回True，不阻塞事件循环
+
+        timeout 为没有收到通知时重新检查的间隔（放行条件可能在没有通知的情况下变化时使用）
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            event = asyncio.Event()
+            # 先登记再检查，检查之后发出的通知不会丢失
+            with self.lock:
+                self.waiters[event] = loop
+            woken = False
+            try:
+                if acquire():
+                    return
+                try:
+                    await asyncio.wait_for(event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                woken = True
+            finally:
+                with self.lock:
+                    notified = self.waiters.pop(event, None) is None
+                # 收到了通知却没有用上（已经自行获得名额，或协程被取消），转交给下一个等待者
+                if notified and not woken:
+                    self.notify()
+
+    def notify(self, n=1):
+        """唤醒最早登记的n个协程"""
+        with self.lock:
+            waiters = [self.waiters.popitem(last=False) for _ in range(min(n, len(self.waiters)))]
+        for event, loop in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+    def notify_all(self):
+        self.notify(len(self.waiters))
+
+
+class AsyncExecutor:
+    """与 ThreadPoolExecutor 接口相同的提交器：submit(协程函数, *参数) 在事件循环中运行协程
+
+    并发数不受线程数限制，由协程内部的限流器（如自适应并发控制器）和连接池决定
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.futures = set()
+        self.lock = Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        future = self.client.run(fn(*args, **kwargs))
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(self.discard)
+        return future
+
+    def discard(self, future):
+        with self.lock:
+            self.futures.discard(future)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self.lock:
+            futures = list(self.futures)
+        if cancel_futures:
+            for future in futures:
+                future.cancel()
+        if wait:
+            wait_futures(futures)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+        return False
+
+
+class AsyncHTTPSession(RateLimitedSession):
+    """用异步引擎发出请求的会话，接口与 RateLimitedSession 相同（同步调用、按域名限速、被限流时重试）
+
+    异步引擎只返回读完的响应体；stream=True 的请求改用 requests 发出（同样限速），响应体边读边用。
+    会话的 headers 会随每个请求发送
+    """
+
+    def __init__(self, client, limiter=None, **kwargs):
+        super().__init__(limiter, **kwargs)
+        self.client = client
+
+    def request(self, method, url, params=None, headers=None, timeout=None, stream=False, **kwargs):
+        if stream:
+            return super().request(method, url, params=params, headers=headers, timeout=timeout,
+                                   stream=True, **kwargs)
+
+        request_headers = dict(self.headers)
+        request_headers.update(headers or {})
+        # 连接管理由引擎负责（HTTP/2不允许Connection头）
+        request_headers.pop('Connection', None)
+
+        def send():
+            future = self.client.run(self.client.fetch(url, params=params, headers=request_headers,
+                                                       raise_for_status=False, method=method))
+            return future.result(timeout=timeout * 2 if timeout else None)
+
+        return self.limited(url, send)
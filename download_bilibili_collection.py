@@ -13,25 +13,201 @@ import requests
 import os
 import json
 import time
+import subprocess
 from urllib.parse import urlparse, parse_qs
+from itertools import chain
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import local, Lock
+
+from tool_registry import get_tool
+from rate_limit import RateLimiter, HostRateLimiter, RateLimitedSession
+from metadata_cache import MetadataCache, bilibili_ok, non_empty, HOUR, DAY
+from download_state import DownloadState, bilibili_key
+from async_http import AsyncHTTPClient, AsyncHTTPSession
+from season_listing import SEASON_ARCHIVES_API, iter_season_pages, season_archives, season_total
+from ranged_fetch import RangedFetcher
 
 class BilibiliCollectionDownloader:
-    def __init__(self):
+    # 元数据缓存有效期：合集列表会新增视频，较短；视频分P信息基本不变，较长
+    LISTING_TTL = 6 * HOUR
+    VIEW_TTL = 7 * DAY
+    PAGE_TTL = DAY
+    # mp4可以直接容纳、合并时无需重新编码的音频编码
+    COPY_AUDIO_CODECS = ('aac', 'mp3', 'alac', 'ac3', 'eac3', 'opus', 'flac')
+
+    def __init__(self, engine='subprocess', download_workers=1, download_rate=0.5, host_rates=None,
+                 page_workers=8, use_cache=True, cache_path=None, merge_workers=None, list_workers=4,
+                 stream_listing=True, http_engine='threads', range_connections=1):
+        """
+        engine: yt-dlp调用方式
+            'subprocess' 每个视频启动一个 yt-dlp 进程（默认）
+            'library'    在当前进程内复用 YoutubeDL 实例（每个下载线程一个，省去每个视频约1秒的启动和导入开销，
+                         并共用HTTP连接和cookies）；未安装yt_dlp模块时自动退回 'subprocess'
+        download_workers: 同时下载的视频数
+        download_rate: 每秒最多开始下载的视频数（所有下载线程共用），替代每个视频后固定等待2秒
+        host_rates: 各域名每秒最多请求数，如 {'api.bilibili.com': 5}；默认使用进程内共享的限速配置
+        page_workers: 并发查询多P视频分集信息的线程数
+        use_cache: 是否使用磁盘元数据缓存（合集列表、视频信息、页面HTML），cache_path 为缓存文件位置
+        merge_workers: 后台合并视频和音频的并发数，默认为CPU核数
+        list_workers: 合集列表第1页返回总数后，并发获取其余页的线程数；为1时逐页获取
+        stream_listing: 边获取合集列表边下载（默认）；为False时先获取并显示完整列表再下载
+        http_engine: API请求方式，'threads' 为requests会话（默认），'async' 为异步HTTP引擎（httpx/aiohttp，
+                     所有并发的列表/分P查询共用一个事件循环和连接池）；未安装httpx或aiohttp时退回 'threads'
+        range_connections: 大于1时（仅 'library' 模式），视频和音频文件按Range区间用多个连接并行下载，
+                           不支持时交回yt-dlp下载
+        """
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'Referer': 'https://www.bilibili.com/',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
             'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
         }
-        self.session = requests.Session()
+        # 所有API请求在会话层按域名限速，被限流（412/429）时自动降速重试
+        limiter = HostRateLimiter(host_rates) if host_rates else None
+        self.session = RateLimitedSession(limiter)
+        self.http_client = None
+        if http_engine == 'async':
+            try:
+                self.http_client = AsyncHTTPClient(self.headers)
+                self.session = AsyncHTTPSession(self.http_client, limiter)
+                print(f"使用异步HTTP引擎: {self.http_client.backend}{' (HTTP/2)' if self.http_client.http2 else ''}")
+            except ImportError:
+                print("未安装httpx或aiohttp，API请求使用requests会话（pip install \"httpx[http2]\"）")
         self.session.headers.update(self.headers)
+        self.engine = engine
+        # YoutubeDL实例不是线程安全的，每个下载线程各用一个，并在该线程内一直复用
+        self.ytdl_local = local()
+        self.progress_state = {}
+        self.download_workers = max(1, download_workers)
+        self.download_limiter = RateLimiter(download_rate)
+        self.page_workers = max(1, page_workers)
+        self.list_workers = max(1, list_workers)
+        self.stream_listing = stream_listing
+        # 已知的各视频分P数（BV号 -> 分P数），来自合集列表和view接口，判断是否已下载时直接使用
+        self.page_counts = {}
+        # 输出目录的文件名索引（目录 -> 索引），判断是否已下载时每个目录只列一次，不再逐个视频扫描目录
+        self.dir_indexes = {}
+        self.dir_index_lock = Lock()
+        # 后台合并：视频下载完成后立即合并分开的视频/音频文件，不必等全部下载结束
+        self.merge_workers = max(1, merge_workers or os.cpu_count() or 2)
+        self.merge_executor = None
+        self.merge_lock = Lock()
+        self.merge_futures = {}  # 合并后的文件路径 -> Future
+        self.ranged_fetcher = None
+        if range_connections > 1:
+            # 多个视频同时下载时共用一个连接池
+            self.ranged_fetcher = RangedFetcher(connections=range_connections, max_files=self.download_workers)
+        if self.ranged_fetcher is not None and engine != 'library':
+            print("多连接下载需要在进程内调用yt-dlp（--in-process），本次不启用")
+        self.cache = None
+        if use_cache:
+            try:
+                self.cache = MetadataCache(cache_path)
+            except Exception as e:
+                print(f"  无法打开元数据缓存，将不使用缓存: {e}")
+    
+    def close(self):
+        """关闭异步HTTP引擎（threads模式无需调用）"""
+        if self.http_client is not None:
+            self.http_client.close()
+    
+    def cached_get(self, url, params=None, ttl=HOUR, validate=None):
+        """GET请求，启用缓存时优先使用磁盘缓存"""
+        if self.cache is None:
+            return self.session.get(url, params=params, timeout=30)
+        return self.cache.get(self.session, url, params=params, ttl=ttl, validate=validate)
+    
+    def get_ytdl(self):
+        """获取当前线程复用的YoutubeDL实例（仅 library 模式），不可用时返回None"""
+        if self.engine != 'library':
+            return None
+        ytdl = getattr(self.ytdl_local, 'ytdl', None)
+        if ytdl is not None:
+            return ytdl
+        try:
+            import yt_dlp
+        except ImportError:
+            print("  未安装yt_dlp模块，改为使用命令行方式调用yt-dlp")
+            self.engine = 'subprocess'
+            return None
+        
+        params = {
+            'outtmpl': '%(title)s.%(ext)s',
+            'merge_output_format': 'mp4',  # 合并为mp4格式
+            'quiet': True,
+            'no_warnings': True,
+            'noprogress': True,
+            'http_headers': {
+                'User-Agent': self.headers['User-Agent'],
+                'Referer': self.headers['Referer'],
+            },
+            'progress_hooks': [self.ytdl_progress_hook],
+        }
+        ytdl = yt_dlp.YoutubeDL(params)
+        # 与requests会话共用cookies
+        for cookie in self.session.cookies:
+            ytdl.cookiejar.set_cookie(cookie)
+        self.ytdl_local.ytdl = ytdl
+        return ytdl
+    
+    def ytdlp_available(self):
+        """yt-dlp是否可用（进程内模块或命令行）"""
+        return self.get_ytdl() is not None or get_tool('yt-dlp') is not None
+    
+    def ytdl_progress_hook(self, status):
+        """YoutubeDL下载进度回调，输出与其他下载步骤一致的进度信息"""
+        try:
+            filename = os.path.basename(status.get('filename') or '')
+            if status.get('status') == 'downloading':
+                downloaded = status.get('downloaded_bytes') or 0
+                total = status.get('total_bytes') or status.get('total_bytes_estimate') or 0
+                speed = status.get('speed') or 0
+                # 限制刷新频率：每个文件每增长1%（总大小未知时每1MB）才输出一次
+                step = int(downloaded * 100 / total) if total else downloaded >> 20
+                if self.progress_state.get(filename) == step:
+                    return
+                self.progress_state[filename] = step
+                if total:
+                    print(f"    下载进度: {step}% ({downloaded / (1024*1024):.1f}/{total / (1024*1024):.1f} MB, "
+                          f"{speed / (1024*1024):.2f} MB/s)", end='\r')
+                else:
+                    print(f"    下载进度: {downloaded / (1024*1024):.1f} MB", end='\r')
+            elif status.get('status') == 'finished':
+                self.progress_state.pop(filename, None)
+                print(f"\n    已下载: {filename}")
+            elif status.get('status') == 'error':
+                self.progress_state.pop(filename, None)
+                print(f"\n    下载出错: {filename}")
+        except Exception:
+            # 进度输出失败不能影响下载本身
+            pass
+    
+    def get_video_info(self, video_url):
+        """获取视频信息（不下载），相当于 yt-dlp --dump-json；失败返回None"""
+        ytdl = self.get_ytdl()
+        if ytdl is not None:
+            try:
+                info = ytdl.extract_info(video_url, download=False)
+                return ytdl.sanitize_info(info) if info else None
+            except Exception as e:
+                print(f"    获取视频信息失败: {e}")
+                return None
+        
+        ytdlp = get_tool('yt-dlp')
+        if ytdlp is None:
+            return None
+        cmd = ytdlp.cmd('--dump-json', '--no-warnings', '--quiet', video_url)
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
+                              universal_newlines=True, timeout=30)
+        if result.returncode == 0 and result.stdout:
+            return json.loads(result.stdout)
+        return None
     
     def download_page(self, url, output_file=None):
         """下载网页源代码"""
         try:
             print(f"正在下载页面: {url}")
-            response = self.session.get(url, timeout=30)
+            response = self.cached_get(url, ttl=self.LISTING_TTL, validate=non_empty)
             response.raise_for_status()
             
             if output_file is None:
@@ -72,7 +248,7 @@ class BilibiliCollectionDownloader:
         """从视频页面获取合集信息"""
         try:
             print(f"正在获取视频页面信息: {video_url}")
-            response = self.session.get(video_url, timeout=30)
+            response = self.cached_get(video_url, ttl=self.PAGE_TTL, validate=non_empty)
             response.raise_for_status()
             html_content = response.text
             
@@ -115,7 +291,7 @@ class BilibiliCollectionDownloader:
                 # 调用视频信息API
                 api_url = "https://api.bilibili.com/x/web-interface/view"
                 params = {'bvid': bvid}
-                response = self.session.get(api_url, params=params, timeout=30)
+                response = self.cached_get(api_url, params=params, ttl=self.VIEW_TTL, validate=bilibili_ok)
                 if response.status_code == 200:
                     data = response.json()
                     if data.get('code') == 0 and 'data' in data:
@@ -263,7 +439,7 @@ class BilibiliCollectionDownloader:
             }
             
             try:
-                response = self.session.get(api_url, params=params, timeout=30)
+                response = self.cached_get(api_url, params=params, ttl=self.LISTING_TTL, validate=bilibili_ok)
                 response.raise_for_status()
                 data = response.json()
                 
@@ -279,13 +455,14 @@ class BilibiliCollectionDownloader:
         try:
             api_url = "https://api.bilibili.com/x/web-interface/view"
             params = {'bvid': bvid}
-            response = self.session.get(api_url, params=params, timeout=30)
+            response = self.cached_get(api_url, params=params, ttl=self.VIEW_TTL, validate=bilibili_ok)
             
             if response.status_code == 200:
                 data = response.json()
                 if data.get('code') == 0 and 'data' in data:
                     video_data = data['data']
                     pages = video_data.get('pages', [])
+                    self.page_counts[bvid] = max(1, len(pages))
                     if len(pages) > 1:
                         # 有多个分P，返回所有分P信息
                         return pages
@@ -298,134 +475,228 @@ class BilibiliCollectionDownloader:
             pass
         return None
     
-    def extract_video_urls_from_api(self, collection_id, mid=None):
-        """从API获取视频列表，并展开多P视频的所有分集"""
-        video_urls = []
-        video_info_list = []  # 存储视频详细信息
+    def get_archive_pages(self, archive):
+        """获取合集中一个视频的分P信息，多P返回分P列表，单P返回None
         
-        # 使用合集API
-        api_url = "https://api.bilibili.com/x/polymer/web-space/seasons_archives_list"
-        page = 1
+        合集列表里已带有分P信息（pages列表或videos分P数）时直接使用，不再请求view接口
+        """
+        bvid = archive.get('bvid', '')
+        pages = archive.get('pages')
+        if isinstance(pages, list) and pages:
+            self.page_counts[bvid] = len(pages)
+            return pages if len(pages) > 1 else None
+        page_count = archive.get('videos')
+        if isinstance(page_count, int) and page_count <= 1:
+            self.page_counts[bvid] = 1
+            return None
+        return self.get_video_pages(bvid)
+    
+    def fetch_season_page(self, params):
+        """请求合集列表的一页，返回解析后的JSON"""
+        response = self.cached_get(SEASON_ARCHIVES_API, params=params, ttl=self.LISTING_TTL, validate=bilibili_ok)
+        response.raise_for_status()
+        return response.json()
+    
+    def expand_archive(self, archive, pages):
+        """把合集中的一个视频展开为下载条目：多P视频每个分P一条，单P视频一条"""
+        bvid = archive.get('bvid', '')
+        aid = archive.get('aid', '')
+        title = archive.get('title', '未知标题')
+        
+        if bvid and pages and len(pages) > 1:
+            # 有多个分P，展开每个分P
+            print(f"    展开多P视频: {title} (共{len(pages)}集)")
+            entries = []
+            for page_info in pages:
+                page_num = page_info.get('page', 1)
+                page_title = page_info.get('part', title)
+                # 构建带分P参数的URL
+                entries.append({
+                    'url': f"https://www.bilibili.com/video/{bvid}?p={page_num}",
+                    'title': f"{title} - {page_title}",
+                    'bvid': bvid,
+                    'aid': aid,
+                    'page': page_num
+                })
+            return entries
+        
+        if bvid:
+            # 单P视频或无法获取分P信息
+            url = f"https://www.bilibili.com/video/{bvid}"
+        elif aid:
+            # 对于av号，暂时不展开分P（av号已废弃，新视频都用BV号）
+            url = f"https://www.bilibili.com/video/av{aid}"
+        else:
+            return []
+        return [{'url': url, 'title': title, 'bvid': bvid, 'aid': aid}]
+    
+    def iter_video_entries(self, collection_id, mid=None):
+        """按合集顺序逐个生成下载条目（视频信息字典，含url、title、bvid、page等）
+        
+        每获取到一页、该页的多P视频展开后立即生成，调用方可以在整个列表获取完成前开始下载。
+        第1页返回总数后其余页并发获取；分P信息在后台线程池中并发查询。
+        已经生成过条目后某一页获取失败时抛出IOError，调用方据此知道列表不完整
+        """
         page_size = 50
+        count = 0
+        executor = ThreadPoolExecutor(max_workers=self.page_workers)
+        pages = iter_season_pages(self.fetch_season_page, collection_id, mid, page_size, self.list_workers)
         
-        while True:
-            params = {
-                'mid': mid or '',
-                'season_id': collection_id,
-                'sort_reverse': 'false',
-                'page_num': page,
-                'page_size': page_size
-            }
-            
-            try:
-                response = self.session.get(api_url, params=params, timeout=30)
-                response.raise_for_status()
-                data = response.json()
+        try:
+            for page, data, error in pages:
+                if error is not None:
+                    print(f"  获取第{page}页失败: {error}")
+                    if count:
+                        raise IOError(f"合集列表获取不完整（已获取 {count} 个视频，第{page}页失败）: {error}")
+                    break
                 
                 print(f"  API响应 (第{page}页): code={data.get('code')}, message={data.get('message', '')}")
                 
-                if data.get('code') == 0 and 'data' in data:
-                    data_obj = data['data']
-                    
-                    # 尝试不同的数据结构
-                    archives = []
-                    if 'archives' in data_obj:
-                        archives = data_obj['archives']
-                    elif 'list' in data_obj:
-                        archives = data_obj['list']
-                    elif 'vlist' in data_obj:
-                        archives = data_obj['vlist']
-                    
-                    if not archives:
-                        # 如果没有archives，尝试直接使用data
-                        if isinstance(data_obj, list):
-                            archives = data_obj
-                        else:
-                            break
-                    
-                    print(f"  第{page}页: 获取到 {len(archives)} 个视频")
-                    
-                    for archive in archives:
-                        bvid = archive.get('bvid', '')
-                        aid = archive.get('aid', '')
-                        title = archive.get('title', '未知标题')
-                        
-                        if bvid:
-                            # 检查是否有多个分P
-                            pages = self.get_video_pages(bvid)
-                            
-                            if pages and len(pages) > 1:
-                                # 有多个分P，展开每个分P
-                                print(f"    展开多P视频: {title} (共{len(pages)}集)")
-                                for page_info in pages:
-                                    page_num = page_info.get('page', 1)
-                                    page_title = page_info.get('part', title)
-                                    # 构建带分P参数的URL
-                                    url = f"https://www.bilibili.com/video/{bvid}?p={page_num}"
-                                    video_urls.append(url)
-                                    video_info_list.append({
-                                        'url': url,
-                                        'title': f"{title} - {page_title}",
-                                        'bvid': bvid,
-                                        'aid': aid,
-                                        'page': page_num
-                                    })
-                            else:
-                                # 单P视频或无法获取分P信息
-                                url = f"https://www.bilibili.com/video/{bvid}"
-                                video_urls.append(url)
-                                video_info_list.append({
-                                    'url': url,
-                                    'title': title,
-                                    'bvid': bvid,
-                                    'aid': aid
-                                })
-                            
-                            # 添加小延迟，避免请求过快
-                            time.sleep(0.1)
-                        elif aid:
-                            # 对于av号，暂时不展开分P（av号已废弃，新视频都用BV号）
-                            url = f"https://www.bilibili.com/video/av{aid}"
-                            video_urls.append(url)
-                            video_info_list.append({
-                                'url': url,
-                                'title': title,
-                                'bvid': '',
-                                'aid': aid
-                            })
-                    
-                    # 获取总数，可能在data_obj或data中
-                    total = data_obj.get('total', data.get('data', {}).get('total', 0))
-                    if total == 0:
-                        total = data.get('total', 0)
-                    
-                    print(f"  当前总数: {len(video_urls)} 个视频/分集, API返回总数: {total}")
-                    
-                    # 如果当前页返回的视频数少于page_size，说明已经是最后一页
-                    # 或者已经获取的数量达到或超过总数
-                    if len(archives) < page_size:
-                        print(f"  已获取所有页面（当前页视频数 {len(archives)} < 每页大小 {page_size}）")
-                        break
-                    
-                    if total > 0 and len(video_urls) >= total:
-                        # 注意：这里total是视频数，不是分集数，所以可能不准确
-                        # 但至少可以作为一个参考
-                        print(f"  已获取所有视频（{len(video_urls)} >= {total}）")
-                        break
-                    
-                    page += 1
-                else:
+                if data.get('code') != 0 or 'data' not in data:
                     error_msg = data.get('message', '未知错误')
                     print(f"  API返回错误: code={data.get('code')}, message={error_msg}")
+                    if count:
+                        raise IOError(f"合集列表获取不完整（已获取 {count} 个视频，第{page}页返回错误）: {error_msg}")
                     break
-            except Exception as e:
-                print(f"  获取第{page}页失败: {e}")
-                import traceback
-                traceback.print_exc()
-                break
+                
+                archives = season_archives(data)
+                if not archives:
+                    break
+                
+                print(f"  第{page}页: 获取到 {len(archives)} 个视频")
+                
+                # 本页的分P信息并发查询，按顺序展开
+                archive_results = [
+                    (archive, executor.submit(self.get_archive_pages, archive) if archive.get('bvid') else None)
+                    for archive in archives
+                ]
+                for archive, future in archive_results:
+                    try:
+                        archive_pages = future.result() if future is not None else None
+                    except Exception:
+                        # 获取失败时按单P处理，不影响主流程
+                        archive_pages = None
+                    yield from self.expand_archive(archive, archive_pages)
+                count += len(archives)
+                
+                total = season_total(data)
+                print(f"  当前总数: {count} 个视频, API返回总数: {total}")
+                
+                # 如果当前页返回的视频数少于page_size，说明已经是最后一页
+                # 或者已经获取的数量达到或超过总数
+                if len(archives) < page_size:
+                    print(f"  已获取所有页面（当前页视频数 {len(archives)} < 每页大小 {page_size}）")
+                    break
+                
+                if total > 0 and count >= total:
+                    print(f"  已获取所有视频（{count} >= {total}）")
+                    break
+        finally:
+            pages.close()
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def extract_video_urls_from_api(self, collection_id, mid=None):
+        """从API获取视频列表，并展开多P视频的所有分集，返回 (URL列表, 视频信息列表, 列表是否完整)"""
+        video_urls = []
+        video_info_list = []  # 存储视频详细信息
+        try:
+            for video_info in self.iter_video_entries(collection_id, mid):
+                video_urls.append(video_info['url'])
+                video_info_list.append(video_info)
+        except IOError as e:
+            print(f"  {e}，只处理已获取的部分")
+            return video_urls, video_info_list, False
+        return video_urls, video_info_list, True
+    
+    def remember_page_counts(self, video_info_list):
+        """从展开后的视频列表中记下各视频的分P数"""
+        counts = {}
+        for video_info in video_info_list:
+            bvid = video_info.get('bvid')
+            if bvid:
+                counts[bvid] = max(counts.get(bvid, 0), video_info.get('page') or 1)
+        for bvid, count in counts.items():
+            self.page_counts.setdefault(bvid, count)
+    
+    def get_page_count(self, bvid, video_url):
+        """视频的分P数：优先使用已知的分P数，其次查询view接口（有缓存），最后才用yt-dlp获取，都失败时返回None"""
+        if bvid in self.page_counts:
+            return self.page_counts[bvid]
+        if bvid:
+            self.get_video_pages(bvid)
+            if bvid in self.page_counts:
+                return self.page_counts[bvid]
+        if not self.ytdlp_available():
+            return None
+        try:
+            video_info = self.get_video_info(video_url)
+        except Exception:
+            return None
+        if not video_info:
+            return None
+        count = len(video_info.get('entries') or []) or 1
+        if bvid:
+            self.page_counts[bvid] = count
+        return count
+    
+    @staticmethod
+    def check_episode_files(output_dir, complete_files, fallback_files):
+        """根据文件名中的分集标识（p01、p02…）判断分集是否连续完整"""
+        episode_pattern = re.compile(r'p(\d+)', re.IGNORECASE)
+        episode_numbers = set()
+        for filename in complete_files:
+            match = episode_pattern.search(filename)
+            if match:
+                episode_numbers.add(int(match.group(1)))
+        
+        if not episode_numbers:
+            # 没有分集标识，可能是单集视频，有文件就认为已下载
+            return True, os.path.join(output_dir, fallback_files[0])
         
-        return video_urls, video_info_list
+        expected_episodes = set(range(1, max(episode_numbers) + 1))
+        if episode_numbers == expected_episodes:
+            return True, os.path.join(output_dir, complete_files[0])
+        missing = expected_episodes - episode_numbers
+        print(f"    检测到分集不完整，缺少: {sorted(missing)}")
+        return False, None
     
+    def get_directory_index(self, output_dir):
+        """输出目录中媒体文件的文件名索引，第一次用到时列一次目录，之后直接复用
+        
+        返回字典：files 为全部媒体文件名，videos 为除 .m4a 以外的文件名，by_bvid 为 BV号 -> 含该BV号的文件名列表
+        """
+        with self.dir_index_lock:
+            index = self.dir_indexes.get(output_dir)
+            if index is not None:
+                return index
+            index = {'files': [], 'videos': [], 'by_bvid': {}}
+            if os.path.isdir(output_dir):
+                with os.scandir(output_dir) as entries:
+                    for entry in entries:
+                        if not entry.is_file() or not entry.name.endswith(('.mp4', '.m4a', '.webm', '.mkv', '.flv')):
+                            continue
+                        index['files'].append(entry.name)
+                        if not entry.name.endswith('.m4a'):
+                            index['videos'].append(entry.name)
+                        for bvid in set(re.findall(r'BV[a-zA-Z0-9]{10}', entry.name)):
+                            index['by_bvid'].setdefault(bvid, []).append(entry.name)
+            self.dir_indexes[output_dir] = index
+            return index
+
+    def invalidate_directory_index(self, output_dir):
+        """目录中有新文件（下载完成）后丢弃索引，下次用到时重新列目录"""
+        with self.dir_index_lock:
+            self.dir_indexes.pop(output_dir, None)
+
+    @staticmethod
+    def indexed_files_with_id(index, video_id, include_audio=False):
+        """文件名中含有该视频ID（BV号或av号）的媒体文件"""
+        if re.fullmatch(r'BV[a-zA-Z0-9]{10}', video_id):
+            files = index['by_bvid'].get(video_id, [])
+        else:
+            files = [f for f in index['files'] if video_id in f]
+        return [f for f in files if include_audio or not f.endswith('.m4a')]
+
     def check_video_downloaded(self, video_url, output_dir, video_title=None):
         """检查视频是否已经下载（通过检查mp4文件是否存在）"""
         try:
@@ -443,11 +714,11 @@ class BilibiliCollectionDownloader:
             
             # 首先，快速检查目录中是否已有mp4文件
             existing_files = []
+            index = None
             if os.path.exists(output_dir):
-                existing_files = [f for f in os.listdir(output_dir) 
-                                if os.path.isfile(os.path.join(output_dir, f)) 
-                                and f.endswith(('.mp4', '.mkv', '.webm', '.flv'))]
-                
+                index = self.get_directory_index(output_dir)
+                existing_files = index['videos']
+                                
                 # 如果目录为空，直接返回False
                 if not existing_files:
                     return False, None
@@ -464,7 +735,7 @@ class BilibiliCollectionDownloader:
                     matched_files = []
                     # 优先在包含BV号的文件中查找
                     if bvid:
-                        bvid_files = [f for f in existing_files if bvid in f]
+                        bvid_files = self.indexed_files_with_id(index, bvid)
                         search_files = bvid_files if bvid_files else existing_files
                     else:
                         search_files = existing_files
@@ -487,136 +758,23 @@ class BilibiliCollectionDownloader:
                 
                 # 优先使用BV号精确匹配（最准确）
                 if bvid:
-                    bvid_files = [f for f in existing_files if bvid in f]
+                    bvid_files = self.indexed_files_with_id(index, bvid)
                     if bvid_files:
                         # 对于多分集视频，需要检查所有分集是否都存在
-                        # 先获取视频信息，看有多少个分集
-                        try:
-                            result = subprocess.run(['python', '-m', 'yt_dlp', '--version'], 
-                                                  capture_output=True, timeout=5)
-                            if result.returncode != 0:
-                                result = subprocess.run(['yt-dlp', '--version'], 
-                                                      capture_output=True, timeout=5)
-                                if result.returncode != 0:
-                                    # yt-dlp不可用，使用简单匹配
-                                    return True, os.path.join(output_dir, bvid_files[0])
-                                use_python_module = False
-                            else:
-                                use_python_module = True
-                            
-                            # 获取视频信息，检查分集数量
-                            if use_python_module:
-                                cmd = ['python', '-m', 'yt_dlp', '--dump-json', '--no-warnings', '--quiet', video_url]
-                            else:
-                                cmd = ['yt-dlp', '--dump-json', '--no-warnings', '--quiet', video_url]
-                            
-                            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
-                                                  universal_newlines=True, timeout=30)
-                            
-                            if result.returncode == 0 and result.stdout:
-                                try:
-                                    video_info = json.loads(result.stdout)
-                                    # 检查是否有多个分集（entries）
-                                    entries = video_info.get('entries', [])
-                                    if entries:
-                                        # 多分集视频，需要检查所有分集
-                                        expected_count = len(entries)
-                                        # 统计目录中该BV号对应的文件数（排除中间文件如.f100026.mp4等）
-                                        bvid_complete_files = [f for f in bvid_files 
-                                                              if not re.search(r'\.f\d+\.(mp4|m4a)$', f) 
-                                                              and not f.endswith('.m4a')]
-                                        if len(bvid_complete_files) >= expected_count:
-                                            return True, os.path.join(output_dir, bvid_complete_files[0])
-                                        else:
-                                            # 分集不完整，需要重新下载
-                                            print(f"    检测到分集不完整: 期望 {expected_count} 个，实际 {len(bvid_complete_files)} 个")
-                                            return False, None
-                                except (json.JSONDecodeError, KeyError):
-                                    # JSON解析失败，继续检查文件名模式
-                                    pass
-                                
-                                # 即使yt-dlp没有返回entries或解析失败，也要检查文件名模式
-                                episode_pattern = re.compile(r'p(\d+)', re.IGNORECASE)
-                                episode_numbers = set()
-                                bvid_complete_files = [f for f in bvid_files 
-                                                      if not re.search(r'\.f\d+\.(mp4|m4a)$', f) 
-                                                      and not f.endswith('.m4a')]
-                                
-                                for filename in bvid_complete_files:
-                                    match = episode_pattern.search(filename)
-                                    if match:
-                                        episode_numbers.add(int(match.group(1)))
-                                
-                                if episode_numbers:
-                                    # 有分集标识，检查是否连续（从1开始）
-                                    max_episode = max(episode_numbers)
-                                    expected_episodes = set(range(1, max_episode + 1))
-                                    if episode_numbers == expected_episodes:
-                                        # 分集完整
-                                        return True, os.path.join(output_dir, bvid_complete_files[0])
-                                    else:
-                                        # 分集不完整，需要重新下载
-                                        missing = expected_episodes - episode_numbers
-                                        print(f"    检测到分集不完整，缺少: {sorted(missing)}")
-                                        return False, None
-                                else:
-                                    # 没有分集标识，可能是单集视频，有文件就认为已下载
-                                    return True, os.path.join(output_dir, bvid_files[0])
-                            else:
-                                # yt-dlp返回错误或没有输出，尝试通过文件名模式检查
-                                episode_pattern = re.compile(r'p(\d+)', re.IGNORECASE)
-                                episode_numbers = set()
-                                bvid_complete_files = [f for f in bvid_files 
-                                                      if not re.search(r'\.f\d+\.(mp4|m4a)$', f) 
-                                                      and not f.endswith('.m4a')]
-                                
-                                for filename in bvid_complete_files:
-                                    match = episode_pattern.search(filename)
-                                    if match:
-                                        episode_numbers.add(int(match.group(1)))
-                                
-                                if episode_numbers:
-                                    max_episode = max(episode_numbers)
-                                    expected_episodes = set(range(1, max_episode + 1))
-                                    if episode_numbers == expected_episodes:
-                                        return True, os.path.join(output_dir, bvid_complete_files[0])
-                                    else:
-                                        missing = expected_episodes - episode_numbers
-                                        print(f"    检测到分集不完整，缺少: {sorted(missing)}")
-                                        return False, None
-                                else:
-                                    # 没有分集标识，可能是单集视频，有文件就认为已下载
-                                    return True, os.path.join(output_dir, bvid_files[0])
-                        except Exception as e:
-                            # 如果获取信息失败，尝试通过文件名模式推断分集数量
-                            # 检查文件名中是否有分集标识（如 p01, p02等）
-                            episode_pattern = re.compile(r'p(\d+)', re.IGNORECASE)
-                            episode_numbers = set()
-                            # 排除中间文件，只检查完整的视频文件
-                            bvid_complete_files = [f for f in bvid_files 
-                                                  if not re.search(r'\.f\d+\.(mp4|m4a)$', f) 
-                                                  and not f.endswith('.m4a')]
-                            
-                            for filename in bvid_complete_files:
-                                match = episode_pattern.search(filename)
-                                if match:
-                                    episode_numbers.add(int(match.group(1)))
-                            
-                            if episode_numbers:
-                                # 有分集标识，检查是否连续（从1开始）
-                                max_episode = max(episode_numbers)
-                                expected_episodes = set(range(1, max_episode + 1))
-                                if episode_numbers == expected_episodes:
-                                    # 分集完整
-                                    return True, os.path.join(output_dir, bvid_complete_files[0])
-                                else:
-                                    # 分集不完整，需要重新下载
-                                    missing = expected_episodes - episode_numbers
-                                    print(f"    检测到分集不完整，缺少: {sorted(missing)}")
-                                    return False, None
-                            else:
-                                # 没有分集标识，可能是单集视频，有文件就认为已下载
-                                return True, os.path.join(output_dir, bvid_files[0])
+                        # 分P数优先用合集列表/view接口中已知的数量，不再为此启动yt-dlp
+                        bvid_complete_files = [f for f in bvid_files 
+                                              if not re.search(r'\.f\d+\.(mp4|m4a)$', f) 
+                                              and not f.endswith('.m4a')]
+                        expected_count = self.get_page_count(bvid, video_url)
+                        if expected_count and expected_count > 1:
+                            if len(bvid_complete_files) >= expected_count:
+                                return True, os.path.join(output_dir, bvid_complete_files[0])
+                            # 分集不完整，需要重新下载
+                            print(f"    检测到分集不完整: 期望 {expected_count} 个，实际 {len(bvid_complete_files)} 个")
+                            return False, None
+                        
+                        # 单集或分P数未知时，检查文件名模式
+                        return self.check_episode_files(output_dir, bvid_complete_files, bvid_files)
                 
                 # 如果没有BV号或BV号匹配失败，使用标题匹配（备用方法）
                 # 但即使通过标题匹配找到文件，也要检查分集是否完整
@@ -658,55 +816,8 @@ class BilibiliCollectionDownloader:
                             # 没有分集标识，可能是单集视频，有文件就认为已下载
                             return True, os.path.join(output_dir, matched_files[0])
             
-            # 检查yt-dlp是否可用
-            try:
-                result = subprocess.run(['python', '-m', 'yt_dlp', '--version'], 
-                                      capture_output=True, 
-                                      timeout=5)
-                if result.returncode != 0:
-                    result = subprocess.run(['yt-dlp', '--version'], 
-                                          capture_output=True, 
-                                          timeout=5)
-                    if result.returncode != 0:
-                        # 如果yt-dlp不可用，但目录中有文件，使用简单的文件名匹配
-                        # 但即使通过标题匹配找到文件，也要检查分集是否完整
-                        if video_title and os.path.exists(output_dir):
-                            title_key = video_title[:20].replace(' ', '').replace('_', '').replace('-', '').replace('【', '').replace('】', '')
-                            matched_files = []
-                            for filename in existing_files:
-                                filename_key = filename[:40].replace(' ', '').replace('_', '').replace('-', '').replace('【', '').replace('】', '')
-                                if title_key.lower() in filename_key.lower():
-                                    matched_files.append(filename)
-                            
-                            if matched_files:
-                                # 检查分集是否完整
-                                episode_pattern = re.compile(r'p(\d+)', re.IGNORECASE)
-                                episode_numbers = set()
-                                complete_files = [f for f in matched_files 
-                                                if not re.search(r'\.f\d+\.(mp4|m4a)$', f) 
-                                                and not f.endswith('.m4a')]
-                                
-                                for filename in complete_files:
-                                    match = episode_pattern.search(filename)
-                                    if match:
-                                        episode_numbers.add(int(match.group(1)))
-                                
-                                if episode_numbers:
-                                    max_episode = max(episode_numbers)
-                                    expected_episodes = set(range(1, max_episode + 1))
-                                    if episode_numbers == expected_episodes:
-                                        return True, os.path.join(output_dir, complete_files[0])
-                                    else:
-                                        missing = expected_episodes - episode_numbers
-                                        print(f"    检测到分集不完整，缺少: {sorted(missing)}")
-                                        return False, None
-                                else:
-                                    return True, os.path.join(output_dir, matched_files[0])
-                        return False, None
-                    use_python_module = False
-                else:
-                    use_python_module = True
-            except (FileNotFoundError, subprocess.TimeoutExpired):
+            # 检查yt-dlp是否可用（进程内只探测一次）
+            if not self.ytdlp_available():
                 # 如果yt-dlp不可用，但目录中有文件，使用简单的文件名匹配
                 # 但即使通过标题匹配找到文件，也要检查分集是否完整
                 if video_title and os.path.exists(output_dir):
@@ -743,38 +854,18 @@ class BilibiliCollectionDownloader:
                             return True, os.path.join(output_dir, matched_files[0])
                 return False, None
             
-            # 获取视频信息（不下载）
-            if use_python_module:
-                cmd = [
-                    'python', '-m', 'yt_dlp',
-                    '--dump-json',
-                    '--no-warnings',
-                    '--quiet',
-                    video_url
-                ]
-            else:
-                cmd = [
-                    'yt-dlp',
-                    '--dump-json',
-                    '--no-warnings',
-                    '--quiet',
-                    video_url
-                ]
-            
-            result = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
-                timeout=30
-            )
-            
-            stdout, stderr = result.stdout, result.stderr
-            process_returncode = result.returncode
+            # 标题和分P数都已知（来自合集列表）时，上面按文件名没有找到就是未下载，不必再用yt-dlp获取视频信息
+            if video_title and bvid in self.page_counts:
+                safe_title = re.sub(r'[<>:"/\\|?*]', '_', video_title)
+                expected_path = os.path.join(output_dir, f"{safe_title}.mp4")
+                if os.path.exists(expected_path) and os.path.getsize(expected_path) > 0:
+                    return True, expected_path
+                return False, None
             
-            if process_returncode == 0 and stdout:
-                try:
-                    video_info = json.loads(stdout)
+            # 获取视频信息（不下载）
+            try:
+                video_info = self.get_video_info(video_url)
+                if video_info:
                     title = video_info.get('title', video_title or '')
                     ext = video_info.get('ext', 'mp4')
                     video_bvid = video_info.get('id', '')  # 获取视频ID
@@ -790,14 +881,10 @@ class BilibiliCollectionDownloader:
                     if entries:
                         # 多分集视频，需要检查所有分集是否都存在
                         expected_count = len(entries)
-                        if os.path.exists(output_dir):
+                        if index is not None:
                             # 统计目录中该BV号对应的完整文件数（排除中间文件）
-                            bvid_files = [f for f in os.listdir(output_dir) 
-                                        if os.path.isfile(os.path.join(output_dir, f))
-                                        and video_bvid in f
-                                        and f.endswith(('.mp4', '.mkv', '.webm', '.flv'))
-                                        and not re.search(r'\.f\d+\.(mp4|m4a)$', f)
-                                        and not f.endswith('.m4a')]
+                            bvid_files = [f for f in self.indexed_files_with_id(index, video_bvid)
+                                        if not re.search(r'\.f\d+\.(mp4|m4a)$', f)]
                             
                             if len(bvid_files) >= expected_count:
                                 return True, os.path.join(output_dir, bvid_files[0])
@@ -806,13 +893,11 @@ class BilibiliCollectionDownloader:
                                 return False, None
                     else:
                         # 单集视频，使用BV号精确匹配
-                        if video_bvid and os.path.exists(output_dir):
-                            for filename in os.listdir(output_dir):
-                                file_path = os.path.join(output_dir, filename)
-                                if os.path.isfile(file_path) and filename.endswith(('.mp4', '.m4a', '.webm', '.mkv', '.flv')):
-                                    # 通过视频ID匹配（最准确）
-                                    if video_bvid in filename and not re.search(r'\.f\d+\.(mp4|m4a)$', filename):
-                                        return True, file_path
+                        if video_bvid and index is not None:
+                            for filename in self.indexed_files_with_id(index, video_bvid, include_audio=True):
+                                # 通过视频ID匹配（最准确）
+                                if not re.search(r'\.f\d+\.(mp4|m4a)$', filename):
+                                    return True, os.path.join(output_dir, filename)
                         
                         # 如果BV号匹配失败，尝试标题匹配
                         safe_title = title
@@ -828,15 +913,13 @@ class BilibiliCollectionDownloader:
                             return True, expected_path
                         
                         # 通过标题匹配（备用方法），但也要检查分集是否完整
-                        if title and len(title) > 5 and os.path.exists(output_dir):
+                        if title and len(title) > 5 and index is not None:
                             title_key = title[:25].replace(' ', '').replace('_', '').replace('-', '').replace('【', '').replace('】', '').replace(' ', '')
                             matched_files = []
-                            for filename in os.listdir(output_dir):
-                                file_path = os.path.join(output_dir, filename)
-                                if os.path.isfile(file_path) and filename.endswith(('.mp4', '.m4a', '.webm', '.mkv', '.flv')):
-                                    filename_key = filename[:50].replace(' ', '').replace('_', '').replace('-', '').replace('【', '').replace('】', '').replace(' ', '')
-                                    if title_key.lower() in filename_key.lower():
-                                        matched_files.append(filename)
+                            for filename in index['files']:
+                                filename_key = filename[:50].replace(' ', '').replace('_', '').replace('-', '').replace('【', '').replace('】', '').replace(' ', '')
+                                if title_key.lower() in filename_key.lower():
+                                    matched_files.append(filename)
                             
                             if matched_files:
                                 # 检查分集是否完整
@@ -862,50 +945,48 @@ class BilibiliCollectionDownloader:
                                         return False, None
                                 else:
                                     return True, os.path.join(output_dir, matched_files[0])
-                except (json.JSONDecodeError, KeyError) as e:
-                    # 如果解析失败，尝试使用简单的文件名匹配，但也要检查分集是否完整
-                    if video_title and os.path.exists(output_dir):
-                        title_key = video_title[:20].replace(' ', '').replace('_', '').replace('-', '').replace('【', '').replace('】', '')
-                        matched_files = []
-                        for filename in existing_files:
-                            filename_key = filename[:40].replace(' ', '').replace('_', '').replace('-', '').replace('【', '').replace('】', '')
-                            if title_key.lower() in filename_key.lower():
-                                matched_files.append(filename)
+            except (json.JSONDecodeError, KeyError) as e:
+                # 如果解析失败，尝试使用简单的文件名匹配，但也要检查分集是否完整
+                if video_title and os.path.exists(output_dir):
+                    title_key = video_title[:20].replace(' ', '').replace('_', '').replace('-', '').replace('【', '').replace('】', '')
+                    matched_files = []
+                    for filename in existing_files:
+                        filename_key = filename[:40].replace(' ', '').replace('_', '').replace('-', '').replace('【', '').replace('】', '')
+                        if title_key.lower() in filename_key.lower():
+                            matched_files.append(filename)
+                    
+                    if matched_files:
+                        # 检查分集是否完整
+                        episode_pattern = re.compile(r'p(\d+)', re.IGNORECASE)
+                        episode_numbers = set()
+                        complete_files = [f for f in matched_files 
+                                        if not re.search(r'\.f\d+\.(mp4|m4a)$', f) 
+                                        and not f.endswith('.m4a')]
                         
-                        if matched_files:
-                            # 检查分集是否完整
-                            episode_pattern = re.compile(r'p(\d+)', re.IGNORECASE)
-                            episode_numbers = set()
-                            complete_files = [f for f in matched_files 
-                                            if not re.search(r'\.f\d+\.(mp4|m4a)$', f) 
-                                            and not f.endswith('.m4a')]
-                            
-                            for filename in complete_files:
-                                match = episode_pattern.search(filename)
-                                if match:
-                                    episode_numbers.add(int(match.group(1)))
-                            
-                            if episode_numbers:
-                                max_episode = max(episode_numbers)
-                                expected_episodes = set(range(1, max_episode + 1))
-                                if episode_numbers == expected_episodes:
-                                    return True, os.path.join(output_dir, complete_files[0])
-                                else:
-                                    missing = expected_episodes - episode_numbers
-                                    print(f"    检测到分集不完整，缺少: {sorted(missing)}")
-                                    return False, None
+                        for filename in complete_files:
+                            match = episode_pattern.search(filename)
+                            if match:
+                                episode_numbers.add(int(match.group(1)))
+                        
+                        if episode_numbers:
+                            max_episode = max(episode_numbers)
+                            expected_episodes = set(range(1, max_episode + 1))
+                            if episode_numbers == expected_episodes:
+                                return True, os.path.join(output_dir, complete_files[0])
                             else:
-                                return True, os.path.join(output_dir, matched_files[0])
-                    pass
+                                missing = expected_episodes - episode_numbers
+                                print(f"    检测到分集不完整，缺少: {sorted(missing)}")
+                                return False, None
+                        else:
+                            return True, os.path.join(output_dir, matched_files[0])
+                pass
             
             return False, None
         except Exception as e:
             # 如果检查失败，尝试使用简单的文件名匹配
             if video_title and os.path.exists(output_dir):
                 try:
-                    fallback_files = [f for f in os.listdir(output_dir) 
-                                    if os.path.isfile(os.path.join(output_dir, f)) 
-                                    and f.endswith(('.mp4', '.mkv', '.webm', '.flv'))]
+                    fallback_files = self.get_directory_index(output_dir)['videos']
                     title_key = video_title[:20].replace(' ', '').replace('_', '').replace('-', '').replace('【', '').replace('】', '')
                     for filename in fallback_files:
                         filename_key = filename[:40].replace(' ', '').replace('_', '').replace('-', '').replace('【', '').replace('】', '')
@@ -915,67 +996,222 @@ class BilibiliCollectionDownloader:
                     pass
             return False, None
     
-    def merge_video_audio_files(self, output_dir):
-        """合并目录中分开的视频和音频文件"""
+    def find_merge_pairs(self, output_dir):
+        """查找目录中分开的视频和音频文件对（如 视频名.f100026.mp4 + 视频名.f30280.m4a）"""
+        # 查找所有mp4和m4a文件
+        mp4_files = {}
+        m4a_files = {}
+        
+        for filename in os.listdir(output_dir):
+            file_path = os.path.join(output_dir, filename)
+            if not os.path.isfile(file_path):
+                continue
+            
+            # 提取基础文件名（去掉扩展名和可能的流标识符）
+            # 例如: "视频名.f100026.mp4" -> "视频名"
+            base_name = filename
+            # 移除扩展名
+            if filename.endswith('.mp4'):
+                base_name = filename[:-4]
+                # 移除可能的流标识符（如 .f100026）
+                base_name = re.sub(r'\.f\d+$', '', base_name)
+                mp4_files[base_name] = file_path
+            elif filename.endswith('.m4a'):
+                base_name = filename[:-4]
+                base_name = re.sub(r'\.f\d+$', '', base_name)
+                m4a_files[base_name] = file_path
+        
+        # 找到匹配的视频和音频文件对
+        matched_pairs = []
+        for base_name in mp4_files:
+            if base_name in m4a_files:
+                matched_pairs.append({
+                    'base_name': base_name,
+                    'video': mp4_files[base_name],
+                    'audio': m4a_files[base_name],
+                    'output': os.path.join(output_dir, f"{base_name}.mp4"),
+                })
+        return matched_pairs
+    
+    @staticmethod
+    def pair_size(pair):
         try:
-            import subprocess
+            return os.path.getsize(pair['video']) + os.path.getsize(pair['audio'])
+        except OSError:
+            return 0
+    
+    def probe_audio_codec(self, audio_path):
+        """用ffprobe获取音频编码（如 aac），无法获取时返回None"""
+        ffprobe = get_tool('ffprobe')
+        if ffprobe is None:
+            return None
+        try:
+            result = subprocess.run(
+                ffprobe.cmd('-v', 'error', '-select_streams', 'a:0',
+                            '-show_entries', 'stream=codec_name', '-of', 'csv=p=0', audio_path),
+                capture_output=True, timeout=30
+            )
+            codec = result.stdout.decode('utf-8', errors='ignore').strip()
+            return codec or None
+        except Exception:
+            return None
+    
+    def merge_pair(self, pair):
+        """合并一对视频和音频文件，成功后删除原始文件，返回是否成功
+        
+        音频已是mp4可直接容纳的编码（B站的m4a一般是AAC）时直接复制流，不重新编码；
+        无法判断编码时先尝试复制，失败再编码为AAC
+        """
+        ffmpeg = get_tool('ffmpeg')
+        base_name = pair['base_name']
+        video_path = pair['video']
+        audio_path = pair['audio']
+        output_path = pair['output']
+        
+        # 获取文件大小信息
+        try:
+            video_size = os.path.getsize(video_path)
+            audio_size = os.path.getsize(audio_path)
+            total_size_mb = (video_size + audio_size) / (1024 * 1024)
+            print(f"  正在合并: {base_name}")
+            print(f"    视频文件: {video_size / (1024*1024):.2f} MB, 音频文件: {audio_size / (1024*1024):.2f} MB")
+        except Exception as e:
+            print(f"  正在合并: {base_name}")
+            total_size_mb = 0
+        
+        # 根据文件大小动态计算超时时间
+        # 每MB给2秒，最少300秒，最多3600秒（1小时）
+        if total_size_mb > 0:
+            timeout_seconds = max(300, min(3600, int(total_size_mb * 2)))
+        else:
+            timeout_seconds = 1800  # 默认30分钟
+        
+        codec = self.probe_audio_codec(audio_path)
+        if codec is None or codec in self.COPY_AUDIO_CODECS:
+            audio_modes = ['copy', 'aac']
+        else:
+            audio_modes = ['aac']
+        
+        for audio_mode in audio_modes:
+            # 使用ffmpeg合并，视频流直接复制，不重新编码
+            cmd = ffmpeg.cmd(
+                '-i', video_path,
+                '-i', audio_path,
+                '-map', '0:v:0',
+                '-map', '1:a:0',
+                '-c:v', 'copy',
+                '-c:a', audio_mode,
+                '-movflags', '+faststart',
+                '-y',            # 覆盖输出文件
+                '-loglevel', 'error',  # 只显示错误信息
+                output_path
+            )
             
-            if not os.path.exists(output_dir):
+            try:
+                result = subprocess.run(
+                    cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    timeout=timeout_seconds
+                )
+                
+                # 检查输出文件大小，确保合并成功（合并后的文件应该比单独的视频文件大）
+                if (result.returncode == 0 and os.path.exists(output_path)
+                        and os.path.getsize(output_path) > os.path.getsize(video_path)):
+                    # 合并成功，删除原始文件
+                    try:
+                        os.remove(video_path)
+                        os.remove(audio_path)
+                        print(f"    [成功] {base_name} 已合并并删除原始文件（音频{'直接复制' if audio_mode == 'copy' else '编码为AAC'}）")
+                        return True
+                    except Exception as e:
+                        print(f"    [警告] 合并成功但删除原始文件失败: {e}")
+                        return False
+                
+                if result.returncode == 0:
+                    print(f"    [失败] {base_name} 合并后的文件大小异常")
+                else:
+                    error_msg = result.stderr.decode('utf-8', errors='ignore') if result.stderr else '未知错误'
+                    print(f"    [失败] {base_name} 合并失败（音频{audio_mode}）: {error_msg[:100]}")
+            except subprocess.TimeoutExpired:
+                print(f"    [超时] {base_name} 合并操作超时（{timeout_seconds // 60} 分钟）")
+                print(f"    提示: 文件较大，合并需要更长时间。您可以:")
+                print(f"      1. 手动运行以下命令合并:")
+                print(f"         ffmpeg -i \"{video_path}\" -i \"{audio_path}\" -c:v copy -c:a {audio_mode} -y \"{output_path}\"")
+                print(f"      2. 或者重新运行脚本，脚本会跳过已存在的文件并继续处理其他文件")
+                self.remove_file(output_path)
                 return False
-            
-            # 查找所有mp4和m4a文件
-            mp4_files = {}
-            m4a_files = {}
-            
-            for filename in os.listdir(output_dir):
-                file_path = os.path.join(output_dir, filename)
-                if not os.path.isfile(file_path):
+            except Exception as e:
+                print(f"    [错误] {base_name} 合并过程出错: {e}")
+            self.remove_file(output_path)
+        return False
+    
+    @staticmethod
+    def remove_file(path):
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except:
+                pass
+    
+    def get_merge_executor(self):
+        """后台合并线程池（每个合并任务是一个独立的ffmpeg进程，线程只负责等待，按CPU核数设置大小）"""
+        with self.merge_lock:
+            if self.merge_executor is None:
+                self.merge_executor = ThreadPoolExecutor(max_workers=self.merge_workers)
+            return self.merge_executor
+    
+    def schedule_merges(self, output_dir, created_before=None):
+        """把目录中新出现的视频/音频文件对交给后台合并，大文件优先
+        
+        created_before: 只合并在此时间之前生成的文件对，避免和仍在运行的yt-dlp同时处理同一组文件
+        返回新提交的文件对数
+        """
+        if get_tool('ffmpeg') is None or not os.path.exists(output_dir):
+            return 0
+        pairs = []
+        for pair in self.find_merge_pairs(output_dir):
+            if pair['output'] in self.merge_futures or os.path.exists(pair['output']):
+                continue
+            if created_before is not None:
+                try:
+                    created = max(os.path.getctime(pair['video']), os.path.getctime(pair['audio']))
+                except OSError:
                     continue
-                
-                # 提取基础文件名（去掉扩展名和可能的流标识符）
-                # 例如: "视频名.f100026.mp4" -> "视频名"
-                base_name = filename
-                # 移除扩展名
-                if filename.endswith('.mp4'):
-                    base_name = filename[:-4]
-                    # 移除可能的流标识符（如 .f100026）
-                    base_name = re.sub(r'\.f\d+$', '', base_name)
-                    mp4_files[base_name] = file_path
-                elif filename.endswith('.m4a'):
-                    base_name = filename[:-4]
-                    base_name = re.sub(r'\.f\d+$', '', base_name)
-                    m4a_files[base_name] = file_path
+                if created >= created_before:
+                    continue
+            pairs.append(pair)
+        
+        executor = self.get_merge_executor()
+        for pair in sorted(pairs, key=self.pair_size, reverse=True):
+            self.merge_futures[pair['output']] = executor.submit(self.merge_pair, pair)
+        return len(pairs)
+    
+    def merge_video_audio_files(self, output_dir):
+        """合并目录中分开的视频和音频文件，并等待后台合并任务完成"""
+        try:
+            if not os.path.exists(output_dir):
+                return False
             
-            # 找到匹配的视频和音频文件对
-            matched_pairs = []
-            for base_name in mp4_files:
-                if base_name in m4a_files:
-                    matched_pairs.append({
-                        'base_name': base_name,
-                        'video': mp4_files[base_name],
-                        'audio': m4a_files[base_name]
-                    })
+            # 下载过程中已提交的后台合并任务
+            directory = os.path.abspath(output_dir)
+            pending = {path: future for path, future in self.merge_futures.items()
+                       if os.path.dirname(os.path.abspath(path)) == directory}
             
-            if not matched_pairs:
+            matched_pairs = [pair for pair in self.find_merge_pairs(output_dir) if pair['output'] not in pending]
+            if not matched_pairs and not pending:
                 print("  未找到需要合并的视频和音频文件对")
                 return False
             
-            print(f"  找到 {len(matched_pairs)} 个需要合并的文件对:")
-            for pair in matched_pairs:
-                print(f"    - {pair['base_name']}")
+            if matched_pairs:
+                print(f"  找到 {len(matched_pairs)} 个需要合并的文件对:")
+                for pair in matched_pairs:
+                    print(f"    - {pair['base_name']}")
+            if pending:
+                print(f"  等待 {len(pending)} 个后台合并任务完成...")
             
-            # 检查ffmpeg是否可用
-            ffmpeg_available = False
-            try:
-                result = subprocess.run(['ffmpeg', '-version'], 
-                                      capture_output=True, 
-                                      timeout=5)
-                if result.returncode == 0:
-                    ffmpeg_available = True
-            except (FileNotFoundError, subprocess.TimeoutExpired):
-                pass
-            
-            if not ffmpeg_available:
+            # 检查ffmpeg是否可用（进程内只探测一次）
+            if matched_pairs and get_tool('ffmpeg') is None:
                 print("\n  错误: 未找到 ffmpeg，无法合并视频和音频文件")
                 print("  请安装 ffmpeg:")
                 print("    Windows: 下载 https://www.gyan.dev/ffmpeg/builds/ 或使用 chocolatey: choco install ffmpeg")
@@ -983,103 +1219,21 @@ class BilibiliCollectionDownloader:
                 print("    安装后请重启终端或重新运行脚本")
                 return False
             
-            merged_count = 0
-            
-            # 合并每个文件对
             for pair in matched_pairs:
-                base_name = pair['base_name']
-                video_path = pair['video']
-                audio_path = pair['audio']
-                
-                # 生成合并后的文件名
-                output_filename = f"{base_name}.mp4"
-                output_path = os.path.join(output_dir, output_filename)
-                
                 # 如果合并后的文件已存在，跳过
-                if os.path.exists(output_path):
-                    print(f"  跳过 {base_name} (已存在合并后的文件)")
+                if os.path.exists(pair['output']):
+                    print(f"  跳过 {pair['base_name']} (已存在合并后的文件)")
+            self.schedule_merges(output_dir)
+            
+            merged_count = 0
+            for path in list(self.merge_futures):
+                if os.path.dirname(os.path.abspath(path)) != directory:
                     continue
-                
-                # 获取文件大小信息
                 try:
-                    video_size = os.path.getsize(video_path)
-                    audio_size = os.path.getsize(audio_path)
-                    total_size_mb = (video_size + audio_size) / (1024 * 1024)
-                    print(f"  正在合并: {base_name}")
-                    print(f"    视频文件: {video_size / (1024*1024):.2f} MB, 音频文件: {audio_size / (1024*1024):.2f} MB")
-                except Exception as e:
-                    print(f"  正在合并: {base_name}")
-                    total_size_mb = 0
-                
-                # 根据文件大小动态计算超时时间
-                # 每MB给2秒，最少300秒，最多3600秒（1小时）
-                if total_size_mb > 0:
-                    timeout_seconds = max(300, min(3600, int(total_size_mb * 2)))
-                else:
-                    timeout_seconds = 1800  # 默认30分钟
-                
-                print(f"    预计耗时: 最多 {timeout_seconds // 60} 分钟")
-                
-                # 使用ffmpeg合并
-                cmd = [
-                    'ffmpeg',
-                    '-i', video_path,
-                    '-i', audio_path,
-                    '-c:v', 'copy',  # 视频流直接复制，不重新编码
-                    '-c:a', 'aac',   # 音频编码为aac
-                    '-y',            # 覆盖输出文件
-                    '-loglevel', 'error',  # 只显示错误信息
-                    output_path
-                ]
-                
-                try:
-                    result = subprocess.run(
-                        cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        timeout=timeout_seconds
-                    )
-                    
-                    if result.returncode == 0 and os.path.exists(output_path):
-                        # 检查输出文件大小，确保合并成功
-                        output_size = os.path.getsize(output_path)
-                        video_size = os.path.getsize(video_path)
-                        if output_size > video_size:  # 合并后的文件应该比单独的视频文件大
-                            # 合并成功，删除原始文件
-                            try:
-                                os.remove(video_path)
-                                os.remove(audio_path)
-                                print(f"    [成功] 已合并并删除原始文件")
-                                merged_count += 1
-                            except Exception as e:
-                                print(f"    [警告] 合并成功但删除原始文件失败: {e}")
-                        else:
-                            print(f"    [失败] 合并后的文件大小异常")
-                            try:
-                                os.remove(output_path)
-                            except:
-                                pass
-                    else:
-                        error_msg = result.stderr.decode('utf-8', errors='ignore') if result.stderr else '未知错误'
-                        print(f"    [失败] 合并失败: {error_msg[:100]}")
-                        if os.path.exists(output_path):
-                            try:
-                                os.remove(output_path)
-                            except:
-                                pass
-                except subprocess.TimeoutExpired:
-                    print(f"    [超时] 合并操作超时（{timeout_seconds // 60} 分钟）")
-                    print(f"    提示: 文件较大，合并需要更长时间。您可以:")
-                    print(f"      1. 手动运行以下命令合并:")
-                    print(f"         ffmpeg -i \"{video_path}\" -i \"{audio_path}\" -c:v copy -c:a aac -y \"{output_path}\"")
-                    print(f"      2. 或者重新运行脚本，脚本会跳过已存在的文件并继续处理其他文件")
+                    if self.merge_futures.pop(path).result():
+                        merged_count += 1
                 except Exception as e:
                     print(f"    [错误] 合并过程出错: {e}")
-                    if os.path.exists(output_path):
-                        try:
-                            os.remove(output_path)
-                        except:
-                            pass
             
             if merged_count > 0:
                 print(f"\n  共成功合并了 {merged_count} 个视频文件")
@@ -1094,24 +1248,17 @@ class BilibiliCollectionDownloader:
             return False
     
     def download_video_with_ytdlp(self, video_url, output_dir, index=None):
-        """使用yt-dlp下载视频（推荐方法）"""
-        try:
-            import subprocess
-            # 尝试使用 python -m yt_dlp，这样更可靠
-            result = subprocess.run(['python', '-m', 'yt_dlp', '--version'], 
-                                  capture_output=True, 
-                                  timeout=5)
-            if result.returncode != 0:
-                # 如果python -m失败，尝试直接调用yt-dlp
-                result = subprocess.run(['yt-dlp', '--version'], 
-                                      capture_output=True, 
-                                      timeout=5)
-                if result.returncode != 0:
-                    return False
-                use_python_module = False
-            else:
-                use_python_module = True
-        except (FileNotFoundError, subprocess.TimeoutExpired):
+        """使用yt-dlp下载视频（推荐方法）
+
+        成功时返回输出文件路径（无法得知路径时返回True），失败返回False
+        """
+        ytdl = self.get_ytdl()
+        if ytdl is not None:
+            return self.download_video_in_process(ytdl, video_url, output_dir)
+        
+        # 优先以当前解释器的模块方式调用yt-dlp（进程内只探测一次）
+        ytdlp = get_tool('yt-dlp')
+        if ytdlp is None:
             print("  yt-dlp未安装，请先安装: pip install yt-dlp")
             return False
         
@@ -1124,24 +1271,14 @@ class BilibiliCollectionDownloader:
             
             # 添加合并选项：自动合并视频和音频为mp4格式
             # 如果视频和音频分开，yt-dlp会自动下载并合并
-            if use_python_module:
-                cmd = [
-                    'python', '-m', 'yt_dlp',
-                    '-o', output_template,
-                    '--merge-output-format', 'mp4',  # 合并为mp4格式
-                    '--no-warnings',
-                    '--quiet',
-                    video_url
-                ]
-            else:
-                cmd = [
-                    'yt-dlp',
-                    '-o', output_template,
-                    '--merge-output-format', 'mp4',  # 合并为mp4格式
-                    '--no-warnings',
-                    '--quiet',
-                    video_url
-                ]
+            cmd = ytdlp.cmd(
+                '-o', output_template,
+                '--merge-output-format', 'mp4',  # 合并为mp4格式
+                '--print', 'after_move:filepath',  # 输出最终文件路径，用于记录下载状态
+                '--no-warnings',
+                '--quiet',
+                video_url
+            )
             
             process = subprocess.Popen(
                 cmd,
@@ -1153,7 +1290,8 @@ class BilibiliCollectionDownloader:
             stdout, stderr = process.communicate()
             
             if process.returncode == 0:
-                return True
+                lines = [line.strip() for line in stdout.splitlines() if line.strip()]
+                return lines[-1] if lines and os.path.isfile(lines[-1]) else True
             else:
                 print(f"  yt-dlp错误: {stderr[:200]}")
                 return False
@@ -1161,8 +1299,279 @@ class BilibiliCollectionDownloader:
             print(f"  yt-dlp执行失败: {e}")
             return False
     
-    def download_collection(self, collection_url, output_dir="downloads"):
-        """主函数：下载合集"""
+    def download_video_in_process(self, ytdl, video_url, output_dir):
+        """在当前进程内用复用的YoutubeDL实例下载视频"""
+        try:
+            # 输出目录随调用变化，文件名模板保持 %(title)s.%(ext)s
+            ytdl.params['paths'] = {'home': output_dir}
+            if self.ranged_fetcher is not None:
+                info = ytdl.extract_info(video_url, download=False)
+                if not info:
+                    print("  yt-dlp获取视频信息失败")
+                    return False
+                filepath = self.download_formats_ranged(ytdl, info)
+                if filepath:
+                    return filepath
+                # 不适用多连接下载时，用已获取的信息交给yt-dlp下载，不再重新解析
+                info = ytdl.process_ie_result(info, download=True)
+            else:
+                info = ytdl.extract_info(video_url, download=True)
+            if not info:
+                print("  yt-dlp下载失败")
+                return False
+            downloads = info.get('requested_downloads') or [{}]
+            filepath = downloads[-1].get('filepath') or info.get('filepath')
+            return filepath if filepath and os.path.isfile(filepath) else True
+        except Exception as e:
+            print(f"\n  yt-dlp执行失败: {e}")
+            return False
+    
+    def download_formats_ranged(self, ytdl, info):
+        """按yt-dlp选出的格式，用多连接分段下载视频（和音频）文件，需要时合并为mp4
+        
+        成功返回输出文件路径；格式不是普通HTTP文件（如分片流）或需要合并但没有ffmpeg时返回None，
+        由调用方交回yt-dlp下载
+        """
+        if info.get('_type', 'video') != 'video':
+            return None
+        formats = info.get('requested_formats') or [info]
+        if any(f.get('protocol') not in ('http', 'https') or not f.get('url') for f in formats):
+            return None
+        if len(formats) > 1 and get_tool('ffmpeg') is None:
+            return None
+        
+        output_path = ytdl.prepare_filename(info)
+        base_path = os.path.splitext(output_path)[0]
+        print(f"  多连接下载（{self.ranged_fetcher.connections}个连接）: {os.path.basename(output_path)}")
+        files = []
+        try:
+            for f in formats:
+                path = output_path if len(formats) == 1 else f"{base_path}.f{f['format_id']}.{f['ext']}"
+                
+                def on_progress(done, total, path=path, started=time.monotonic()):
+                    speed = done / max(time.monotonic() - started, 1e-6)
+                    self.ytdl_progress_hook({'status': 'downloading', 'filename': path, 'downloaded_bytes': done,
+                                             'total_bytes': total, 'speed': speed})
+                
+                self.ranged_fetcher.fetch(f['url'], path, headers=f.get('http_headers'), on_progress=on_progress)
+                self.ytdl_progress_hook({'status': 'finished', 'filename': path})
+                files.append((f, path))
+        except Exception as e:
+            print(f"\n  多连接下载失败，交给yt-dlp下载: {e}")
+            for _, path in files:
+                self.remove_file(path)
+            return None
+        
+        if len(files) == 1:
+            return output_path
+        video = next((path for f, path in files if f.get('vcodec') != 'none'), files[0][1])
+        audio = next((path for f, path in files if path != video), files[1][1])
+        pair = {'base_name': os.path.basename(base_path), 'video': video, 'audio': audio, 'output': output_path}
+        return output_path if self.merge_pair(pair) else False
+    
+    def get_item_key(self, video_url, video_info=None):
+        """下载状态索引中的键：BV号 + 分P号"""
+        video_info = video_info or {}
+        bvid = video_info.get('bvid') or self.extract_bvid_from_url(video_url)
+        page = video_info.get('page')
+        if page is None:
+            page_match = re.search(r'[?&]p=(\d+)', video_url)
+            page = int(page_match.group(1)) if page_match else None
+        aid = video_info.get('aid')
+        if not bvid and not aid:
+            aid_match = re.search(r'/av(\d+)', video_url)
+            aid = aid_match.group(1) if aid_match else None
+        if not bvid and not aid:
+            return f"bilibili:{video_url}"
+        return bilibili_key(bvid, page, aid)
+
+    def find_downloaded_file(self, video_url, title, output_path):
+        """按文件名扫描输出目录查找已下载的文件（较慢，只在建立索引时使用）"""
+        is_downloaded, existing_file = self.check_video_downloaded(video_url, output_path, video_title=title)
+        return existing_file if is_downloaded else None
+
+    def open_state(self, output_path):
+        """打开输出目录中的下载状态索引，失败时返回None（退回文件名扫描）"""
+        try:
+            return DownloadState(output_path)
+        except Exception as e:
+            print(f"  无法打开下载状态索引，将扫描目录判断是否已下载: {e}")
+            return None
+
+    def build_items(self, video_urls, video_info_list):
+        """生成 (索引键, (URL, 标题)) 列表"""
+        items = []
+        for i, video_url in enumerate(video_urls, 1):
+            video_info = video_info_list[i-1] if i <= len(video_info_list) else {}
+            items.append((self.get_item_key(video_url, video_info), (video_url, video_info.get('title', ''))))
+        return items
+
+    def reconcile_state(self, state, items, output_path, complete=True):
+        """按磁盘上的文件重建下载状态索引"""
+        print("  正在核对输出目录中的文件，建立下载状态索引...")
+        found, removed = state.reconcile(
+            lambda item: self.find_downloaded_file(item[0], item[1], output_path), items, mark=complete)
+        print(f"  索引完成: {found}/{len(items)} 个已下载，删除 {removed} 条失效记录")
+        if not complete:
+            print("  视频列表不完整，索引未标记为已核对，下次运行仍会按文件名核对")
+
+    def rebuild_state(self, video_urls, video_info_list, output_path, complete=True):
+        """--reconcile：重建下载状态索引；列表不完整时只记录找到的文件，不标记为已核对"""
+        self.remember_page_counts(video_info_list)
+        state = self.open_state(output_path)
+        if state is not None:
+            self.reconcile_state(state, self.build_items(video_urls, video_info_list), output_path, complete)
+            state.close()
+
+    def download_one_video(self, i, total, video_url, title, output_path, state=None, key=None,
+                           verify_on_disk=False):
+        """下载列表中的一个视频（已存在则跳过），返回是否成功
+        
+        verify_on_disk: 索引中没有记录时再按文件名扫描目录，找到的文件补记到索引（索引尚未和磁盘核对过时使用）
+        """
+        label = f"[{i}/{total}] {title}" if title else f"[{i}/{total}] 处理视频"
+        print(f"\n{label}\n  URL: {video_url}")
+
+        # 检查是否已经下载：有索引时只查索引（一次查询 + 一次stat），否则扫描目录
+        if state is not None:
+            existing_file = state.lookup(key)
+            if existing_file is None and verify_on_disk:
+                existing_file = self.find_downloaded_file(video_url, title, output_path)
+                if existing_file:
+                    state.record(key, existing_file)
+        else:
+            existing_file = self.find_downloaded_file(video_url, title, output_path)
+        if existing_file:
+            print(f"  [跳过] {label} 文件已存在: {os.path.basename(existing_file)}")
+            return True
+
+        # 限制开始下载的速率，避免请求过快（空闲时不需要等待）
+        self.download_limiter.acquire()
+        result = self.download_video_with_ytdlp(video_url, output_path, index=i)
+        self.invalidate_directory_index(output_path)
+        if result:
+            print(f"  [成功] {label} 下载成功")
+            if state is not None:
+                filepath = result if isinstance(result, str) else self.find_downloaded_file(video_url, title, output_path)
+                if filepath:
+                    state.record(key, filepath)
+            return True
+        print(f"  [失败] {label} 下载失败")
+        return False
+
+    def download_videos(self, video_urls, video_info_list, output_path, max_workers=None, complete=True):
+        """用有限大小的线程池下载视频列表，返回 (成功数, 失败数)；complete 为False表示列表不完整"""
+        entries = []
+        for i, video_url in enumerate(video_urls, 1):
+            video_info = video_info_list[i-1] if i <= len(video_info_list) else {}
+            entries.append(dict(video_info, url=video_url))
+        self.remember_page_counts(entries)
+        return self.download_entries(entries, output_path, total=len(entries), max_workers=max_workers,
+                                     complete=complete)
+    
+    def download_entries(self, entries, output_path, total=None, max_workers=None, complete=True):
+        """边获取边下载：entries 为视频信息字典（含url、title等）的可迭代对象，可以是 iter_video_entries 生成器
+        
+        每得到一个条目就提交到有限大小的线程池下载，不必等整个列表获取完成；返回 (成功数, 失败数)。
+        列表不完整（complete 为False，或获取列表时出错）时不把下载状态索引标记为已核对
+        """
+        max_workers = max_workers or self.download_workers
+        total = total or '?'
+        success_count = 0
+        fail_count = 0
+
+        # 索引尚未和磁盘核对过时，逐个视频在索引中找不到再按文件名核对（效果同 --reconcile）；之后只查索引
+        state = self.open_state(output_path)
+        verify_on_disk = state is not None and not state.reconciled
+
+        if max_workers > 1:
+            print(f"  最多同时下载 {max_workers} 个视频")
+
+        # 正在下载的视频的开始时间，用于判断目录中的视频/音频文件对是否已可以合并
+        active = {}
+        active_lock = Lock()
+        
+        def run_download(i, video_url, title, key):
+            with active_lock:
+                active[i] = time.time()
+            try:
+                return self.download_one_video(i, total, video_url, title, output_path, state, key, verify_on_disk)
+            finally:
+                with active_lock:
+                    active.pop(i, None)
+        
+        def collect(futures):
+            """统计已完成的下载，并把已下载完的视频/音频文件对交给后台合并，返回 (成功数, 失败数)"""
+            succeeded = failed = 0
+            for future in futures:
+                try:
+                    ok = future.result()
+                except Exception as e:
+                    print(f"  下载出错: {e}")
+                    ok = False
+                if ok:
+                    succeeded += 1
+                else:
+                    failed += 1
+            
+            # 只合并仍在下载的视频开始之前生成的文件，不和正在运行的yt-dlp抢同一组文件
+            if futures:
+                with active_lock:
+                    created_before = min(active.values(), default=time.time())
+                try:
+                    self.schedule_merges(output_path, created_before=created_before)
+                except Exception as e:
+                    print(f"  提交合并任务失败: {e}")
+            return succeeded, failed
+        
+        enumerated = True
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
+            try:
+                for i, video_info in enumerate(entries, 1):
+                    video_url = video_info['url']
+                    key = self.get_item_key(video_url, video_info)
+                    pending.add(executor.submit(run_download, i, video_url, video_info.get('title', ''), key))
+                    
+                    # 获取列表的同时处理已完成的下载
+                    done = {future for future in pending if future.done()}
+                    pending -= done
+                    succeeded, failed = collect(done)
+                    success_count += succeeded
+                    fail_count += failed
+            except Exception as e:
+                print(f"  获取视频列表出错，列表不完整，只下载已获取的视频: {e}")
+                enumerated = False
+            
+            for future in as_completed(pending):
+                succeeded, failed = collect([future])
+                success_count += succeeded
+                fail_count += failed
+        
+        if state is not None:
+            if verify_on_disk and enumerated and complete:
+                state.mark_reconciled()
+            state.close()
+        return success_count, fail_count
+    
+    def finish_download(self, output_path, success_count, fail_count):
+        """合并分开的视频和音频文件，并输出统计"""
+        print(f"\n[5/5] 检查并合并分开的视频和音频文件...")
+        self.merge_video_audio_files(output_path)
+        
+        print(f"\n{'='*60}")
+        print(f"下载完成!")
+        print(f"成功: {success_count}, 失败: {fail_count}")
+        print(f"输出目录: {output_path}")
+        if self.cache is not None:
+            print(f"元数据{self.cache.stats()}")
+        print(f"{'='*60}")
+    
+    def download_collection(self, collection_url, output_dir="downloads", reconcile=False):
+        """主函数：下载合集
+
+        reconcile: 只按磁盘上的文件重建下载状态索引，不下载
+        """
         print(f"开始处理URL: {collection_url}")
         print("=" * 60)
         
@@ -1222,42 +1631,12 @@ class BilibiliCollectionDownloader:
                     print(f"\n[4/5] 开始下载视频到: {output_path}")
                     print("=" * 60)
                     
-                    success_count = 0
-                    fail_count = 0
-                    
-                    for i, video_url in enumerate(video_urls, 1):
-                        video_info = video_info_list[i-1]
-                        title = video_info.get('title', '')
-                        
-                        print(f"\n[{i}/{len(video_urls)}] {title}")
-                        print(f"  URL: {video_url}")
-                        
-                        # 检查是否已经下载
-                        is_downloaded, existing_file = self.check_video_downloaded(video_url, output_path, video_title=title)
-                        if is_downloaded:
-                            print(f"  [跳过] 文件已存在: {os.path.basename(existing_file)}")
-                            success_count += 1
-                            continue
-                        
-                        if self.download_video_with_ytdlp(video_url, output_path, index=i):
-                            print(f"  [成功] 下载成功")
-                            success_count += 1
-                        else:
-                            print(f"  [失败] 下载失败")
-                            fail_count += 1
-                        
-                        # 避免请求过快
-                        time.sleep(2)
-                    
-                    # 合并分开的视频和音频文件
-                    print(f"\n[5/5] 检查并合并分开的视频和音频文件...")
-                    self.merge_video_audio_files(output_path)
-                    
-                    print(f"\n{'='*60}")
-                    print(f"下载完成!")
-                    print(f"成功: {success_count}, 失败: {fail_count}")
-                    print(f"输出目录: {output_path}")
-                    print(f"{'='*60}")
+                    if reconcile:
+                        self.rebuild_state(video_urls, video_info_list, output_path)
+                        return
+
+                    success_count, fail_count = self.download_videos(video_urls, video_info_list, output_path)
+                    self.finish_download(output_path, success_count, fail_count)
                     return
                 else:
                     print("  提示: 该视频可能不属于任何合集，或需要登录才能查看")
@@ -1284,17 +1663,35 @@ class BilibiliCollectionDownloader:
         
         # 3. 获取视频URL列表
         is_single_video = bvid and not self.extract_collection_id(original_url)
+        safe_dir_name = f"bilibili_collection_{collection_id or 'unknown'}"
+        output_path = os.path.join(output_dir, safe_dir_name)
+        
+        # 边获取列表边下载：第一页的视频展开后立即开始下载，不等整个合集列表获取完
+        if collection_id and self.stream_listing and not reconcile:
+            print("\n[3/5] 获取视频列表（边获取边下载）...")
+            entries = self.iter_video_entries(collection_id, mid)
+            first = next(entries, None)
+            if first is not None:
+                os.makedirs(output_path, exist_ok=True)
+                print(f"\n[4/5] 开始下载视频到: {output_path}")
+                print("=" * 60)
+                success_count, fail_count = self.download_entries(chain([first], entries), output_path)
+                self.finish_download(output_path, success_count, fail_count)
+                return
+        
         print("\n[3/5] 获取视频列表...")
         video_urls = []
         video_info_list = []
+        listing_complete = True
         
-        # 方法1: 尝试从API获取
-        if collection_id:
+        # 方法1: 尝试从API获取（边获取边下载时API已经没有返回结果，不再重复请求）
+        if collection_id and (not self.stream_listing or reconcile):
             print("  尝试通过API获取视频列表...")
-            api_urls, api_info = self.extract_video_urls_from_api(collection_id, mid)
+            api_urls, api_info, api_complete = self.extract_video_urls_from_api(collection_id, mid)
             if api_urls:
                 video_urls = api_urls
                 video_info_list = api_info
+                listing_complete = api_complete
                 print(f"  从API获取到 {len(video_urls)} 个视频")
         
         # 方法2: 从HTML中提取（仅当有HTML内容时）
@@ -1323,69 +1720,64 @@ class BilibiliCollectionDownloader:
                 print(f"  {i}. {url}")
         
         # 4. 创建输出目录
-        safe_dir_name = f"bilibili_collection_{collection_id or 'unknown'}"
-        output_path = os.path.join(output_dir, safe_dir_name)
         os.makedirs(output_path, exist_ok=True)
         
         # 5. 下载视频
         print(f"\n[4/5] 开始下载视频到: {output_path}")
         print("=" * 60)
-        
-        success_count = 0
-        fail_count = 0
-        
-        for i, video_url in enumerate(video_urls, 1):
-            video_info = video_info_list[i-1] if i <= len(video_info_list) else {}
-            title = video_info.get('title', '')
-            
-            if title:
-                print(f"\n[{i}/{len(video_urls)}] {title}")
-            else:
-                print(f"\n[{i}/{len(video_urls)}] 处理视频")
-            print(f"  URL: {video_url}")
-            
-            # 检查是否已经下载
-            is_downloaded, existing_file = self.check_video_downloaded(video_url, output_path, video_title=title)
-            if is_downloaded:
-                print(f"  [跳过] 文件已存在: {os.path.basename(existing_file)}")
-                success_count += 1
-                continue
-            
-            if self.download_video_with_ytdlp(video_url, output_path, index=i):
-                print(f"  [成功] 下载成功")
-                success_count += 1
-            else:
-                print(f"  [失败] 下载失败")
-                fail_count += 1
-            
-            # 避免请求过快
-            time.sleep(2)
+
+        if reconcile:
+            self.rebuild_state(video_urls, video_info_list, output_path, listing_complete)
+            return
+
+        success_count, fail_count = self.download_videos(video_urls, video_info_list, output_path,
+                                                         complete=listing_complete)
         
         # 6. 合并分开的视频和音频文件
-        print(f"\n[5/5] 检查并合并分开的视频和音频文件...")
-        self.merge_video_audio_files(output_path)
-        
-        print(f"\n{'='*60}")
-        print(f"下载完成!")
-        print(f"成功: {success_count}, 失败: {fail_count}")
-        print(f"输出目录: {output_path}")
-        print(f"{'='*60}")
+        self.finish_download(output_path, success_count, fail_count)
 
 
 def main():
     import sys
     
-    if len(sys.argv) < 2:
-        print("使用方法: python download_bilibili_collection.py <bilibili合集URL> [输出目录]")
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    
+    if len(args) < 1:
+        print("使用方法: python download_bilibili_collection.py <bilibili合集URL> [输出目录] [--in-process] [--workers=N] [--no-cache] [--reconcile] [--list-first] [--async] [--connections=N]")
         print("\n示例:")
         print("  python download_bilibili_collection.py https://space.bilibili.com/4520265/lists/3308869?type=season")
+        print("\n选项:")
+        print("  --in-process  在当前进程内调用yt-dlp（复用同一个YoutubeDL实例），不再为每个视频启动新进程")
+        print("  --workers=N   同时下载N个视频（默认1）")
+        print("  --no-cache    不使用元数据缓存，所有接口都重新请求")
+        print("  --reconcile   按输出目录中的文件重建下载状态索引（不下载）")
+        print("  --list-first  先获取并显示完整的视频列表再开始下载（默认边获取边下载）")
+        print("  --async       API请求使用异步HTTP引擎（需安装httpx或aiohttp）")
+        print("  --connections=N  每个视频/音频文件用N个连接按区间并行下载（需配合 --in-process）")
         sys.exit(1)
     
-    url = sys.argv[1]
-    output_dir = sys.argv[2] if len(sys.argv) > 2 else "downloads"
+    url = args[0]
+    output_dir = args[1] if len(args) > 1 else "downloads"
+    engine = 'library' if '--in-process' in sys.argv else 'subprocess'
+    use_cache = '--no-cache' not in sys.argv
+    reconcile = '--reconcile' in sys.argv
+    stream_listing = '--list-first' not in sys.argv
+    http_engine = 'async' if '--async' in sys.argv else 'threads'
+    download_workers = 1
+    range_connections = 1
+    for arg in sys.argv[1:]:
+        if arg.startswith('--workers='):
+            download_workers = int(arg.split('=', 1)[1])
+        elif arg.startswith('--connections='):
+            range_connections = int(arg.split('=', 1)[1])
     
-    downloader = BilibiliCollectionDownloader()
-    downloader.download_collection(url, output_dir)
+    downloader = BilibiliCollectionDownloader(engine=engine, download_workers=download_workers, use_cache=use_cache,
+                                              stream_listing=stream_listing, http_engine=http_engine,
+                                              range_connections=range_connections)
+    try:
+        downloader.download_collection(url, output_dir, reconcile=reconcile)
+    finally:
+        downloader.close()
 
 
 if __name__ == "__main__":
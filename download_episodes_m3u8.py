@@ -15,20 +15,500 @@ import requests
 import os
 import json
 import time
+import hashlib
+import heapq
 import random
 import subprocess
+import shutil
+import socket
+import asyncio
+from collections import deque
 from urllib.parse import urlparse, parse_qs, urljoin
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed, wait, FIRST_COMPLETED
+from threading import Lock, Condition, Semaphore
+
+from ts_remux import TSRemuxer, remux_ts_files
+from tool_registry import get_tool
+from rate_limit import HostRateLimiter, RateLimitedSession
+from metadata_cache import MetadataCache, cntv_video_info_ok, non_empty, HOUR, DAY
+from download_state import DownloadState, cctv_key
+from async_http import AsyncHTTPClient, AsyncHTTPSession, AsyncExecutor, AsyncWaiters
+from hls_playlist import parse_media_playlist, parse_attributes, resolve_url
+from ranged_fetch import RangedFetcher
+
+
+class ByteBudget:
+    """全局在途字节预算：限制所有下载线程同时持有在内存中的片段数据总量"""
+    
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.cond = Condition()
+        self.async_waiters = AsyncWaiters()
+        
+    def acquire(self, size, can_bypass=None):
+        """申请size字节，超出预算时阻塞；can_bypass()返回True时允许越过预算（避免队首片段死锁）"""
+        if not self.limit:
+            return
+        with self.cond:
+            # 预算为空时总是放行，保证单个超大块也能继续
+            while self.used > 0 and self.used + size > self.limit:
+                if can_bypass is not None and can_bypass():
+                    break
+                self.cond.wait(0.5)
+            self.used += size
+    
+    def try_acquire(self, size, can_bypass=None):
+        """不阻塞的 acquire：超出预算时返回False"""
+        if not self.limit:
+            return True
+        with self.cond:
+            if self.used > 0 and self.used + size > self.limit:
+                if can_bypass is None or not can_bypass():
+                    return False
+            self.used += size
+            return True
+    
+    async def acquire_async(self, size, can_bypass=None):
+        """acquire 的协程版本（异步引擎使用），等待时不阻塞事件循环"""
+        await self.async_waiters.wait_for(lambda: self.try_acquire(size, can_bypass),
+                                          0.5 if can_bypass is not None else None)
+    
+    def release(self, size):
+        """归还size字节"""
+        if not self.limit or size <= 0:
+            return
+        with self.cond:
+            self.used = max(0, self.used - size)
+            self.cond.notify_all()
+        # 归还的字节可能够多个片段使用，等待者不多（最多为并发数），全部唤醒
+        self.async_waiters.notify_all()
+    
+    def wake(self):
+        """唤醒等待中的线程和协程，重新检查放行条件"""
+        with self.cond:
+            self.cond.notify_all()
+        self.async_waiters.notify_all()
+
+
+class BufferPool:
+    """流式组装的片段缓冲区池：写出后的缓冲区留给后续片段复用，不必每个片段重新分配
+    
+    最多保留 max_buffers 个空闲缓冲区；只复用大小在所需大小1~2倍之间的缓冲区，
+    截短这样的bytearray不会重新分配内存
+    """
+    
+    def __init__(self, max_buffers=8):
+        self.max_buffers = max_buffers
+        self.free = []
+        self.lock = Lock()
+    
+    def get(self, size):
+        """返回长度为size的bytearray（内容未清零），没有合适的空闲缓冲区时新分配"""
+        with self.lock:
+            for i, buffer in enumerate(self.free):
+                if size <= len(buffer) < size * 2:
+                    del self.free[i]
+                    del buffer[size:]
+                    return buffer
+        return bytearray(size)
+    
+    def put(self, buffer):
+        """归还已写出的缓冲区；调用方之后不能再使用它"""
+        if not isinstance(buffer, bytearray) or not buffer:
+            return
+        with self.lock:
+            if len(self.free) < self.max_buffers:
+                self.free.append(buffer)
+
+
+class AdaptiveConcurrency:
+    """自适应并发控制（AIMD）
+    
+    所有剧集的片段下载共享同一个并发上限：吞吐量随并发增加而提升时逐步加1，
+    遇到429/5xx或错误率过高时成倍减小，吞吐量不再提升时回退一步。
+    """
+    
+    def __init__(self, initial=8, min_limit=2, max_limit=64):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = max(min_limit, min(initial, max_limit))
+        self.active = 0
+        self.cond = Condition()
+        self.async_waiters = AsyncWaiters()
+        self.last_throughput = 0
+        self.last_decrease = 0
+        # 实测的片段下载总吞吐量（字节/秒，滑动平均），0表示尚未测得
+        self.measured_throughput = 0
+        self._reset_window()
+    
+    def _reset_window(self):
+        self.window_start = time.monotonic()
+        self.window_success = 0
+        self.window_errors = 0
+        self.window_bytes = 0
+    
+    def acquire(self, can_bypass=None):
+        """占用一个并发名额，超出当前上限时阻塞
+        
+        can_bypass()返回True时允许越过上限：流式组装中写出端等待的片段必须能开始下载，
+        否则名额可能全被等待字节预算的后续片段占住，而预算要等该片段写出后才会归还
+        """
+        with self.cond:
+            while self.active >= self.limit:
+                if can_bypass is not None and can_bypass():
+                    break
+                self.cond.wait(0.5 if can_bypass is not None else None)
+            self.active += 1
+    
+    def try_acquire(self, can_bypass=None):
+        """不阻塞的 acquire：已达上限时返回False"""
+        with self.cond:
+            if self.active >= self.limit and (can_bypass is None or not can_bypass()):
+                return False
+            self.active += 1
+            return True
+    
+    async def acquire_async(self, can_bypass=None):
+        """acquire 的协程版本（异步引擎使用），等待时不阻塞事件循环"""
+        await self.async_waiters.wait_for(lambda: self.try_acquire(can_bypass),
+                                          0.5 if can_bypass is not None else None)
+    
+    def wake(self):
+        """唤醒等待中的线程和协程，重新检查放行条件"""
+        with self.cond:
+            self.cond.notify_all()
+        self.async_waiters.notify_all()
+    
+    def release(self):
+        """归还并发名额"""
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+        # 等待的协程可能有上千个，每归还一个名额只唤醒一个
+        self.async_waiters.notify()
+    
+    def record(self, size=0, status=None, error=False):
+        """记录一次请求的结果：下载字节数、HTTP状态码、是否出错"""
+        with self.cond:
+            # 服务端明确要求降速，立即减半
+            if status == 429 or (status is not None and status >= 500):
+                self._decrease(0.5, f"HTTP {status}")
+                return
+            
+            if error:
+                self.window_errors += 1
+            else:
+                self.window_success += 1
+                self.window_bytes += size
+            
+            # 每完成约一轮（当前并发数个请求）评估一次
+            samples = self.window_success + self.window_errors
+            if samples < max(4, self.limit):
+                return
+            
+            elapsed = max(time.monotonic() - self.window_start, 1e-6)
+            throughput = self.window_bytes / elapsed
+            error_rate = self.window_errors / samples
+            if self.window_bytes:
+                self.measured_throughput = (throughput if not self.measured_throughput
+                                            else self.measured_throughput * 0.7 + throughput * 0.3)
+            
+            if error_rate > 0.1:
+                self._decrease(0.7, f"错误率 {error_rate:.0%}")
+                return
+            
+            if throughput >= self.last_throughput * 0.95:
+                # 吞吐量没有下降，继续加性增加
+                if self.limit < self.max_limit:
+                    self.limit += 1
+                    self.cond.notify_all()
+                    self.async_waiters.notify()
+            elif self.limit > self.min_limit:
+                # 增加并发反而变慢，回退一步
+                self.limit -= 1
+            
+            self.last_throughput = throughput
+            self._reset_window()
+    
+    def _decrease(self, factor, reason):
+        now = time.monotonic()
+        # 同一波错误只减一次
+        if now - self.last_decrease < 1:
+            return
+        old_limit = self.limit
+        self.limit = max(self.min_limit, int(self.limit * factor))
+        self.last_decrease = now
+        self.last_throughput = 0
+        self._reset_window()
+        if self.limit != old_limit:
+            print(f"\n    并发调整: {old_limit} -> {self.limit} ({reason})")
+
+
+class SegmentManifest:
+    """分片下载清单：记录剧集的片段URL列表，以及已完成片段的大小和校验和，用于断点续传"""
+    
+    FILENAME = 'manifest.json'
+    
+    def __init__(self, temp_dir, ts_urls, m3u8_url=None):
+        self.path = os.path.join(temp_dir, self.FILENAME)
+        self.m3u8_url = m3u8_url
+        self.segments = list(ts_urls)
+        self.completed = {}
+        self.lock = Lock()
+        self.last_save = 0
+    
+    @staticmethod
+    def segment_key(url):
+        """片段的标识：只比较路径，CDN节点和鉴权参数每次可能不同"""
+        return urlparse(url).path
+    
+    def load(self):
+        """读取已有清单；片段列表与本次一致时沿用其中的完成记录"""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            old_keys = [self.segment_key(url) for url in data.get('segments', [])]
+            new_keys = [self.segment_key(url) for url in self.segments]
+            if old_keys != new_keys:
+                print("    片段列表已变化，重新下载")
+                return False
+            self.completed = {int(index): info for index, info in data.get('completed', {}).items()}
+            return True
+        except Exception as e:
+            print(f"    读取下载清单失败: {e}")
+            return False
+    
+    def save(self):
+        """原子写入清单文件"""
+        with self.lock:
+            data = {
+                'version': 1,
+                'm3u8_url': self.m3u8_url,
+                'segments': self.segments,
+                'completed': {str(index): info for index, info in sorted(self.completed.items())},
+            }
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self.last_save = time.monotonic()
+    
+    def mark_complete(self, index, size, checksum):
+        """记录一个片段下载完成；最多每2秒落盘一次"""
+        with self.lock:
+            self.completed[index] = {'size': size, 'sha256': checksum}
+            need_save = time.monotonic() - self.last_save >= 2
+        if need_save:
+            self.save()
+    
+    def completed_files(self, get_path, verify_checksum=False):
+        """返回清单中记录为已完成、且本地文件仍然有效的片段 {序号: 文件路径}"""
+        valid = {}
+        for index, info in list(self.completed.items()):
+            ts_file = get_path(index)
+            if not os.path.exists(ts_file) or os.path.getsize(ts_file) != info.get('size'):
+                del self.completed[index]
+                continue
+            if verify_checksum:
+                sha256 = hashlib.sha256()
+                with open(ts_file, 'rb') as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b''):
+                        sha256.update(block)
+                if sha256.hexdigest() != info.get('sha256'):
+                    del self.completed[index]
+                    continue
+            valid[index] = ts_file
+        return valid
+
+
+class TempDirLock:
+    """剧集临时目录的占用标记
+    
+    防止多个进程同时下载同一个剧集，也用于判断临时目录是否已成为无人使用的遗留目录。
+    同一台机器上通过进程号判断占用者是否存活；其他机器（共享目录）的标记超过stale_after秒视为失效。
+    """
+    
+    FILENAME = 'owner.json'
+    
+    def __init__(self, temp_dir, stale_after=24 * 3600):
+        self.temp_dir = temp_dir
+        self.path = os.path.join(temp_dir, self.FILENAME)
+        self.stale_after = stale_after
+    
+    @staticmethod
+    def pid_alive(pid):
+        if os.name == 'nt':
+            # Windows上os.kill(pid, 0)会发送CTRL_C_EVENT，无法用来探测进程，保守地视为存活
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+    
+    def is_active(self):
+        """临时目录是否正被某个仍在运行的进程占用"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                owner = json.load(f)
+            age = time.time() - os.path.getmtime(self.path)
+        except (OSError, ValueError):
+            return False
+        if age > self.stale_after:
+            return False
+        if owner.get('host') == socket.gethostname():
+            return self.pid_alive(owner.get('pid', 0))
+        return True
+    
+    def is_mine(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                owner = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return owner.get('host') == socket.gethostname() and owner.get('pid') == os.getpid()
+    
+    def acquire(self):
+        """占用临时目录；已被其他存活进程占用时返回False"""
+        os.makedirs(self.temp_dir, exist_ok=True)
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self.is_active() and not self.is_mine():
+                    return False
+                # 占用者已退出，接管该目录（保留其中的片段用于续传）
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'pid': os.getpid(), 'host': socket.gethostname(), 'started': time.time()}, f)
+            return True
+        return False
+    
+    def release(self):
+        """释放占用；临时目录为空时一并删除"""
+        try:
+            if self.is_mine():
+                os.remove(self.path)
+            os.rmdir(self.temp_dir)
+            os.rmdir(os.path.dirname(self.temp_dir))
+        except OSError:
+            pass  # 目录可能不为空，忽略错误
+
 
 class CCTVDownloader:
-    def __init__(self):
+    # 元数据缓存有效期：剧集列表会更新，较短；专辑信息和剧集页面基本不变，较长
+    LISTING_TTL = 6 * HOUR
+    ALBUM_TTL = 7 * DAY
+    PAGE_TTL = 7 * DAY
+    # guid -> m3u8链接（视频信息接口）；链接失效导致下载失败时会立即作废缓存并重新获取
+    VIDEO_INFO_TTL = 6 * HOUR
+    # 播放列表或片段返回这些状态码时，认为m3u8链接已失效（签名过期等）
+    LINK_FAILURE_STATUSES = (403, 404, 410)
+
+    def __init__(self, assembly_mode='temp', max_inflight_bytes=256 * 1024 * 1024, chunk_size=256 * 1024,
+                 min_segment_workers=2, max_segment_workers=64, verify_resume_checksums=False,
+                 segment_retries=5, retry_backoff=0.5, retry_backoff_max=16, failure_budget=None,
+                 host_rates=None, use_cache=True, cache_path=None, http_engine='threads', async_connections=100,
+                 album_workers=4, rendition='first', decrypt_workers=None, range_connections=4):
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
             'Referer': 'https://tv.cctv.com/'
         }
-        self.session = requests.Session()
+        # 接口请求（api.cntv.cn、vdn.apps.cntv.cn）在会话层按域名限速，被限流（412/429）时自动降速重试；
+        # 片段所在的CDN域名不在限速配置中，不受影响
+        limiter = HostRateLimiter(host_rates) if host_rates else None
+        self.session = RateLimitedSession(limiter)
+        # HTTP引擎：
+        #   'threads' - 每个并发片段占用一个下载线程（默认）
+        #   'async'   - 所有请求在一个事件循环中以协程执行（httpx/aiohttp），片段并发数不受线程数限制；
+        #               async_connections 为连接池大小。未安装httpx或aiohttp时退回 'threads'
+        self.http_client = None
+        if http_engine == 'async':
+            try:
+                self.http_client = AsyncHTTPClient(self.headers, max_connections=async_connections)
+                self.session = AsyncHTTPSession(self.http_client, limiter)
+                print(f"使用异步HTTP引擎: {self.http_client.backend}{' (HTTP/2)' if self.http_client.http2 else ''}")
+            except ImportError:
+                print("未安装httpx或aiohttp，使用线程模式下载（pip install \"httpx[http2]\"）")
         self.session.headers.update(self.headers)
+        # 并发获取专辑剧集列表各页的线程数
+        self.album_workers = max(1, album_workers)
+        # 主播放列表中码率的选择：
+        #   'first' - 按播放列表顺序使用第一个可用的码率（默认）
+        #   'max' / 'min' - 最高 / 最低码率
+        #   'auto' - 按实测下载吞吐量选择能实时下载的最高码率（尚未测得时用最高码率）
+        #   数字（kbps，如 2000）或 '720p' - 不超过目标码率/分辨率的最高一档，都超过时用最低一档
+        self.rendition = rendition
+        # AES-128加密片段的解密：线程模式在下载线程中边收边解密；
+        # 异步引擎把解密交给独立的解密线程池（首次使用时创建），不阻塞事件循环
+        self.decrypt_workers = decrypt_workers or os.cpu_count() or 2
+        self.decrypt_pool = None
+        self.decrypt_pool_lock = Lock()
+        # 片段数少于当前并发数时（少量很大的片段），单个片段按Range区间多连接并行下载；
+        # 只用于线程模式的临时目录组装，range_connections<=1 时关闭
+        self.ranged_fetcher = None
+        if range_connections > 1:
+            # 同时按Range下载的片段数少于并发上限，连接池按最大并发数分配
+            self.ranged_fetcher = RangedFetcher(connections=range_connections, headers=self.headers,
+                                                max_files=max_segment_workers)
+        # 片段组装方式：
+        #   'temp'   - 先下载到临时目录 .temp_ts，再统一合并（默认）
+        #   'stream' - 按顺序直接写入输出文件，不产生临时ts文件
+        self.assembly_mode = assembly_mode
+        # 片段按chunk_size分块流式读取；流式组装模式下，已下载但尚未写出的片段数据
+        # 受所有下载线程共享的在途字节预算限制（临时目录模式每块立即落盘，不需要预算）
+        self.chunk_size = chunk_size
+        self.inflight_budget = ByteBudget(max_inflight_bytes)
+        # 写出后的片段缓冲区复用于后续片段
+        self.buffer_pool = BufferPool()
+        # 片段下载并发数由所有剧集共享的自适应控制器动态调整
+        self.concurrency = AdaptiveConcurrency(initial=8,
+                                               min_limit=min_segment_workers,
+                                               max_limit=max_segment_workers)
+        # 断点续传时是否重新计算已下载片段的sha256（默认只校验文件大小）
+        self.verify_resume_checksums = verify_resume_checksums
+        # 片段重试：每个片段最多重试segment_retries次，等待时间按指数退避并加随机抖动；
+        # failure_budget为每个剧集允许的重试总次数（None表示按片段数的5%计算，至少10次）
+        self.segment_retries = segment_retries
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.failure_budget = failure_budget
+        # 磁盘元数据缓存（专辑信息、剧集列表、剧集页面HTML），与Bilibili下载器共用同一个缓存文件
+        self.cache = None
+        if use_cache:
+            try:
+                self.cache = MetadataCache(cache_path)
+            except Exception as e:
+                print(f"  无法打开元数据缓存，将不使用缓存: {e}")
+    
+    def cached_get(self, url, params=None, ttl=HOUR, validate=non_empty, cache_key=None):
+        """GET请求，启用缓存时优先使用磁盘缓存"""
+        if self.cache is None:
+            return self.session.get(url, params=params, timeout=30)
+        return self.cache.get(self.session, url, params=params, ttl=ttl, validate=validate, cache_key=cache_key)
+    
+    @staticmethod
+    def video_info_cache_key(guid):
+        """视频信息接口的缓存键：参数中带时间戳和随机数，按guid保存"""
+        return f"https://vdn.apps.cntv.cn/api/getHttpVideoInfo.do?pid={guid}"
+    
+    def invalidate_video_info(self, guid):
+        """作废guid对应的视频信息缓存（缓存的m3u8链接可能已过期）"""
+        if self.cache is None:
+            return
+        try:
+            self.cache.invalidate(cache_key=self.video_info_cache_key(guid))
+        except Exception as e:
+            print(f"  作废元数据缓存失败: {e}")
     
     def extract_itemid_from_url(self, url):
         """从URL中提取视频ID (itemid1)"""
@@ -60,10 +540,18 @@ class CCTVDownloader:
             return match.group(1)
         return None
     
+    def extract_guid_from_episode(self, episode):
+        """从剧集列表条目中提取guid（32位十六进制），没有时返回None，需要再从剧集页面提取"""
+        for field in ('guid', 'videoId', 'video_id', 'pid', 'vid'):
+            value = episode.get(field)
+            if isinstance(value, str) and re.fullmatch(r'[0-9a-fA-F]{32}', value):
+                return value
+        return None
+    
     def get_page_html(self, url):
         """获取页面HTML"""
         try:
-            response = self.session.get(url, timeout=30)
+            response = self.cached_get(url, ttl=self.PAGE_TTL)
             response.raise_for_status()
             return response.text
         except Exception as e:
@@ -76,7 +564,7 @@ class CCTVDownloader:
         
         try:
             # 使用JSONP方式调用
-            response = self.session.get(url, params={'cb': 'callback'}, timeout=30)
+            response = self.cached_get(url, params={'cb': 'callback'}, ttl=self.ALBUM_TTL)
             response.raise_for_status()
             
             # 解析JSONP响应
@@ -105,7 +593,7 @@ class CCTVDownloader:
         url = f"https://api.cntv.cn/NewVideo/getVideoStreamByAlbumId?id={album_id}&mode=1&sort=asc&n=100&serviceId=tvcctv{order_param}"
         
         try:
-            response = self.session.get(url, params={'cb': 'callback1'}, timeout=30)
+            response = self.cached_get(url, params={'cb': 'callback1'}, ttl=self.LISTING_TTL)
             response.raise_for_status()
             
             content = response.text
@@ -122,6 +610,96 @@ class CCTVDownloader:
             print(f"获取剧集列表失败: {e}")
             return None
     
+    def fetch_episode_page(self, album_id, page, page_size=100):
+        """获取专辑剧集列表的一页（按集数升序），返回解析后的JSON"""
+        url = "https://api.cntv.cn/NewVideo/getVideoStreamByAlbumId"
+        params = {
+            'id': album_id,
+            'mode': 1,
+            'sort': 'asc',
+            'p': page,
+            'n': page_size,
+            'serviceId': 'tvcctv',
+            'cb': 'callback1',
+        }
+        response = self.cached_get(url, params=params, ttl=self.LISTING_TTL)
+        response.raise_for_status()
+        
+        content = response.text
+        # 移除JSONP包装
+        json_str = re.search(r'callback1\((.*)\);?\s*$', content, re.DOTALL)
+        return json.loads(json_str.group(1) if json_str else content)
+    
+    @staticmethod
+    def get_episode_id(episode):
+        """剧集的唯一标识：guid，其次id，最后用页面URL"""
+        return episode.get('guid') or episode.get('id') or episode.get('url')
+    
+    def iter_album_episodes(self, album_id, page_size=100, workers=None):
+        """按集数顺序逐个生成专辑的所有剧集（不受单次请求100集的限制）
+        
+        第1页返回总数后，其余页并发获取并按页码顺序生成；按剧集ID去重。
+        不知道总数时逐页获取，直到某页不足 page_size 个或没有新剧集。
+        第1页之后的某一页获取失败时抛出IOError，调用方据此知道列表不完整
+        """
+        workers = workers or self.album_workers
+        seen = set()
+        
+        def new_episodes(data):
+            episodes = []
+            for episode in (data.get('data') or {}).get('list') or []:
+                episode_id = self.get_episode_id(episode)
+                if episode_id in seen:
+                    continue
+                seen.add(episode_id)
+                episodes.append(episode)
+            return episodes
+        
+        try:
+            first = self.fetch_episode_page(album_id, 1, page_size)
+        except Exception as e:
+            print(f"获取剧集列表失败: {e}")
+            return
+        page_items = (first.get('data') or {}).get('list') or []
+        yield from new_episodes(first)
+        if len(page_items) < page_size:
+            return
+        
+        total = int((first.get('data') or {}).get('total') or 0)
+        if total > page_size:
+            # 总数已知：其余页并发获取，按顺序生成
+            page_count = (total + page_size - 1) // page_size
+            print(f"  专辑共 {total} 集、{page_count} 页，其余 {page_count - 1} 页并发获取")
+            executor = ThreadPoolExecutor(max_workers=workers)
+            try:
+                futures = [(page, executor.submit(self.fetch_episode_page, album_id, page, page_size))
+                           for page in range(2, page_count + 1)]
+                for page, future in futures:
+                    try:
+                        data = future.result()
+                    except Exception as e:
+                        raise IOError(f"剧集列表获取不完整（已获取 {len(seen)} 集，第{page}页失败）: {e}")
+                    yield from new_episodes(data)
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+            return
+        
+        if total:
+            return
+        # 不知道总数：逐页获取；接口不支持翻页时下一页没有新剧集，停止
+        page = 2
+        while True:
+            try:
+                data = self.fetch_episode_page(album_id, page, page_size)
+            except Exception as e:
+                raise IOError(f"剧集列表获取不完整（已获取 {len(seen)} 集，第{page}页失败）: {e}")
+            page_items = (data.get('data') or {}).get('list') or []
+            episodes = new_episodes(data)
+            yield from episodes
+            if len(page_items) < page_size or not episodes:
+                return
+            page += 1
+    
     def get_video_info(self, guid):
         """获取视频播放信息，提取m3u8链接"""
         
@@ -152,7 +730,9 @@ class CCTVDownloader:
         }
         
         try:
-            response = self.session.get(api_url, params=params, timeout=30)
+            # 只缓存包含播放链接的响应
+            response = self.cached_get(api_url, params=params, ttl=self.VIDEO_INFO_TTL,
+                                       validate=cntv_video_info_ok, cache_key=self.video_info_cache_key(guid))
             response.raise_for_status()
             data = response.json()
             
@@ -248,59 +828,104 @@ class CCTVDownloader:
             return False
     
     def parse_m3u8(self, m3u8_content, base_url):
-        """解析m3u8内容，获取所有ts片段URL"""
-        ts_urls = []
-        lines = m3u8_content.strip().split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            # 跳过注释和空行
-            if not line or line.startswith('#'):
+        """解析m3u8内容，获取所有片段URL（包括fMP4初始化片段；字节区间等信息见 parse_media_playlist）"""
+        return [segment.uri for segment in parse_media_playlist(m3u8_content, base_url).segments]
+    
+    def load_playlist_keys(self, playlist):
+        """下载播放列表中所有AES-128密钥（同一地址只下载一次），失败时抛出异常"""
+        values = {}
+        for key in playlist.keys:
+            if key.method != 'AES-128':
                 continue
-            # 如果是URL
-            if line.endswith('.m3u8') or line.endswith('.ts'):
-                # 处理相对URL
-                if line.startswith('/'):
-                    # 从base_url提取域名
-                    parsed = urlparse(base_url)
-                    ts_url = f"{parsed.scheme}://{parsed.netloc}{line}"
-                elif line.startswith('http'):
-                    ts_url = line
-                else:
-                    # 相对路径
-                    ts_url = urljoin(base_url, line)
-                ts_urls.append(ts_url)
+            if key.uri not in values:
+                response = self.session.get(key.uri, timeout=30)
+                response.raise_for_status()
+                if len(response.content) != 16:
+                    raise ValueError(f"密钥长度不是16字节: {key.uri}")
+                values[key.uri] = response.content
+            key.value = values[key.uri]
+        return len(values)
+    
+    def parse_variants(self, m3u8_content, base_url):
+        """解析主播放列表中的各个码率（#EXT-X-STREAM-INF），按播放列表顺序返回
+        
+        每项为 {'url', 'bandwidth'(bps), 'width', 'height', 'codecs'}，没有的属性为0或空
+        """
+        variants = []
+        lines = [line.strip() for line in m3u8_content.strip().split('\n')]
+        for i, line in enumerate(lines):
+            if not line.startswith('#EXT-X-STREAM-INF'):
+                continue
+            # 紧跟着的下一行（跳过空行和普通注释）是子m3u8的URL；遇到的是另一个标签说明这一项缺少URL，跳过
+            uri = next((l for l in lines[i + 1:] if l and not (l.startswith('#') and not l.startswith('#EXT'))), None)
+            if not uri or uri.startswith('#'):
+                continue
+            attributes = parse_attributes(line.split(':', 1)[1] if ':' in line else '')
+            resolution = re.match(r'(\d+)x(\d+)', attributes.get('RESOLUTION', ''))
+            variants.append({
+                'url': resolve_url(uri, base_url),
+                'bandwidth': int(attributes.get('BANDWIDTH') or attributes.get('AVERAGE-BANDWIDTH') or 0),
+                'width': int(resolution.group(1)) if resolution else 0,
+                'height': int(resolution.group(2)) if resolution else 0,
+                'codecs': attributes.get('CODECS', ''),
+            })
+        return variants
+    
+    def order_variants(self, variants, rendition=None):
+        """按码率选择方式排序，首选的排在最前，其余作为首选不可用时的备选"""
+        rendition = rendition or self.rendition
+        rank = lambda v: (v['bandwidth'], v['height'])
+        ascending = sorted(variants, key=rank)
+        descending = ascending[::-1]
+        if rendition == 'max':
+            return descending
+        if rendition == 'min':
+            return ascending
+        
+        if rendition == 'auto':
+            throughput = self.concurrency.measured_throughput * 8
+            if not throughput:
+                return descending
+            # 留20%余量，选择能实时下载的最高码率
+            limit, value = rank, (throughput * 0.8, float('inf'))
+        elif isinstance(rendition, str) and re.fullmatch(r'\d+p', rendition):
+            limit, value = (lambda v: v['height']), int(rendition[:-1])
+        elif str(rendition).isdigit():
+            limit, value = (lambda v: v['bandwidth']), int(rendition) * 1000
+        else:
+            # 'first'：保持播放列表中的顺序
+            return list(variants)
         
-        return ts_urls
+        fitting = [v for v in descending if limit(v) <= value]
+        return fitting + [v for v in ascending if v not in fitting]
+    
+    @staticmethod
+    def describe_variant(variant):
+        parts = []
+        if variant['bandwidth']:
+            parts.append(f"{variant['bandwidth'] // 1000} kbps")
+        if variant['height']:
+            parts.append(f"{variant['width']}x{variant['height']}")
+        return ', '.join(parts) or variant['url']
     
-    def get_final_m3u8(self, m3u8_url):
-        """获取最终的m3u8文件（处理主播放列表）"""
+    def get_final_m3u8(self, m3u8_url, rendition=None):
+        """获取最终的m3u8文件（处理主播放列表，按码率选择方式选择子播放列表）"""
         try:
             response = self.session.get(m3u8_url, timeout=30)
             response.raise_for_status()
             content = response.text
             
-            # 如果是主播放列表（包含子m3u8）
-            lines = content.strip().split('\n')
-            for i, line in enumerate(lines):
-                if line.startswith('#EXT-X-STREAM-INF'):
-                    # 下一行应该是子m3u8的URL
-                    if i + 1 < len(lines):
-                        sub_m3u8 = lines[i + 1].strip()
-                        if not sub_m3u8 or sub_m3u8.startswith('#'):
-                            continue
-                        if sub_m3u8.startswith('/'):
-                            parsed = urlparse(m3u8_url)
-                            sub_m3u8_url = f"{parsed.scheme}://{parsed.netloc}{sub_m3u8}"
-                        elif sub_m3u8.startswith('http'):
-                            sub_m3u8_url = sub_m3u8
-                        else:
-                            sub_m3u8_url = urljoin(m3u8_url, sub_m3u8)
-                        
-                        # 递归获取子m3u8
-                        result = self.get_final_m3u8(sub_m3u8_url)
-                        if result[0]:  # 如果成功获取
-                            return result
+            # 如果是主播放列表（包含子m3u8），按选择方式依次尝试
+            variants = self.parse_variants(content, m3u8_url)
+            if len(variants) > 1:
+                print(f"  可选码率: {'; '.join(self.describe_variant(v) for v in variants)}")
+            for variant in self.order_variants(variants, rendition):
+                # 递归获取子m3u8
+                result = self.get_final_m3u8(variant['url'], rendition)
+                if result[0]:  # 如果成功获取
+                    if len(variants) > 1:
+                        print(f"  选择码率: {self.describe_variant(variant)}")
+                    return result
             
             # 如果没有子m3u8，返回当前内容
             return content, m3u8_url
@@ -310,27 +935,21 @@ class CCTVDownloader:
     
     def download_with_ffmpeg(self, m3u8_url, output_path):
         """使用ffmpeg下载并转换为mp4"""
-        try:
-            # 检查ffmpeg是否可用
-            result = subprocess.run(['ffmpeg', '-version'], 
-                                  capture_output=True, 
-                                  timeout=5)
-            if result.returncode != 0:
-                return False
-        except (FileNotFoundError, subprocess.TimeoutExpired):
+        # 检查ffmpeg是否可用（进程内只探测一次）
+        ffmpeg = get_tool('ffmpeg')
+        if ffmpeg is None:
             print("  ffmpeg未安装或无法使用")
             return False
         
         try:
             # 使用ffmpeg下载
-            cmd = [
-                'ffmpeg',
+            cmd = ffmpeg.cmd(
                 '-i', m3u8_url,
                 '-c', 'copy',
                 '-bsf:a', 'aac_adtstoasc',
                 '-y',  # 覆盖已存在的文件
                 output_path
-            ]
+            )
             
             process = subprocess.Popen(
                 cmd,
@@ -351,192 +970,905 @@ class CCTVDownloader:
             print(f"  ffmpeg执行失败: {e}")
             return False
     
-    def download_single_ts(self, ts_url, ts_index, total, temp_dir):
-        """下载单个ts片段"""
+    def get_error_status(self, error):
+        """从requests异常中取出HTTP状态码（没有响应时返回None）"""
+        response = getattr(error, 'response', None)
+        return getattr(response, 'status_code', None)
+    
+    def is_retryable_status(self, status):
+        """网络错误、429和5xx可以重试；其他4xx（如403/404）重试也不会成功"""
+        return status is None or status == 429 or status >= 500
+    
+    def get_retry_delay(self, attempt):
+        """第attempt次重试前的等待时间：指数退避，并在后一半区间内随机抖动"""
+        delay = min(self.retry_backoff_max, self.retry_backoff * (2 ** (attempt - 1)))
+        return delay / 2 + random.uniform(0, delay / 2)
+    
+    def get_failure_budget(self, total):
+        """每个剧集允许的重试总次数"""
+        if self.failure_budget is not None:
+            return self.failure_budget
+        return max(10, total // 20)
+    
+    def record_segment_error(self, status):
+        """把片段下载错误反馈给并发控制器；普通4xx与服务端负载无关，不计入"""
+        if self.is_retryable_status(status):
+            self.concurrency.record(status=status, error=True)
+    
+    def get_segment_path(self, temp_dir, ts_index):
+        """临时目录中片段文件的路径"""
+        return os.path.join(temp_dir, f"segment_{ts_index:05d}.ts")
+    
+    def download_single_ts(self, segment, ts_index, total, temp_dir, manifest=None):
+        """下载单个片段（分块流式写入文件，不在内存中保留整个片段）；加密片段边下载边解密"""
+        ts_file = self.get_segment_path(temp_dir, ts_index)
+        size = 0
+        sha256 = hashlib.sha256()
+        self.concurrency.acquire()
         try:
-            response = self.session.get(ts_url, timeout=30)
-            response.raise_for_status()
+            if self.use_ranged_fetch(segment, total):
+                return self.download_single_ts_ranged(segment, ts_index, ts_file, manifest)
+            decryptor = segment.decryptor()
+            with self.session.get(segment.uri, headers=segment.request_headers(), timeout=30,
+                                  stream=True) as response:
+                response.raise_for_status()
+                self.check_range_response(segment, response)
+                
+                with open(ts_file, 'wb') as f:
+                    # 每块读到后立即写入文件，内存中最多只有一个块，不占用在途字节预算
+                    def write_chunk(chunk):
+                        nonlocal size
+                        if not chunk:
+                            return
+                        f.write(chunk)
+                        sha256.update(chunk)
+                        size += len(chunk)
+                    
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        write_chunk(decryptor.update(chunk) if decryptor is not None and chunk else chunk)
+                    if decryptor is not None:
+                        write_chunk(decryptor.finalize())
             
-            ts_file = os.path.join(temp_dir, f"segment_{ts_index:05d}.ts")
+            self.concurrency.record(size)
+            if manifest is not None:
+                manifest.mark_complete(ts_index, size, sha256.hexdigest())
+            return ts_file, ts_index, None, None
+        except Exception as e:
+            status = self.get_error_status(e)
+            self.record_segment_error(status)
+            if os.path.exists(ts_file):
+                try:
+                    os.remove(ts_file)
+                except:
+                    pass
+            return None, ts_index, str(e), status
+        finally:
+            self.concurrency.release()
+    
+    def use_ranged_fetch(self, segment, total):
+        """片段数少于当前并发数时，片段间的并行用不满带宽，改为单个片段内按Range区间并行
+
+        第一个区间的请求同时用来得到片段大小，不大于一个区间的片段仍然只有一个请求
+        """
+        return (self.ranged_fetcher is not None and total < self.concurrency.limit
+                and segment.byterange is None and not segment.encrypted)
+    
+    def download_single_ts_ranged(self, segment, ts_index, ts_file, manifest=None):
+        """多连接下载单个大片段（由download_single_ts在持有并发名额时调用），小文件或不支持Range时自动单连接"""
+        size = self.ranged_fetcher.fetch(segment.uri, ts_file)
+        self.concurrency.record(size)
+        if manifest is not None:
+            sha256 = hashlib.sha256()
+            with open(ts_file, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    sha256.update(block)
+            manifest.mark_complete(ts_index, size, sha256.hexdigest())
+        return ts_file, ts_index, None, None
+    
+    async def download_single_ts_async(self, segment, ts_index, total, temp_dir, manifest=None):
+        """download_single_ts 的协程版本（异步引擎使用）；解密在解密线程池中进行，不阻塞事件循环"""
+        ts_file = self.get_segment_path(temp_dir, ts_index)
+        size = 0
+        sha256 = hashlib.sha256()
+        await self.concurrency.acquire_async()
+        try:
+            decryptor = segment.decryptor()
             with open(ts_file, 'wb') as f:
-                f.write(response.content)
+                async def write_chunk(chunk):
+                    nonlocal size
+                    if decryptor is not None:
+                        chunk = await self.decrypt(decryptor.update, chunk)
+                    if not chunk:
+                        return
+                    f.write(chunk)
+                    sha256.update(chunk)
+                    size += len(chunk)
+                
+                response = await self.http_client.fetch(segment.uri, headers=segment.request_headers(),
+                                                        on_chunk=write_chunk, chunk_size=self.chunk_size)
+                self.check_range_response(segment, response)
+                if decryptor is not None:
+                    tail = decryptor.finalize()
+                    f.write(tail)
+                    sha256.update(tail)
+                    size += len(tail)
+            
+            self.concurrency.record(size)
+            if manifest is not None:
+                manifest.mark_complete(ts_index, size, sha256.hexdigest())
+            return ts_file, ts_index, None, None
+        except asyncio.CancelledError:
+            self.remove_segment_file(ts_file)
+            raise
+        except Exception as e:
+            status = self.get_error_status(e)
+            self.record_segment_error(status)
+            self.remove_segment_file(ts_file)
+            return None, ts_index, str(e) or type(e).__name__, status
+        finally:
+            self.concurrency.release()
+    
+    @staticmethod
+    def remove_segment_file(ts_file):
+        if os.path.exists(ts_file):
+            try:
+                os.remove(ts_file)
+            except:
+                pass
+    
+    @staticmethod
+    def check_range_response(segment, response):
+        """字节区间片段要求服务器返回206，返回整个文件时报错（不重试）"""
+        if segment.byterange is not None and response.status_code != 206:
+            raise requests.HTTPError(f"服务器不支持Range请求（HTTP {response.status_code}）: {segment.uri}",
+                                     response=response)
+    
+    async def decrypt(self, fn, data):
+        """在解密线程池中执行解密，与其他片段的下载并行"""
+        if self.decrypt_pool is None:
+            with self.decrypt_pool_lock:
+                if self.decrypt_pool is None:
+                    self.decrypt_pool = ThreadPoolExecutor(max_workers=self.decrypt_workers,
+                                                           thread_name_prefix='decrypt')
+        return await asyncio.get_running_loop().run_in_executor(self.decrypt_pool, fn, data)
+    
+    def fetch_ts_bytes(self, segment, can_bypass=None):
+        """分块下载单个片段到内存（流式组装模式使用）；加密片段边下载边解密
+        
+        返回的数据占用的预算由调用方在写出后通过 inflight_budget.release 归还
+        """
+        acquired = 0
+        self.concurrency.acquire(can_bypass)
+        try:
+            decryptor = segment.decryptor()
+            with self.session.get(segment.uri, headers=segment.request_headers(), timeout=30,
+                                  stream=True) as response:
+                response.raise_for_status()
+                self.check_range_response(segment, response)
+                
+                # 已知长度时一次性取得缓冲区（优先复用已写出片段的缓冲区），避免反复扩容
+                content_length = int(response.headers.get('Content-Length') or 0)
+                data = self.buffer_pool.get(content_length)
+                view = memoryview(data)
+                offset = 0
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    if not chunk:
+                        continue
+                    self.inflight_budget.acquire(len(chunk), can_bypass)
+                    acquired += len(chunk)
+                    if decryptor is not None:
+                        # 解密后的数据不超过密文长度，仍然写入预分配的缓冲区
+                        chunk = decryptor.update(chunk)
+                    end = offset + len(chunk)
+                    if end <= content_length:
+                        view[offset:end] = chunk
+                    else:
+                        view.release()
+                        data[offset:] = chunk
+                        view = memoryview(data)
+                    offset = end
+                view.release()
+                del data[offset:]
+                if decryptor is not None:
+                    data.extend(decryptor.finalize())
+            # 解密去掉的填充部分不再占用预算
+            self.inflight_budget.release(acquired - len(data))
+            acquired = len(data)
+            self.concurrency.record(len(data))
+            return data, None, None
+        except Exception as e:
+            status = self.get_error_status(e)
+            self.record_segment_error(status)
+            self.inflight_budget.release(acquired)
+            return None, str(e), status
+        finally:
+            self.concurrency.release()
+    
+    async def fetch_ts_bytes_async(self, segment, can_bypass=None):
+        """fetch_ts_bytes 的协程版本（异步引擎使用）"""
+        acquired = 0
+        data = bytearray()
+        await self.concurrency.acquire_async(can_bypass)
+        try:
+            decryptor = segment.decryptor()
             
-            return ts_file, ts_index, None
+            async def add_chunk(chunk):
+                nonlocal acquired
+                await self.inflight_budget.acquire_async(len(chunk), can_bypass)
+                acquired += len(chunk)
+                data.extend(await self.decrypt(decryptor.update, chunk) if decryptor is not None else chunk)
+            
+            response = await self.http_client.fetch(segment.uri, headers=segment.request_headers(),
+                                                    on_chunk=add_chunk, chunk_size=self.chunk_size)
+            self.check_range_response(segment, response)
+            if decryptor is not None:
+                data.extend(decryptor.finalize())
+            self.inflight_budget.release(acquired - len(data))
+            acquired = len(data)
+            self.concurrency.record(len(data))
+            return data, None, None
+        except asyncio.CancelledError:
+            self.inflight_budget.release(acquired)
+            raise
         except Exception as e:
-            return None, ts_index, str(e)
+            status = self.get_error_status(e)
+            self.record_segment_error(status)
+            self.inflight_budget.release(acquired)
+            return None, str(e) or type(e).__name__, status
+        finally:
+            self.concurrency.release()
     
-    def download_ts_segments(self, ts_urls, temp_dir, max_workers=8):
-        """多线程并行下载所有ts片段"""
+    def fetch_now(self, fetch_ts_bytes, segment, can_bypass=None):
+        """在当前线程中下载一个片段（异步引擎时在事件循环中执行并等待结果）"""
+        if self.http_client is not None:
+            return self.http_client.run(fetch_ts_bytes(segment, can_bypass)).result()
+        return fetch_ts_bytes(segment, can_bypass)
+    
+    def segment_executor(self, max_workers):
+        """片段下载的执行器和下载函数：异步引擎返回 (AsyncExecutor, 协程版本)，否则为线程池"""
+        if self.http_client is not None:
+            return AsyncExecutor(self.http_client), self.download_single_ts_async, self.fetch_ts_bytes_async
+        return ThreadPoolExecutor(max_workers=max_workers), self.download_single_ts, self.fetch_ts_bytes
+    
+    def close(self):
+        """关闭异步引擎和解密线程池（线程模式无需调用）"""
+        if self.http_client is not None:
+            self.http_client.close()
+        if self.decrypt_pool is not None:
+            self.decrypt_pool.shutdown(wait=False)
+    
+    def open_stream_output(self, part_path, fragmented=False):
+        """打开流式组装的输出端：有ffmpeg时通过管道实时封装为mp4，否则用内置转封装器边收边写分片mp4
+        
+        fragmented: 片段本身是fMP4（初始化片段 + 媒体片段），按顺序直接写入文件即可
+        """
+        if fragmented:
+            return open(part_path, 'wb'), None
+        ffmpeg = get_tool('ffmpeg')
+        if ffmpeg is not None:
+            cmd = ffmpeg.cmd(
+                '-f', 'mpegts',
+                '-i', 'pipe:0',
+                '-c', 'copy',
+                '-bsf:a', 'aac_adtstoasc',
+                '-f', 'mp4',
+                '-loglevel', 'error',
+                '-y',
+                part_path
+            )
+            process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE
+            )
+            return process.stdin, process
+        
+        print("    未找到ffmpeg，使用内置转封装器写入...")
+        return TSRemuxer(open(part_path, 'wb')), None
+    
+    def stream_ts_to_mp4(self, segments, output_path, max_workers=None, fragmented=False, failure=None):
+        """流式组装：并行下载片段，经有序重排缓冲区按顺序写入输出，不落临时文件
+        
+        队首片段失败时按退避策略重试；重试用尽或超出失败预算时放弃整个剧集，不输出有缺失的文件。
+        传入字典 failure 时，放弃剧集的片段的HTTP状态码记录在 failure['status']
+        """
+        max_workers = max_workers or self.concurrency.max_limit
+        part_path = output_path + '.part'
+        pending = deque()
+        written_count = 0
+        retry_count = 0
+        failure_budget = self.get_failure_budget(len(segments))
+        # 下一个待写出的片段序号；该片段的下载不受字节预算限制，避免缓冲区占满后队首片段无法完成
+        next_index = 1
+        # 放弃剧集后，仍在等待字节预算或并发名额的下载直接放行，线程池才能结束
+        aborted = False
+        
+        def window():
+            """重排缓冲区大小：最多缓存这么多个已提交但尚未写出的片段，随当前并发上限变化"""
+            return min(max_workers, self.concurrency.limit) * 2
+        
+        sink, process = self.open_stream_output(part_path, fragmented)
+        
+        def write_next():
+            nonlocal written_count, retry_count, next_index
+            ts_index, future = pending[0]
+            result = future.result()
+            attempt = 0
+            while True:
+                data, error, status = result
+                if data is not None:
+                    break
+                attempt += 1
+                if (not self.is_retryable_status(status) or attempt > self.segment_retries
+                        or retry_count >= failure_budget):
+                    if failure is not None:
+                        failure['status'] = status
+                    raise RuntimeError(f"片段 {ts_index} 下载失败，放弃该剧集: {error}")
+                retry_count += 1
+                delay = self.get_retry_delay(attempt)
+                print(f"\n    片段 {ts_index} 下载失败，{delay:.1f}秒后重试 ({attempt}/{self.segment_retries}): {error}")
+                time.sleep(delay)
+                # 写出端正在等待该片段，重试不受字节预算和并发上限限制，并且直接在写出线程中执行：
+                # 下载线程可能都在等待字节预算，排到线程池队尾的重试永远轮不到
+                result = self.fetch_now(fetch_ts_bytes, segments[ts_index - 1], lambda: True)
+            
+            pending.popleft()
+            try:
+                sink.write(data)
+            finally:
+                self.inflight_budget.release(len(data))
+            # 输出端写入时已复制数据，缓冲区可以交给后续片段（异步引擎不知道片段长度，逐块追加，不复用）
+            if self.http_client is None:
+                self.buffer_pool.put(data)
+            written_count += 1
+            next_index = ts_index + 1
+            self.inflight_budget.wake()
+            self.concurrency.wake()
+            print(f"    下载进度: {written_count}/{len(segments)}", end='\r')
+        
+        success = False
+        executor, _, fetch_ts_bytes = self.segment_executor(max_workers)
+        try:
+            with executor:
+                try:
+                    for i, segment in enumerate(segments):
+                        is_head = lambda ts_index=i + 1: aborted or ts_index == next_index
+                        pending.append((i + 1, executor.submit(fetch_ts_bytes, segment, is_head)))
+                        # 缓冲区满时，等待最早的片段完成并写出；
+                        # 提交和写出在同一个线程中，队首片段退避重试期间不会提交新的下载
+                        while len(pending) >= window():
+                            write_next()
+                    while pending:
+                        write_next()
+                finally:
+                    if pending:
+                        # 中途放弃：取消尚未开始的下载，放行等待预算或名额的下载，
+                        # 否则它们等待的预算要在线程池结束后才归还，线程池永远无法结束
+                        aborted = True
+                        for _, future in pending:
+                            future.cancel()
+                        self.inflight_budget.wake()
+                        self.concurrency.wake()
+            success = written_count == len(segments)
+        except BrokenPipeError:
+            print("\n    ffmpeg提前退出")
+        except Exception as e:
+            print(f"\n    流式写入失败: {e}")
+        finally:
+            # 异常中断时归还尚未写出片段占用的预算
+            while pending:
+                _, future = pending.popleft()
+                if future.cancelled():
+                    continue
+                data, _, _ = future.result()
+                if data is not None:
+                    self.inflight_budget.release(len(data))
+            try:
+                sink.close()
+            except Exception:
+                pass
+            if process is not None:
+                stderr = process.stderr.read().decode('utf-8', errors='ignore')
+                process.wait()
+                if process.returncode != 0:
+                    if success:
+                        print(f"\n  ffmpeg错误: {stderr[:200]}")
+                    success = False
+        
+        print(f"\n    共写入 {written_count}/{len(segments)} 个片段", end='')
+        if retry_count > 0:
+            print(f" (重试: {retry_count})")
+        else:
+            print()
+        
+        if success and os.path.exists(part_path):
+            os.replace(part_path, output_path)
+            return True
+        
+        if os.path.exists(part_path):
+            try:
+                os.remove(part_path)
+            except:
+                pass
+        return False
+    
+    def download_ts_segments(self, segments, temp_dir, max_workers=None, manifest=None, failure=None):
+        """多线程并行下载所有ts片段
+        
+        max_workers 为线程数上限，实际并发由共享的自适应控制器决定；为None时使用控制器的最大并发数。
+        传入 manifest 时跳过清单中已完成的片段，并记录新完成片段的大小和校验和。
+        传入字典 failure 时，最终失败的片段的HTTP状态码记录在 failure['status']
+        """
+        max_workers = max_workers or self.concurrency.max_limit
         downloaded_files = {}
-        failed_count = 0
-        lock = Lock()
-        completed = 0
+        if manifest is not None:
+            downloaded_files = manifest.completed_files(
+                lambda index: self.get_segment_path(temp_dir, index),
+                verify_checksum=self.verify_resume_checksums
+            )
+            if downloaded_files:
+                print(f"    断点续传: 已有 {len(downloaded_files)}/{len(segments)} 个片段，只下载缺失部分")
+        failed_indexes = set()
+        retry_count = 0
+        failure_budget = self.get_failure_budget(len(segments))
+        attempts = {}
+        aborted = False
+        # 等待重试的片段：(可重试时间, 序号)
+        retry_queue = []
+        completed = len(downloaded_files)
         
         def update_progress():
             nonlocal completed
-            with lock:
-                completed += 1
-                print(f"    下载进度: {completed}/{len(ts_urls)}", end='\r')
+            completed += 1
+            print(f"    下载进度: {completed}/{len(segments)}", end='\r')
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        executor, download_single_ts, _ = self.segment_executor(max_workers)
+        with executor:
+            def submit(ts_index):
+                return executor.submit(download_single_ts, segments[ts_index - 1], ts_index,
+                                       len(segments), temp_dir, manifest)
+            
             # 提交所有下载任务
-            futures = {
-                executor.submit(self.download_single_ts, ts_url, i+1, len(ts_urls), temp_dir): (i+1, ts_url)
-                for i, ts_url in enumerate(ts_urls)
+            running = {
+                submit(i + 1)
+                for i in range(len(segments))
+                if i + 1 not in downloaded_files
             }
             
-            # 收集结果
-            for future in as_completed(futures):
-                ts_file, ts_index, error = future.result()
-                update_progress()
+            # 收集结果；失败的片段在退避等待后重新提交到队尾，不占用下载线程
+            while running or retry_queue:
+                now = time.monotonic()
+                while retry_queue and retry_queue[0][0] <= now:
+                    _, ts_index = heapq.heappop(retry_queue)
+                    running.add(submit(ts_index))
                 
-                if ts_file:
-                    downloaded_files[ts_index] = ts_file
-                else:
-                    failed_count += 1
-                    if error:
-                        print(f"\n    片段 {ts_index} 下载失败: {error}")
+                timeout = retry_queue[0][0] - now if retry_queue else None
+                if not running:
+                    time.sleep(max(0, timeout))
+                    continue
+                
+                done, running = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    ts_file, ts_index, error, status = future.result()
+                    
+                    if ts_file:
+                        downloaded_files[ts_index] = ts_file
+                        update_progress()
+                        continue
+                    
+                    attempts[ts_index] = attempts.get(ts_index, 0) + 1
+                    if (self.is_retryable_status(status) and attempts[ts_index] <= self.segment_retries
+                            and retry_count < failure_budget):
+                        retry_count += 1
+                        delay = self.get_retry_delay(attempts[ts_index])
+                        print(f"\n    片段 {ts_index} 下载失败，{delay:.1f}秒后重试 "
+                              f"({attempts[ts_index]}/{self.segment_retries}): {error}")
+                        heapq.heappush(retry_queue, (time.monotonic() + delay, ts_index))
+                        continue
+                    
+                    failed_indexes.add(ts_index)
+                    if failure is not None and failure.get('status') not in self.LINK_FAILURE_STATUSES:
+                        failure['status'] = status
+                    update_progress()
+                    print(f"\n    片段 {ts_index} 下载失败: {error}")
+                    if not aborted and retry_count >= failure_budget and self.is_retryable_status(status):
+                        # 失败预算用完：该剧集整体放弃，取消排队中的下载
+                        aborted = True
+                        print(f"\n    超出失败预算（已重试 {retry_count} 次），放弃该剧集")
+                        for pending_future in running:
+                            pending_future.cancel()
+                        running = {f for f in running if not f.cancelled()}
+                        retry_queue.clear()
+        
+        if manifest is not None:
+            manifest.save()
         
         # 按索引排序
         sorted_files = [downloaded_files[i] for i in sorted(downloaded_files.keys())]
         
-        print(f"\n    共下载 {len(sorted_files)}/{len(ts_urls)} 个片段", end='')
-        if failed_count > 0:
-            print(f" (失败: {failed_count})")
+        print(f"\n    共下载 {len(sorted_files)}/{len(segments)} 个片段", end='')
+        if retry_count > 0 or failed_indexes:
+            print(f" (重试: {retry_count}, 失败: {len(failed_indexes)})")
         else:
             print()
         
         return sorted_files
     
+    @staticmethod
+    def is_fragmented_mp4(path):
+        """文件是否以MP4的box开头（fMP4初始化片段），而不是TS"""
+        with open(path, 'rb') as f:
+            return f.read(8)[4:8] in (b'ftyp', b'styp', b'moov')
+    
     def merge_ts_to_mp4(self, ts_files, output_path):
         """合并ts文件为mp4"""
         try:
+            # fMP4片段（初始化片段在最前）按顺序拼接即为完整的分片mp4
+            if self.is_fragmented_mp4(ts_files[0]):
+                print("    fMP4片段，直接按顺序拼接...")
+                with open(output_path, 'wb') as out:
+                    for ts_file in ts_files:
+                        with open(ts_file, 'rb') as f:
+                            shutil.copyfileobj(f, out, 1024 * 1024)
+                return True
+            
             # 使用ffmpeg合并（如果可用）
-            try:
-                result = subprocess.run(['ffmpeg', '-version'], 
-                                      capture_output=True, 
-                                      timeout=5)
-                if result.returncode == 0:
-                    # 创建文件列表
-                    list_file = output_path.replace('.mp4', '_list.txt')
-                    with open(list_file, 'w', encoding='utf-8') as f:
-                        for ts_file in ts_files:
-                            f.write(f"file '{os.path.abspath(ts_file)}'\n")
-                    
-                    cmd = [
-                        'ffmpeg',
-                        '-f', 'concat',
-                        '-safe', '0',
-                        '-i', list_file,
-                        '-c', 'copy',
-                        '-y',
-                        output_path
-                    ]
-                    
-                    process = subprocess.Popen(
-                        cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE
-                    )
-                    process.communicate()
-                    
-                    # 清理临时文件
-                    try:
-                        os.remove(list_file)
-                    except:
-                        pass
-                    
-                    if process.returncode == 0 and os.path.exists(output_path):
-                        return True
-            except (FileNotFoundError, subprocess.TimeoutExpired):
-                pass
+            ffmpeg = get_tool('ffmpeg')
+            if ffmpeg is not None:
+                # 创建文件列表（放在片段所在的剧集临时目录中，避免与其他剧集冲突）
+                list_file = os.path.join(os.path.dirname(os.path.abspath(ts_files[0])), 'concat_list.txt')
+                with open(list_file, 'w', encoding='utf-8') as f:
+                    for ts_file in ts_files:
+                        f.write(f"file '{os.path.abspath(ts_file)}'\n")
+                
+                cmd = ffmpeg.cmd(
+                    '-f', 'concat',
+                    '-safe', '0',
+                    '-i', list_file,
+                    '-c', 'copy',
+                    '-y',
+                    output_path
+                )
+                
+                process = subprocess.Popen(
+                    cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE
+                )
+                process.communicate()
+                
+                # 清理临时文件
+                try:
+                    os.remove(list_file)
+                except:
+                    pass
+                
+                if process.returncode == 0 and os.path.exists(output_path):
+                    return True
             
-            # 如果没有ffmpeg，直接合并二进制文件
-            print("    使用二进制方式合并...")
-            with open(output_path, 'wb') as outfile:
-                for ts_file in ts_files:
-                    if os.path.exists(ts_file):
-                        with open(ts_file, 'rb') as infile:
-                            outfile.write(infile.read())
+            # 没有ffmpeg（或ffmpeg合并失败）时，用内置转封装器输出分片mp4（编码不支持时自动退回为二进制拼接）
+            print("    使用内置转封装器合并...")
+            remux_ts_files([ts_file for ts_file in ts_files if os.path.exists(ts_file)], output_path)
             
             return True
         except Exception as e:
             print(f"  合并失败: {e}")
             return False
     
-    def download_m3u8_to_mp4(self, m3u8_url, output_path, max_workers=8):
-        """下载m3u8并转换为mp4"""
-        # 检查文件是否已存在
-        if os.path.exists(output_path):
-            file_size = os.path.getsize(output_path) / (1024 * 1024)  # MB
-            print(f"  ⏭ 文件已存在，跳过: {output_path} ({file_size:.2f} MB)")
-            return True
+    def get_temp_dir(self, output_path):
+        """获取剧集的临时目录 <输出目录>/.temp_ts/<剧集文件名>
         
-        # 确保输出目录存在
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        每个剧集独立，多个剧集（或多个进程）可以同时下载到同一个输出目录
+        """
+        name = os.path.splitext(os.path.basename(output_path))[0]
+        return os.path.join(os.path.dirname(output_path), '.temp_ts', name)
+    
+    def cleanup_temp_files(self, ts_files, temp_dir):
+        """清理临时ts文件、下载清单、占用标记和临时目录"""
+        try:
+            if ts_files:
+                for ts_file in ts_files:
+                    if os.path.exists(ts_file):
+                        os.remove(ts_file)
+            if temp_dir and os.path.exists(temp_dir):
+                for filename in (SegmentManifest.FILENAME, TempDirLock.FILENAME):
+                    file_path = os.path.join(temp_dir, filename)
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                try:
+                    os.rmdir(temp_dir)
+                    # 所有剧集的临时目录都清理完后，删除上层的 .temp_ts
+                    os.rmdir(os.path.dirname(temp_dir))
+                except:
+                    pass  # 目录可能不为空，忽略错误
+        except Exception as e:
+            pass  # 忽略清理错误
+    
+    def cleanup_orphaned_temp_dirs(self, episode_dir, max_age_days=7):
+        """清理输出目录中无人使用的遗留临时文件
         
-        # 方法1: 尝试使用ffmpeg直接下载（最快）
-        # print("  尝试使用ffmpeg下载...")
-        # if self.download_with_ffmpeg(m3u8_url, output_path):
-        #     print(f"  ✓ ffmpeg下载成功")
-        #     return True
+        删除以下未被存活进程占用的临时目录：对应的mp4已存在、没有下载清单（无法续传）、
+        或超过max_age_days天未更新；同时删除流式模式中断后遗留的 .part 文件。
+        """
+        removed = 0
+        temp_root = os.path.join(episode_dir, '.temp_ts')
         
-        # 方法2: 多线程下载ts片段并合并
-        print("  使用多线程下载方式...")
+        if os.path.isdir(temp_root):
+            for name in os.listdir(temp_root):
+                temp_dir = os.path.join(temp_root, name)
+                if not os.path.isdir(temp_dir) or TempDirLock(temp_dir).is_active():
+                    continue
+                
+                output_path = os.path.join(episode_dir, name + '.mp4')
+                has_manifest = os.path.exists(os.path.join(temp_dir, SegmentManifest.FILENAME))
+                try:
+                    mtimes = [os.path.getmtime(os.path.join(temp_dir, f)) for f in os.listdir(temp_dir)]
+                    last_modified = max(mtimes) if mtimes else os.path.getmtime(temp_dir)
+                except OSError:
+                    continue
+                expired = time.time() - last_modified > max_age_days * 24 * 3600
+                
+                if os.path.exists(output_path) or not has_manifest or expired:
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+                    removed += 1
+            try:
+                os.rmdir(temp_root)
+            except OSError:
+                pass
+        
+        if os.path.isdir(episode_dir):
+            for name in os.listdir(episode_dir):
+                if not name.endswith('.mp4.part'):
+                    continue
+                output_path = os.path.join(episode_dir, name[:-len('.part')])
+                if TempDirLock(self.get_temp_dir(output_path)).is_active():
+                    continue
+                try:
+                    os.remove(os.path.join(episode_dir, name))
+                    removed += 1
+                except OSError:
+                    pass
+        
+        return removed
+    
+    def download_m3u8_segments(self, m3u8_url, output_path, max_workers=None, failure=None):
+        """下载阶段：解析m3u8并下载所有ts片段
+        
+        返回 (是否成功, ts文件列表, 临时目录)。
+        流式组装模式下直接写出最终文件，返回的ts文件列表为空。
+        传入字典 failure 时记录失败原因：failure['playlist'] 表示m3u8获取失败，
+        failure['status'] 为失败的请求（播放列表、密钥或片段）的HTTP状态码
+        """
         ts_files = []
-        temp_dir = None
+        
+        # 占用该剧集的临时目录，防止其他进程同时下载同一剧集
+        temp_dir = self.get_temp_dir(output_path)
+        lock = TempDirLock(temp_dir)
+        if not lock.acquire():
+            print("  ⏭ 其他进程正在下载该剧集，跳过")
+            return False, [], None
+        
+        # 成功下载后临时目录交给合并阶段，由合并阶段负责清理或释放
+        handed_over = False
         try:
             # 获取最终的m3u8内容
             m3u8_content, final_m3u8_url = self.get_final_m3u8(m3u8_url)
             if not m3u8_content:
-                return False
+                if failure is not None:
+                    failure['playlist'] = True
+                return False, [], None
             
-            # 解析m3u8获取ts片段列表
-            ts_urls = self.parse_m3u8(m3u8_content, final_m3u8_url)
-            if not ts_urls:
+            # 解析m3u8获取片段列表（字节区间、初始化片段、加密信息）
+            playlist = parse_media_playlist(m3u8_content, final_m3u8_url)
+            segments = playlist.segments
+            if not segments:
                 print("  无法解析ts片段列表")
-                return False
+                return False, [], None
+            
+            # 无法自行解密的加密方式（SAMPLE-AES，或未安装cryptography时的AES-128）交给ffmpeg
+            if playlist.unsupported_methods:
+                hint = "（自行解密需要 pip install cryptography）" if 'AES-128' in playlist.unsupported_methods else ""
+                print(f"  片段使用 {', '.join(playlist.unsupported_methods)} 加密，使用ffmpeg下载{hint}")
+                return self.download_with_ffmpeg(final_m3u8_url, output_path), [], None
+            if playlist.keys:
+                print(f"  片段使用AES-128加密，已获取 {self.load_playlist_keys(playlist)} 个密钥，下载时同步解密")
             
-            print(f"  找到 {len(ts_urls)} 个ts片段，使用 {max_workers} 个线程并行下载")
+            if max_workers:
+                print(f"  找到 {len(segments)} 个ts片段，最多使用 {max_workers} 个线程并行下载")
+            else:
+                print(f"  找到 {len(segments)} 个ts片段，使用自适应并发下载（当前 {self.concurrency.limit}）")
             
-            # 创建临时目录
-            temp_dir = os.path.join(os.path.dirname(output_path), '.temp_ts')
-            os.makedirs(temp_dir, exist_ok=True)
+            # 流式组装：片段按顺序直接写入输出，临时目录中只有占用标记；
+            # 有不连续点（#EXT-X-DISCONTINUITY）的TS片段时间戳会跳变，交给临时目录模式按文件合并
+            stream = self.assembly_mode == 'stream' and (playlist.fragmented or not playlist.has_discontinuity)
+            if self.assembly_mode == 'stream' and not stream:
+                print("  播放列表包含不连续点，使用临时目录模式")
+            if stream:
+                if self.stream_ts_to_mp4(segments, output_path, max_workers, playlist.fragmented, failure):
+                    print(f"  ✓ 合并成功")
+                    return True, [], None
+                return False, [], None
+            
+            # 读取或创建下载清单，上次中断时已完成的片段不再重复下载
+            manifest = SegmentManifest(temp_dir, [segment.uri for segment in segments], final_m3u8_url)
+            manifest.load()
             
             # 多线程下载所有ts片段
-            ts_files = self.download_ts_segments(ts_urls, temp_dir, max_workers)
+            ts_files = self.download_ts_segments(segments, temp_dir, max_workers, manifest, failure)
             
             if not ts_files:
                 print("  没有成功下载任何片段")
-                return False
+                self.cleanup_temp_files(ts_files, temp_dir)
+                return False, [], None
+            
+            # 有缺失片段时不合并，避免输出被截断的视频；已下载的片段保留用于下次续传
+            if len(ts_files) != len(segments):
+                print(f"  ✗ 缺少 {len(segments) - len(ts_files)} 个片段，不进行合并（重新运行可继续下载）")
+                return False, [], None
             
-            # 合并为mp4
+            handed_over = True
+            return True, ts_files, temp_dir
+        except Exception as e:
+            # 保留已下载的片段和清单，重新运行时继续下载
+            print(f"  下载失败: {e}")
+            if failure is not None:
+                failure['status'] = self.get_error_status(e)
+            return False, [], None
+        finally:
+            if not handed_over:
+                lock.release()
+    
+    def merge_episode(self, ts_files, temp_dir, output_path):
+        """合并阶段：把下载好的ts片段合并为mp4，成功后清理临时文件
+        
+        合并失败时保留片段和下载清单，重新运行时无需再次下载
+        """
+        try:
             print("  正在合并为mp4...")
             if self.merge_ts_to_mp4(ts_files, output_path):
                 print(f"  ✓ 合并成功")
+                self.cleanup_temp_files(ts_files, temp_dir)
                 return True
             else:
+                TempDirLock(temp_dir).release()
                 return False
         except Exception as e:
-            print(f"  下载转换失败: {e}")
+            print(f"  合并失败: {e}")
+            TempDirLock(temp_dir).release()
             return False
-        finally:
-            # 清理临时文件
+    
+    def download_m3u8_to_mp4(self, m3u8_url, output_path, max_workers=None):
+        """下载m3u8并转换为mp4"""
+        # 检查文件是否已存在
+        if os.path.exists(output_path):
+            file_size = os.path.getsize(output_path) / (1024 * 1024)  # MB
+            print(f"  ⏭ 文件已存在，跳过: {output_path} ({file_size:.2f} MB)")
+            return True
+        
+        # 确保输出目录存在
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        
+        # 方法1: 尝试使用ffmpeg直接下载（最快）
+        # print("  尝试使用ffmpeg下载...")
+        # if self.download_with_ffmpeg(m3u8_url, output_path):
+        #     print(f"  ✓ ffmpeg下载成功")
+        #     return True
+        
+        # 方法2: 多线程下载ts片段并合并
+        print("  使用多线程下载方式...")
+        success, ts_files, temp_dir = self.download_m3u8_segments(m3u8_url, output_path, max_workers)
+        if not success or not ts_files:
+            return success
+        
+        return self.merge_episode(ts_files, temp_dir, output_path)
+    
+    def resolve_episode(self, job):
+        """元数据阶段：获取剧集的m3u8链接
+        
+        剧集列表中已有guid时直接查询视频信息，不再下载剧集页面
+        """
+        print(f"\n[{job['index']}/{job['total']}] 获取m3u8链接: {job['title']}")
+        print(f"  URL: {job['url']}")
+        try:
+            if job.get('guid'):
+                m3u8_url = self.get_video_info(job['guid'])
+            else:
+                m3u8_url = self.get_m3u8_from_page(job['url'])
+        except Exception as e:
+            print(f"  获取m3u8链接失败: {e}")
+            m3u8_url = None
+        
+        return m3u8_url
+    
+    def download_episode(self, job, max_workers, merge_executor, merge_slots):
+        """下载阶段：下载剧集片段，并把合并任务交给后台合并线程
+        
+        返回 False 表示失败，True 表示已完成（流式模式），或返回合并任务的 Future
+        """
+        print(f"\n[{job['index']}/{job['total']}] 开始下载: {job['title']}")
+        print(f"  m3u8链接: {job['m3u8_url']}")
+        
+        os.makedirs(os.path.dirname(job['mp4_path']), exist_ok=True)
+        failure = {}
+        success, ts_files, temp_dir = self.download_m3u8_segments(job['m3u8_url'], job['mp4_path'], max_workers,
+                                                                  failure)
+        if not success and job.get('guid') and self.is_link_failure(failure):
+            # 缓存的m3u8链接可能已经过期：作废缓存重新获取，链接变了就再下载一次
+            self.invalidate_video_info(job['guid'])
+            m3u8_url = self.get_video_info(job['guid'])
+            if m3u8_url and m3u8_url != job['m3u8_url']:
+                print(f"  m3u8链接已更新，重新下载: {m3u8_url}")
+                job['m3u8_url'] = m3u8_url
+                failure = {}
+                success, ts_files, temp_dir = self.download_m3u8_segments(m3u8_url, job['mp4_path'], max_workers,
+                                                                          failure)
+                if not success and self.is_link_failure(failure):
+                    self.invalidate_video_info(job['guid'])
+        if not success or not ts_files:
+            return success
+        
+        # 合并队列已满时阻塞，避免临时文件无限堆积
+        merge_slots.acquire()
+        
+        def run_merge():
             try:
-                if ts_files:
-                    for ts_file in ts_files:
-                        if os.path.exists(ts_file):
-                            os.remove(ts_file)
-                if temp_dir and os.path.exists(temp_dir):
-                    try:
-                        os.rmdir(temp_dir)
-                    except:
-                        pass  # 目录可能不为空，忽略错误
-            except Exception as e:
-                pass  # 忽略清理错误
+                print(f"\n[{job['index']}/{job['total']}] 后台合并: {job['title']}")
+                return self.merge_episode(ts_files, temp_dir, job['mp4_path'])
+            finally:
+                merge_slots.release()
+        
+        return merge_executor.submit(run_merge)
+    
+    def is_link_failure(self, failure):
+        """下载失败是否由m3u8链接失效引起（m3u8获取失败，或播放列表/片段返回403/404/410）
+        
+        其他原因（其他进程正在下载、超出失败预算、合并失败等）不需要重新获取链接
+        """
+        return bool(failure.get('playlist')) or failure.get('status') in self.LINK_FAILURE_STATUSES
+    
+    def open_state(self, episode_dir):
+        """打开剧集目录中的下载状态索引，失败时返回None（退回按文件名判断）"""
+        try:
+            return DownloadState(episode_dir)
+        except Exception as e:
+            print(f"  无法打开下载状态索引，将按文件名判断是否已下载: {e}")
+            return None
     
-    def download_episodes(self, start_url, output_dir="downloads"):
-        """主函数：下载所有剧集的m3u8"""
+    def adopt_legacy_files(self, state, album_id, data_order, episode_dir):
+        """按旧的文件编号查找已下载的剧集，找到的按剧集ID记入下载状态索引，返回找到的数量
+        
+        旧版本只获取当前集前后的100集，文件名中的序号按那个列表编号；现在获取整个专辑，
+        序号从专辑第1集开始，同一集的文件名会变。每个目录只检查一次（记录在索引中）
+        """
+        if state.get_meta('legacy_names_checked') is not None:
+            return 0
+        episode_list_data = self.get_episode_list(album_id, data_order)
+        if not episode_list_data or 'data' not in episode_list_data:
+            return 0
+        found = 0
+        for i, episode in enumerate(episode_list_data['data'].get('list') or [], 1):
+            episode_id = self.get_episode_id(episode)
+            if not episode_id or state.lookup(cctv_key(episode_id)) is not None:
+                continue
+            safe_episode_title = re.sub(r'[<>:"/\\|?*]', '_', episode.get('title', f'第{i}集'))
+            old_path = os.path.join(episode_dir, f"{i:03d}_{safe_episode_title}.mp4")
+            if os.path.isfile(old_path) and state.record(cctv_key(episode_id), old_path):
+                found += 1
+        state.set_meta('legacy_names_checked', time.time())
+        return found
+    
+    def download_episodes(self, start_url, output_dir="downloads", max_workers=None,
+                          episode_workers=1, resolve_workers=2, resolve_ahead=2, merge_workers=1,
+                          reconcile=False):
+        """主函数：下载所有剧集的m3u8
+        
+        max_workers: 每个剧集的片段下载线程数上限，为None时由自适应并发控制器决定
+        episode_workers: 同时下载的剧集数
+        resolve_workers/resolve_ahead: 获取m3u8链接的线程数，以及最多提前解析的剧集数
+        merge_workers: 后台合并线程数
+        reconcile: 只按磁盘上的文件重建下载状态索引，不下载
+        """
         print(f"开始处理URL: {start_url}")
         
         # 1. 获取页面HTML
@@ -570,14 +1902,24 @@ class CCTVDownloader:
         print(f"专辑标题: {album_title}")
         print(f"当前集数: {data_order}")
         
-        # 4. 获取剧集列表
+        # 4. 获取剧集列表（分页获取整个专辑，不再只取当前集附近的100集）
         print("\n[4/5] 获取剧集列表...")
-        episode_list_data = self.get_episode_list(album_id, data_order)
-        if not episode_list_data or 'data' not in episode_list_data:
-            print("无法获取剧集列表")
-            return
-        
-        episodes = episode_list_data['data'].get('list', [])
+        episodes = []
+        listing_complete = True
+        try:
+            for episode in self.iter_album_episodes(album_id):
+                episodes.append(episode)
+        except IOError as e:
+            # 已获取的剧集按专辑顺序排列，编号仍然正确，只处理这一部分
+            print(f"{e}，只处理已获取的 {len(episodes)} 集")
+            listing_complete = False
+        if not episodes:
+            # 分页接口不可用时，退回只获取当前集附近的剧集
+            episode_list_data = self.get_episode_list(album_id, data_order)
+            if not episode_list_data or 'data' not in episode_list_data:
+                print("无法获取剧集列表")
+                return
+            episodes = episode_list_data['data'].get('list', [])
         print(f"找到 {len(episodes)} 个剧集")
         
         if not episodes:
@@ -589,77 +1931,189 @@ class CCTVDownloader:
         episode_dir = os.path.join(output_dir, safe_title)
         os.makedirs(episode_dir, exist_ok=True)
         
+        # 清理之前运行遗留的临时目录（正在被其他进程使用的不会删除）
+        removed = self.cleanup_orphaned_temp_dirs(episode_dir)
+        if removed:
+            print(f"已清理 {removed} 个遗留的临时目录/文件")
+        
+        # 下载状态索引：按剧集ID记录已完成的文件，剧集改名或重新排序后仍能识别
+        state = self.open_state(episode_dir)
+        if state is not None:
+            adopted = self.adopt_legacy_files(state, album_id, data_order, episode_dir)
+            if adopted:
+                print(f"按旧的文件编号找到 {adopted} 个已下载的剧集，已记入下载状态索引")
+        items = []
+        for i, episode in enumerate(episodes, 1):
+            episode_title = episode.get('title', f'第{i}集')
+            safe_episode_title = re.sub(r'[<>:"/\\|?*]', '_', episode_title)
+            mp4_path = os.path.join(episode_dir, f"{i:03d}_{safe_episode_title}.mp4")
+            key = cctv_key(self.get_episode_id(episode) or mp4_path)
+            items.append((key, mp4_path))
+        
+        if reconcile:
+            if state is not None:
+                print("\n按磁盘上的文件重建下载状态索引...")
+                found, removed = state.reconcile(lambda path: path if os.path.isfile(path) else None, items,
+                                                 mark=listing_complete)
+                print(f"索引完成: {found}/{len(items)} 个已下载，删除 {removed} 条失效记录")
+                if not listing_complete:
+                    print("剧集列表不完整，索引未标记为已核对")
+                state.close()
+            return
+        
         # 6. 下载每个剧集并转换为mp4
+        # 三个阶段流水线执行：获取m3u8链接 -> 下载片段 -> 后台合并，
+        # 当前剧集下载时，后续剧集的m3u8链接已在并行获取
         print("\n[5/5] 开始下载并转换为mp4文件...")
         success_count = 0
         fail_count = 0
         
-        for i, episode in enumerate(episodes, 1):
-            episode_id = episode.get('id', '')
+        jobs = []
+        for i, (episode, (key, mp4_path)) in enumerate(zip(episodes, items), 1):
             episode_title = episode.get('title', f'第{i}集')
             episode_url = episode.get('url', '')
             
-            print(f"\n[{i}/{len(episodes)}] 处理: {episode_title}")
-            print(f"  URL: {episode_url}")
-            
-            if not episode_url:
-                print("  ✗ 缺少剧集URL")
-                fail_count += 1
+            # 检查是否已下载（无需再获取m3u8链接）：先查索引，再看文件名；按文件名找到的补记到索引
+            existing_path = state.lookup(key) if state is not None else None
+            if existing_path is None and os.path.exists(mp4_path):
+                existing_path = mp4_path
+                if state is not None:
+                    state.record(key, mp4_path)
+            if existing_path:
+                file_size = os.path.getsize(existing_path) / (1024 * 1024)  # MB
+                print(f"[{i}/{len(episodes)}] ⏭ 文件已存在，跳过下载: {episode_title} ({file_size:.2f} MB)")
+                success_count += 1
                 continue
             
-            # 获取m3u8链接
-            print("  正在获取m3u8链接...")
-            m3u8_url = self.get_m3u8_from_page(episode_url)
-            
-            if not m3u8_url:
-                print("  ✗ 无法获取m3u8链接")
+            guid = self.extract_guid_from_episode(episode)
+            if not episode_url and not guid:
+                print(f"[{i}/{len(episodes)}] ✗ 缺少剧集URL: {episode_title}")
                 fail_count += 1
                 continue
             
-            print(f"  m3u8链接: {m3u8_url}")
-            
-            # 保存为mp4文件
-            safe_episode_title = re.sub(r'[<>:"/\\|?*]', '_', episode_title)
-            mp4_filename = f"{i:03d}_{safe_episode_title}.mp4"
-            mp4_path = os.path.join(episode_dir, mp4_filename)
+            jobs.append({
+                'index': i,
+                'total': len(episodes),
+                'title': episode_title,
+                'url': episode_url,
+                'guid': guid,
+                'mp4_path': mp4_path,
+                'key': key,
+            })
+        
+        resolve_executor = ThreadPoolExecutor(max_workers=resolve_workers)
+        download_executor = ThreadPoolExecutor(max_workers=episode_workers)
+        merge_executor = ThreadPoolExecutor(max_workers=merge_workers)
+        merge_slots = Semaphore(merge_workers * 2)
+        
+        resolving = deque()
+        pending_jobs = iter(jobs)
+        download_futures = []
+        merge_futures = []
+        
+        def fill_resolve_queue():
+            # 只提前解析有限数量的剧集，避免m3u8链接在下载前过期
+            while len(resolving) < episode_workers + resolve_ahead:
+                job = next(pending_jobs, None)
+                if job is None:
+                    break
+                resolving.append((job, resolve_executor.submit(self.resolve_episode, job)))
+        
+        try:
+            fill_resolve_queue()
+            while resolving:
+                job, resolve_future = resolving.popleft()
+                m3u8_url = resolve_future.result()
+                fill_resolve_queue()
+                
+                if not m3u8_url:
+                    print(f"  ✗ 无法获取m3u8链接: {job['title']}")
+                    fail_count += 1
+                    continue
+                job['m3u8_url'] = m3u8_url
+                
+                # 下载阶段已满时等待，保证解析阶段只领先有限的剧集
+                running = [f for _, f in download_futures if not f.done()]
+                if len(running) >= episode_workers:
+                    wait(running, return_when=FIRST_COMPLETED)
+                
+                download_futures.append((job, download_executor.submit(
+                    self.download_episode, job, max_workers, merge_executor, merge_slots
+                )))
             
-            # 检查文件是否已存在
-            if os.path.exists(mp4_path):
-                file_size = os.path.getsize(mp4_path) / (1024 * 1024)  # MB
-                print(f"  ⏭ 文件已存在，跳过下载 ({file_size:.2f} MB)")
-                success_count += 1
-            elif self.download_m3u8_to_mp4(m3u8_url, mp4_path, max_workers=8):
-                if os.path.exists(mp4_path):
-                    file_size = os.path.getsize(mp4_path) / (1024 * 1024)  # MB
-                    print(f"  ✓ 已保存: {mp4_path} ({file_size:.2f} MB)")
-                success_count += 1
-            else:
-                fail_count += 1
+            for job, future in download_futures:
+                result = future.result()
+                if isinstance(result, Future):
+                    merge_futures.append((job, result))
+                elif result:
+                    success_count += 1
+                    if state is not None:
+                        state.record(job['key'], job['mp4_path'])
+                else:
+                    fail_count += 1
             
-            # 避免请求过快
-            time.sleep(1)
+            for job, future in merge_futures:
+                if future.result():
+                    success_count += 1
+                    if state is not None:
+                        state.record(job['key'], job['mp4_path'])
+                else:
+                    fail_count += 1
+        finally:
+            resolve_executor.shutdown(wait=True)
+            download_executor.shutdown(wait=True)
+            merge_executor.shutdown(wait=True)
+            if state is not None:
+                state.close()
         
         print(f"\n{'='*60}")
         print(f"下载完成!")
         print(f"成功: {success_count}, 失败: {fail_count}")
         print(f"输出目录: {episode_dir}")
+        if self.cache is not None:
+            print(f"元数据{self.cache.stats()}")
         print(f"{'='*60}")
 
 
 def main():
     import sys
     
-    if len(sys.argv) < 2:
-        print("使用方法: python download_episodes_m3u8.py <CCTV视频页面URL> [输出目录]")
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    
+    if len(args) < 1:
+        print("使用方法: python download_episodes_m3u8.py <CCTV视频页面URL> [输出目录] [--stream] [--no-cache] [--reconcile] [--async] [--quality=Q] [--connections=N]")
         print("\n示例:")
         print("  python download_episodes_m3u8.py https://tv.cctv.com/2025/12/06/VIDE2bG5I0c3AD1EQvX1pxjF251206.shtml")
+        print("\n选项:")
+        print("  --stream    流式组装，片段按顺序直接写入输出文件，不使用临时目录")
+        print("  --no-cache  不使用元数据缓存，所有接口和页面都重新请求")
+        print("  --reconcile 按输出目录中的文件重建下载状态索引（不下载）")
+        print("  --async     使用异步HTTP引擎（需安装httpx或aiohttp），片段并发不受线程数限制")
+        print("  --quality=Q 码率选择：max（最高）、min（最低）、auto（按实测吞吐量）、")
+        print("              目标码率kbps（如2000）或目标分辨率（如720p）；默认使用播放列表中第一个码率")
+        print("  --connections=N  少量大片段时，每个片段用N个连接按区间并行下载（默认4，1为关闭）")
         sys.exit(1)
     
-    url = sys.argv[1]
-    output_dir = sys.argv[2] if len(sys.argv) > 2 else "downloads"
+    url = args[0]
+    output_dir = args[1] if len(args) > 1 else "downloads"
+    assembly_mode = 'stream' if '--stream' in sys.argv else 'temp'
+    use_cache = '--no-cache' not in sys.argv
+    reconcile = '--reconcile' in sys.argv
+    http_engine = 'async' if '--async' in sys.argv else 'threads'
+    rendition = 'first'
+    range_connections = 4
+    for arg in sys.argv[1:]:
+        if arg.startswith('--quality='):
+            rendition = arg.split('=', 1)[1]
+        elif arg.startswith('--connections='):
+            range_connections = int(arg.split('=', 1)[1])
     
-    downloader = CCTVDownloader()
-    downloader.download_episodes(url, output_dir)
+    downloader = CCTVDownloader(assembly_mode=assembly_mode, use_cache=use_cache, http_engine=http_engine,
+                                rendition=rendition, range_connections=range_connections)
+    try:
+        downloader.download_episodes(url, output_dir, reconcile=reconcile)
+    finally:
+        downloader.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+下载状态索引（SQLite）
+功能：
+1. 记录已完成的条目（Bilibili的BV号/分P、CCTV的剧集ID）对应的文件路径、大小和校验值
+2. 判断是否已下载只需一次索引查询和一次文件stat，不再扫描目录
+3. reconcile：按磁盘上的实际文件重建索引
+"""
+
+import os
+import time
+import hashlib
+import sqlite3
+from threading import Lock
+
+# 快速校验值取文件开头和结尾各1MB，加上文件大小
+CHECKSUM_SAMPLE_SIZE = 1024 * 1024
+
+
+def quick_checksum(path):
+    """文件的快速校验值（sha256(大小 + 开头1MB + 结尾1MB)），避免对整个视频文件做哈希"""
+    size = os.path.getsize(path)
+    sha256 = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as f:
+        sha256.update(f.read(CHECKSUM_SAMPLE_SIZE))
+        if size > CHECKSUM_SAMPLE_SIZE * 2:
+            f.seek(-CHECKSUM_SAMPLE_SIZE, os.SEEK_END)
+            sha256.update(f.read(CHECKSUM_SAMPLE_SIZE))
+    return sha256.hexdigest()
+
+
+def bilibili_key(bvid, page=None, aid=None):
+    """Bilibili条目的键：bilibili:<BV号>[:p<分P>]"""
+    video_id = bvid or f"av{aid}"
+    return f"bilibili:{video_id}:p{page}" if page else f"bilibili:{video_id}"
+
+
+def cctv_key(episode_id):
+    return f"cctv:{episode_id}"
+
+
+class DownloadState:
+    """输出目录中的下载状态索引，文件为 <目录>/.download_state.sqlite3"""
+    FILENAME = '.download_state.sqlite3'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, self.FILENAME)
+        self.lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self.lock:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS items (
+                    key TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    checksum TEXT,
+                    completed_at REAL NOT NULL
+                )
+            ''')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+            self.conn.commit()
+
+    def relpath(self, path):
+        """索引中保存相对于输出目录的路径，目录整体移动后仍然有效"""
+        return os.path.relpath(os.path.abspath(path), os.path.abspath(self.directory))
+
+    def lookup(self, key):
+        """返回已完成条目的文件路径；未记录或文件已不存在/大小不符时返回None"""
+        with self.lock:
+            row = self.conn.execute('SELECT path, size FROM items WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        path = os.path.join(self.directory, row[0])
+        try:
+            if os.path.getsize(path) == row[1]:
+                return path
+        except OSError:
+            pass
+        # 文件被删除或改动，记录失效
+        self.remove(key)
+        return None
+
+    def record(self, key, path, checksum=True):
+        """记录条目已完成"""
+        try:
+            size = os.path.getsize(path)
+            digest = quick_checksum(path) if checksum else None
+        except OSError as e:
+            print(f"  记录下载状态失败: {e}")
+            return False
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO items (key, path, size, checksum, completed_at) VALUES (?, ?, ?, ?, ?)',
+                (key, self.relpath(path), size, digest, time.time())
+            )
+            self.conn.commit()
+        return True
+
+    def remove(self, key):
+        with self.lock:
+            self.conn.execute('DELETE FROM items WHERE key = ?', (key,))
+            self.conn.commit()
+
+    def verify(self, key):
+        """重新计算校验值，确认文件内容未变"""
+        with self.lock:
+            row = self.conn.execute('SELECT path, checksum FROM items WHERE key = ?', (key,)).fetchone()
+        if row is None or not row[1]:
+            return False
+        try:
+            return quick_checksum(os.path.join(self.directory, row[0])) == row[1]
+        except OSError:
+            return False
+
+    @property
+    def reconciled(self):
+        """索引是否已经和磁盘上的文件核对过（核对过之后，未记录即表示未下载）"""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE name = 'reconciled_at'").fetchone()
+        return row is not None
+
+    def reconcile(self, find_existing, items, mark=True):
+        """按磁盘上的文件重建索引
+
+        find_existing(item) 返回该条目在磁盘上的文件路径（未找到返回None），
+        items 为 (键, 条目) 列表；返回 (找到的文件数, 删除的失效记录数)。
+        mark 为False时（条目列表不完整）不标记为已核对
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT key FROM items').fetchall()
+        removed = 0
+        for (key,) in rows:
+            if self.lookup(key) is None:
+                removed += 1
+
+        found = 0
+        for key, item in items:
+            if self.lookup(key) is not None:
+                found += 1
+                continue
+            path = find_existing(item)
+            if path and os.path.isfile(path) and self.record(key, path):
+                found += 1
+
+        if mark:
+            self.mark_reconciled()
+        return found, removed
+
+    def mark_reconciled(self):
+        """记录索引已和磁盘上的文件核对过"""
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('reconciled_at', ?)",
+                              (str(time.time()),))
+            self.conn.commit()
+
+    def get_meta(self, name):
+        """读取索引的附加信息，未设置时返回None"""
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, name, value):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', (name, str(value)))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -11,15 +11,21 @@ import os
 import json
 from urllib.parse import urlparse
 
+from rate_limit import RateLimitedSession
+from season_listing import SEASON_ARCHIVES_API, iter_season_pages, season_archives, season_total
+
 class BilibiliURLExtractor:
-    def __init__(self):
+    def __init__(self, list_workers=4):
+        """list_workers: 合集列表第1页返回总数后，并发获取其余页的线程数；为1时逐页获取"""
+        self.list_workers = max(1, list_workers)
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'Referer': 'https://www.bilibili.com/',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
             'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
         }
-        self.session = requests.Session()
+        # API请求按域名限速，被限流（412/429）时自动降速重试
+        self.session = RateLimitedSession()
         self.session.headers.update(self.headers)
     
     def extract_collection_id(self, url):
@@ -29,97 +35,73 @@ class BilibiliURLExtractor:
             return match.group(1)
         return None
     
+    def fetch_season_page(self, params):
+        """请求合集列表的一页，返回解析后的JSON"""
+        response = self.session.get(SEASON_ARCHIVES_API, params=params, timeout=30)
+        response.raise_for_status()
+        return response.json()
+    
     def extract_video_urls_from_api(self, collection_id, mid=None):
-        """从API获取视频列表"""
+        """从API获取视频列表（第1页返回总数后，其余页并发获取）"""
         video_urls = []
         video_info_list = []
         
-        api_url = "https://api.bilibili.com/x/polymer/web-space/seasons_archives_list"
-        page = 1
         page_size = 50
+        pages = iter_season_pages(self.fetch_season_page, collection_id, mid, page_size, self.list_workers)
         
-        while True:
-            params = {
-                'mid': mid or '',
-                'season_id': collection_id,
-                'sort_reverse': 'false',
-                'page_num': page,
-                'page_size': page_size
-            }
+        for page, data, error in pages:
+            if error is not None:
+                print(f"获取第{page}页失败: {error}")
+                break
+            
+            if data.get('code') != 0 or 'data' not in data:
+                error_msg = data.get('message', '未知错误')
+                print(f"  API返回错误: code={data.get('code')}, message={error_msg}")
+                break
+            
+            archives = season_archives(data)
+            if not archives:
+                break
+            
+            print(f"  第{page}页: 获取到 {len(archives)} 个视频")
             
-            try:
-                response = self.session.get(api_url, params=params, timeout=30)
-                response.raise_for_status()
-                data = response.json()
+            for archive in archives:
+                bvid = archive.get('bvid', '')
+                aid = archive.get('aid', '')
+                title = archive.get('title', '未知标题')
                 
-                if data.get('code') == 0 and 'data' in data:
-                    data_obj = data['data']
-                    
-                    archives = []
-                    if 'archives' in data_obj:
-                        archives = data_obj['archives']
-                    elif 'list' in data_obj:
-                        archives = data_obj['list']
-                    elif 'vlist' in data_obj:
-                        archives = data_obj['vlist']
-                    
-                    if not archives:
-                        if isinstance(data_obj, list):
-                            archives = data_obj
-                        else:
-                            break
-                    
-                    print(f"  第{page}页: 获取到 {len(archives)} 个视频")
-                    
-                    for archive in archives:
-                        bvid = archive.get('bvid', '')
-                        aid = archive.get('aid', '')
-                        title = archive.get('title', '未知标题')
-                        
-                        if bvid:
-                            url = f"https://www.bilibili.com/video/{bvid}"
-                            video_urls.append(url)
-                            video_info_list.append({
-                                'url': url,
-                                'title': title,
-                                'bvid': bvid,
-                                'aid': aid
-                            })
-                        elif aid:
-                            url = f"https://www.bilibili.com/video/av{aid}"
-                            video_urls.append(url)
-                            video_info_list.append({
-                                'url': url,
-                                'title': title,
-                                'bvid': '',
-                                'aid': aid
-                            })
-                    
-                    # 获取总数，可能在data_obj或data中
-                    total = data_obj.get('total', data.get('data', {}).get('total', 0))
-                    if total == 0:
-                        total = data.get('total', 0)
-                    
-                    print(f"  当前总数: {len(video_urls)}, API返回总数: {total}")
-                    
-                    # 如果当前页返回的视频数少于page_size，说明已经是最后一页
-                    # 或者已经获取的数量达到或超过总数
-                    if len(archives) < page_size:
-                        print(f"  已获取所有页面（当前页视频数 {len(archives)} < 每页大小 {page_size}）")
-                        break
-                    
-                    if total > 0 and len(video_urls) >= total:
-                        print(f"  已获取所有视频（{len(video_urls)} >= {total}）")
-                        break
-                    
-                    page += 1
-                else:
-                    error_msg = data.get('message', '未知错误')
-                    print(f"  API返回错误: code={data.get('code')}, message={error_msg}")
-                    break
-            except Exception as e:
-                print(f"获取第{page}页失败: {e}")
+                if bvid:
+                    url = f"https://www.bilibili.com/video/{bvid}"
+                    video_urls.append(url)
+                    video_info_list.append({
+                        'url': url,
+                        'title': title,
+                        'bvid': bvid,
+                        'aid': aid
+                    })
+                elif aid:
+                    url = f"https://www.bilibili.com/video/av{aid}"
+                    video_urls.append(url)
+                    video_info_list.append({
+                        'url': url,
+                        'title': title,
+                        'bvid': '',
+                        'aid': aid
+                    })
+            
+            total = season_total(data)
+            print(f"  当前总数: {len(video_urls)}, API返回总数: {total}")
+            
+            # 如果当前页返回的视频数少于page_size，说明已经是最后一页
+            # 或者已经获取的数量达到或超过总数
+            if len(archives) < page_size:
+                print(f"  已获取所有页面（当前页视频数 {len(archives)} < 每页大小 {page_size}）")
+                break
+            
+            if total > 0 and len(video_urls) >= total:
+                print(f"  已获取所有视频（{len(video_urls)} >= {total}）")
                 break
+        pages.close()
         
         return video_urls, video_info_list
     
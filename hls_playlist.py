@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+HLS媒体播放列表解析
+功能：
+1. 解析片段列表：片段地址可以带查询参数，支持 #EXT-X-BYTERANGE（同一文件中的字节区间）
+2. 支持 #EXT-X-MAP（fMP4初始化片段）、#EXT-X-DISCONTINUITY、#EXT-X-MEDIA-SEQUENCE
+3. 支持 #EXT-X-KEY：AES-128 片段边下载边解密（SegmentDecryptor），
+   其他加密方式（如SAMPLE-AES）标记为不支持，由调用方交给ffmpeg处理
+
+AES-128解密需要可选依赖 cryptography：pip install cryptography
+"""
+
+import re
+import importlib.util
+from urllib.parse import urlparse, urljoin
+
+
+def crypto_available():
+    """是否安装了 cryptography（AES-128解密需要）"""
+    return importlib.util.find_spec('cryptography') is not None
+
+
+def resolve_url(uri, base_url):
+    """把播放列表中的（相对）地址转换为完整URL"""
+    if uri.startswith('/'):
+        # 从base_url提取域名
+        parsed = urlparse(base_url)
+        return f"{parsed.scheme}://{parsed.netloc}{uri}"
+    if uri.startswith('http'):
+        return uri
+    # 相对路径
+    return urljoin(base_url, uri)
+
+
+def parse_attributes(text):
+    """解析 #EXT-X-...: 后的属性列表（KEY=VALUE,KEY="VALUE"），返回字典"""
+    return {key: value.strip('"') for key, value in
+            re.findall(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)', text)}
+
+
+def parse_byterange(text, last_end=None):
+    """解析 <长度>[@<偏移>]，省略偏移时紧接同一文件上一个区间之后，返回 (长度, 偏移)"""
+    length, _, offset = text.strip().partition('@')
+    if offset:
+        return int(length), int(offset)
+    return int(length), last_end or 0
+
+
+class Key:
+    """#EXT-X-KEY：加密方式、密钥地址和IV；value 为下载后的16字节密钥"""
+
+    def __init__(self, method, uri=None, iv=None):
+        self.method = method
+        self.uri = uri
+        self.iv = iv
+        self.value = None
+
+    @property
+    def encrypted(self):
+        return self.method != 'NONE'
+
+
+class Segment:
+    """一个要下载的片段（媒体片段或 #EXT-X-MAP 初始化片段）
+
+    byterange 为 (长度, 偏移)，为None时下载整个文件
+    """
+
+    def __init__(self, uri, duration=0.0, sequence=0, byterange=None, key=None,
+                 discontinuity=False, init=False):
+        self.uri = uri
+        self.duration = duration
+        self.sequence = sequence
+        self.byterange = byterange
+        self.key = key
+        self.discontinuity = discontinuity
+        self.init = init
+
+    def request_headers(self):
+        """下载该片段需要的请求头（字节区间对应的Range）"""
+        if self.byterange is None:
+            return None
+        length, offset = self.byterange
+        return {'Range': f"bytes={offset}-{offset + length - 1}"}
+
+    @property
+    def encrypted(self):
+        return self.key is not None and self.key.encrypted
+
+    def iv_bytes(self):
+        """AES-128的IV：播放列表指定的IV，否则为片段序号（16字节大端）"""
+        if self.key.iv:
+            return bytes.fromhex(self.key.iv[2:] if self.key.iv.lower().startswith('0x') else self.key.iv)
+        return self.sequence.to_bytes(16, 'big')
+
+    def decryptor(self):
+        """返回该片段的流式解密器，未加密时返回None"""
+        if not self.encrypted:
+            return None
+        if self.key.method != 'AES-128':
+            raise ValueError(f"不支持的加密方式: {self.key.method}")
+        if self.key.value is None:
+            raise ValueError(f"密钥尚未下载: {self.key.uri}")
+        return SegmentDecryptor(self.key.value, self.iv_bytes())
+
+
+class MediaPlaylist:
+    """媒体播放列表：按顺序的片段列表和播放列表属性"""
+
+    def __init__(self, url=None):
+        self.url = url
+        self.segments = []
+        self.target_duration = 0
+        self.media_sequence = 0
+        self.endlist = False
+
+    @property
+    def keys(self):
+        """所有加密片段用到的密钥（解析时相同的 #EXT-X-KEY 共用一个对象，这里只出现一次）"""
+        keys = {}
+        for segment in self.segments:
+            if segment.encrypted:
+                keys.setdefault(id(segment.key), segment.key)
+        return list(keys.values())
+
+    @property
+    def unsupported_methods(self):
+        """无法自行解密的加密方式（SAMPLE-AES等；未安装cryptography时也包括AES-128）"""
+        supported = {'NONE', 'AES-128'} if crypto_available() else {'NONE'}
+        return sorted({key.method for key in self.keys} - supported)
+
+    @property
+    def fragmented(self):
+        """是否为fMP4片段（带 #EXT-X-MAP 初始化片段）"""
+        return any(segment.init for segment in self.segments)
+
+    @property
+    def has_discontinuity(self):
+        return any(segment.discontinuity for segment in self.segments)
+
+    @property
+    def duration(self):
+        return sum(segment.duration for segment in self.segments)
+
+
+def parse_media_playlist(content, base_url):
+    """解析媒体播放列表，返回 MediaPlaylist
+
+    初始化片段作为普通片段插入列表（init=True），只在它第一次出现或发生变化时插入一次，
+    按列表顺序下载并拼接即为完整输出。
+    重复出现的相同 #EXT-X-KEY（加密方式、地址、IV都相同）共用一个 Key 对象，下载一次密钥即可用于所有片段
+    """
+    playlist = MediaPlaylist(base_url)
+    sequence = 0
+    duration = 0.0
+    byterange = None
+    discontinuity = False
+    key = None
+    keys = {}
+    current_map = None
+    # 省略偏移的字节区间紧接在同一文件的上一个区间之后
+    last_end = {}
+
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith('#'):
+            tag, _, value = line.partition(':')
+            if tag == '#EXT-X-MEDIA-SEQUENCE':
+                sequence = playlist.media_sequence = int(value)
+            elif tag == '#EXT-X-TARGETDURATION':
+                playlist.target_duration = int(float(value))
+            elif tag == '#EXTINF':
+                duration = float(value.split(',', 1)[0] or 0)
+            elif tag == '#EXT-X-BYTERANGE':
+                byterange = value
+            elif tag == '#EXT-X-DISCONTINUITY':
+                discontinuity = True
+            elif tag == '#EXT-X-ENDLIST':
+                playlist.endlist = True
+            elif tag == '#EXT-X-KEY':
+                attributes = parse_attributes(value)
+                method = attributes.get('METHOD', 'NONE')
+                uri = attributes.get('URI')
+                if method == 'NONE':
+                    key = None
+                else:
+                    key_id = (method, resolve_url(uri, base_url) if uri else None, attributes.get('IV'))
+                    if key_id not in keys:
+                        keys[key_id] = Key(*key_id)
+                    key = keys[key_id]
+            elif tag == '#EXT-X-MAP':
+                attributes = parse_attributes(value)
+                uri = resolve_url(attributes['URI'], base_url)
+                map_range = parse_byterange(attributes['BYTERANGE']) if attributes.get('BYTERANGE') else None
+                if (uri, map_range) != current_map:
+                    current_map = (uri, map_range)
+                    playlist.segments.append(Segment(uri, sequence=sequence, byterange=map_range, key=key,
+                                                     discontinuity=discontinuity, init=True))
+            continue
+
+        uri = resolve_url(line, base_url)
+        segment_range = None
+        if byterange is not None:
+            segment_range = parse_byterange(byterange, last_end.get(uri))
+            last_end[uri] = segment_range[1] + segment_range[0]
+        playlist.segments.append(Segment(uri, duration, sequence, segment_range, key, discontinuity))
+        sequence += 1
+        duration = 0.0
+        byterange = None
+        discontinuity = False
+
+    return playlist
+
+
+class SegmentDecryptor:
+    """AES-128-CBC流式解密：update(数据块) 返回已能解密的部分，finalize() 返回剩余部分并去掉PKCS7填充"""
+
+    def __init__(self, key, iv):
+        from cryptography.hazmat.primitives import padding
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        self.decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+        self.unpadder = padding.PKCS7(128).unpadder()
+
+    def update(self, data):
+        return self.unpadder.update(self.decryptor.update(bytes(data)))
+
+    def finalize(self):
+        return self.unpadder.update(self.decryptor.finalize()) + self.unpadder.finalize()
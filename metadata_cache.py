@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+接口元数据磁盘缓存（SQLite）
+功能：
+1. 缓存API响应和页面HTML，每类请求各自设置有效期（TTL）
+2. 过期后带 ETag / Last-Modified 重新验证，服务器返回304时直接续期
+3. 总大小超过上限时按最近最少使用（LRU）淘汰
+4. 多线程共用一个缓存对象；CCTV下载器和Bilibili下载器共用同一个缓存文件
+"""
+
+import os
+import time
+import sqlite3
+from threading import Lock
+
+import requests
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'download-animation', 'metadata.sqlite3')
+
+# 常用有效期（秒）
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+
+class MetadataCache:
+    """基于SQLite的HTTP响应缓存"""
+
+    def __init__(self, path=None, max_bytes=128 * 1024 * 1024):
+        self.path = path or DEFAULT_CACHE_PATH
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    body BLOB NOT NULL,
+                    encoding TEXT,
+                    content_type TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    size INTEGER NOT NULL
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries (accessed_at)')
+            self.conn.commit()
+
+    @staticmethod
+    def make_key(url, params=None):
+        """缓存键：带上查询参数的完整URL"""
+        return requests.Request('GET', url, params=params).prepare().url
+
+    def lookup(self, key):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT body, encoding, content_type, etag, last_modified, expires_at FROM entries WHERE key = ?',
+                (key,)
+            ).fetchone()
+            if row is not None:
+                self.conn.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (time.time(), key))
+                self.conn.commit()
+        return row
+
+    def store(self, key, response, ttl):
+        body = response.content
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO entries '
+                '(key, body, encoding, content_type, etag, last_modified, expires_at, accessed_at, size) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, body, response.encoding, response.headers.get('Content-Type'),
+                 response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                 now + ttl, now, len(body))
+            )
+            self.conn.commit()
+            self.evict()
+
+    def touch(self, key, ttl):
+        """重新验证通过，延长有效期"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute('UPDATE entries SET expires_at = ?, accessed_at = ? WHERE key = ?',
+                              (now + ttl, now, key))
+            self.conn.commit()
+
+    def evict(self):
+        """总大小超过上限时，按最近访问时间从旧到新删除（调用方需持有锁）"""
+        total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.conn.execute('SELECT key, size FROM entries ORDER BY accessed_at').fetchall()
+        removed = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            removed.append((key,))
+            total -= size
+        self.conn.executemany('DELETE FROM entries WHERE key = ?', removed)
+        self.conn.commit()
+
+    def invalidate(self, url=None, params=None, cache_key=None):
+        """删除一条缓存；用 get() 时传入了 cache_key 的条目需要用同一个 cache_key 删除"""
+        with self.lock:
+            self.conn.execute('DELETE FROM entries WHERE key = ?', (cache_key or self.make_key(url, params),))
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM entries')
+            self.conn.commit()
+
+    @staticmethod
+    def build_response(key, body, encoding, content_type):
+        """用缓存内容构造 requests.Response，调用方无需区分是否来自缓存"""
+        response = requests.Response()
+        response.status_code = 200
+        response.url = key
+        response._content = body
+        response.encoding = encoding
+        if content_type:
+            response.headers['Content-Type'] = content_type
+        response.from_cache = True
+        return response
+
+    def get(self, session, url, params=None, ttl=HOUR, validate=None, timeout=30, cache_key=None):
+        """带缓存的GET请求
+
+        ttl: 有效期（秒），有效期内直接返回缓存，不发请求
+        validate: 判断响应是否值得缓存的函数（例如接口返回 code==0），默认只要求状态码200
+        cache_key: 自定义缓存键，用于参数中带时间戳、随机数的请求（默认为完整URL）
+        """
+        key = cache_key or self.make_key(url, params)
+        try:
+            row = self.lookup(key)
+        except sqlite3.Error as e:
+            print(f"  读取元数据缓存失败: {e}")
+            row = None
+
+        headers = {}
+        if row is not None:
+            body, encoding, content_type, etag, last_modified, expires_at = row
+            if expires_at > time.time():
+                self.hits += 1
+                return self.build_response(key, body, encoding, content_type)
+            # 已过期：带上验证信息，服务器未变化时返回304
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        response = session.get(url, params=params, headers=headers, timeout=timeout)
+        if response.status_code == 304 and row is not None:
+            self.revalidated += 1
+            self.touch(key, ttl)
+            return self.build_response(key, body, encoding, content_type)
+
+        self.misses += 1
+        if response.status_code == 200:
+            try:
+                if validate is None or validate(response):
+                    self.store(key, response, ttl)
+            except Exception as e:
+                # 缓存写入失败不影响本次请求
+                print(f"  写入元数据缓存失败: {e}")
+        return response
+
+    def stats(self):
+        return f"缓存命中 {self.hits} 次，重新验证 {self.revalidated} 次，请求 {self.misses} 次"
+
+
+def bilibili_ok(response):
+    """Bilibili接口：只缓存 code==0 的正常响应（风控返回的 -412 等不缓存）"""
+    try:
+        return response.json().get('code') == 0
+    except ValueError:
+        return False
+
+
+def cntv_video_info_ok(response):
+    """CNTV视频信息接口：只缓存包含播放链接（hls_url 或 manifest）的响应"""
+    try:
+        data = response.json()
+    except ValueError:
+        return False
+    return isinstance(data, dict) and bool(data.get('hls_url') or data.get('manifest'))
+
+
+def non_empty(response):
+    return bool(response.content and response.content.strip())
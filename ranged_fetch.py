@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+多连接分段下载（HTTP Range）
+功能：
+1. 第一个请求直接请求第一个区间，同时从Content-Range得到文件总大小、确认服务器支持Range请求；
+   文件只有一个区间大小或服务器返回整个文件（200）时，这一个请求就完成下载，小文件不多发请求
+2. 大文件按区间切分，其余区间由多个连接并行下载，直接写入预先分配好大小的 .part 文件的对应位置
+3. 每个区间校验206响应和Content-Range，失败的区间单独重试；全部完成后校验总长度再改名为目标文件
+4. 文件较小时其余部分用一个连接下载
+
+高延迟线路上单个TCP连接的速度有限，多个连接并行才能用满带宽
+"""
+
+import os
+import re
+import time
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+MB = 1024 * 1024
+
+
+def parse_content_range(value):
+    """解析 Content-Range: bytes <起>-<止>/<总长度>，返回 (起, 止, 总长度)，总长度未知时为None"""
+    match = re.match(r'bytes\s+(\d+)-(\d+)/(\d+|\*)', value or '')
+    if not match:
+        return None
+    start, end, total = match.groups()
+    return int(start), int(end), None if total == '*' else int(total)
+
+
+class RangedFetcher:
+    """把一个大文件切分为多个Range区间并行下载
+
+    connections: 每个文件同时使用的连接数；chunk_size: 每个区间的大小；
+    min_size: 小于该大小的文件不并行下载；retries: 每个区间的重试次数；
+    max_files: 同时用本对象下载的文件数上限（决定连接池大小）
+    """
+
+    def __init__(self, session=None, connections=4, chunk_size=8 * MB, min_size=16 * MB, retries=3,
+                 timeout=30, buffer_size=256 * 1024, headers=None, max_files=1):
+        self.connections = max(1, connections)
+        self.chunk_size = chunk_size
+        self.min_size = min_size
+        self.retries = retries
+        self.timeout = timeout
+        self.buffer_size = buffer_size
+        if session is None:
+            # 同时下载的每个文件都要用满自己的连接数，连接池按文件数放大，区间请求复用连接
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.connections * max(1, max_files))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        if headers:
+            self.session.headers.update(headers)
+
+    def fetch(self, url, path, headers=None, on_progress=None):
+        """下载url到path，返回文件大小；失败时抛出异常，不留下不完整的文件
+
+        on_progress(已下载字节数, 总字节数) 在下载过程中被调用（总大小未知时为None）
+        """
+        part_path = path + '.part'
+        request_headers = dict(headers or {})
+        request_headers['Range'] = f"bytes=0-{self.chunk_size - 1}"
+        total = None
+        done = 0
+        done_lock = Lock()
+
+        def add_progress(size):
+            nonlocal done
+            with done_lock:
+                done += size
+                current = done
+            if on_progress is not None:
+                on_progress(current, total)
+
+        try:
+            with self.session.get(url, headers=request_headers, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    # 服务器不支持Range，返回的就是整个文件
+                    length = response.headers.get('Content-Length')
+                    total = int(length) if length else None
+                    return self.save_whole(response, part_path, path, total, on_progress)
+                content_range = parse_content_range(response.headers.get('Content-Range'))
+                if not content_range or content_range[0] != 0 or not content_range[2]:
+                    # 总大小未知，无法切分：不带Range重新请求整个文件
+                    response.close()
+                    with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as whole:
+                        whole.raise_for_status()
+                        return self.save_whole(whole, part_path, path, None, on_progress)
+                total = content_range[2]
+                first_end = min(content_range[1], total - 1)
+
+                # 预先分配完整大小，各区间写入自己的位置，互不等待
+                with open(part_path, 'wb') as f:
+                    f.truncate(total)
+                if total < self.min_size or self.connections <= 1:
+                    rest = [(first_end + 1, total - 1)] if first_end + 1 < total else []
+                else:
+                    rest = [(start, min(start + self.chunk_size, total) - 1)
+                            for start in range(first_end + 1, total, self.chunk_size)]
+                executor = ThreadPoolExecutor(max_workers=max(1, min(self.connections - 1, len(rest))))
+                try:
+                    futures = [executor.submit(self.fetch_range, url, part_path, start, end, headers, add_progress)
+                               for start, end in rest]
+                    # 第一个区间直接从这个响应写入，同时其余区间在线程池中下载；中途失败时重新请求该区间
+                    try:
+                        written = self.write_range(response, part_path, 0, first_end)
+                        add_progress(written)
+                    except Exception:
+                        written = None
+                    response.close()
+                    if written is None:
+                        written = self.fetch_range(url, part_path, 0, first_end, headers, add_progress)
+                    written += sum(future.result() for future in futures)
+                finally:
+                    # 某个区间最终失败时，尚未开始的区间不再下载
+                    executor.shutdown(wait=True, cancel_futures=True)
+            if written != total or os.path.getsize(part_path) != total:
+                raise IOError(f"下载长度不符: {written}/{total} 字节")
+            os.replace(part_path, path)
+            return total
+        except BaseException:
+            self.remove(part_path)
+            raise
+
+    def write_range(self, response, part_path, start, end):
+        """把206响应的内容写入文件的 start-end 位置，返回写入的字节数；长度不符时抛出异常"""
+        expected = end - start + 1
+        written = 0
+        with open(part_path, 'r+b') as f:
+            f.seek(start)
+            for chunk in response.iter_content(chunk_size=self.buffer_size):
+                if not chunk:
+                    continue
+                f.write(chunk[:expected - written])
+                written += min(len(chunk), expected - written)
+        if written != expected:
+            raise IOError(f"区间 {start}-{end} 长度不符: {written}/{expected} 字节")
+        return written
+
+    def fetch_range(self, url, part_path, start, end, headers=None, on_progress=None):
+        """下载一个区间写入文件对应位置，返回写入的字节数；失败时按退避重试"""
+        request_headers = dict(headers or {})
+        request_headers['Range'] = f"bytes={start}-{end}"
+        for attempt in range(self.retries + 1):
+            try:
+                with self.session.get(url, headers=request_headers, timeout=self.timeout, stream=True) as response:
+                    response.raise_for_status()
+                    content_range = parse_content_range(response.headers.get('Content-Range'))
+                    if response.status_code != 206 or not content_range or content_range[:2] != (start, end):
+                        raise IOError(f"服务器返回的区间不符: HTTP {response.status_code} "
+                                      f"{response.headers.get('Content-Range')}")
+                    written = self.write_range(response, part_path, start, end)
+                if on_progress is not None:
+                    on_progress(written)
+                return written
+            except Exception as e:
+                # 4xx（429除外）重试也不会成功
+                status = getattr(getattr(e, 'response', None), 'status_code', None)
+                if attempt >= self.retries or (status is not None and 400 <= status < 500 and status != 429):
+                    raise
+                time.sleep(min(8, 0.5 * 2 ** attempt))
+
+    def save_whole(self, response, part_path, path, total=None, on_progress=None):
+        """把返回整个文件的响应（服务器不支持Range）写入文件，已知总大小时同样校验长度"""
+        size = 0
+        with open(part_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=self.buffer_size):
+                if not chunk:
+                    continue
+                f.write(chunk)
+                size += len(chunk)
+                if on_progress is not None:
+                    on_progress(size, total)
+        if total is not None and size != total:
+            raise IOError(f"下载长度不符: {size}/{total} 字节")
+        os.replace(part_path, path)
+        return size
+
+    @staticmethod
+    def remove(path):
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
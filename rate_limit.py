@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+请求限速
+功能：
+1. 令牌桶限速器，多个线程共用，替代固定的 time.sleep
+2. 空闲时不等待，并发时保证整体速率不超过设定值
+3. 按域名分别限速的 requests 会话：所有HTTP请求在会话层统一限速，
+   遇到 412/429 时自动降速、等待后重试
+"""
+
+import time
+import random
+from threading import Lock
+from urllib.parse import urlparse
+
+import requests
+
+# 各接口域名的默认速率（每秒请求数）；未列出的域名（如视频CDN）不限速
+DEFAULT_HOST_RATES = {
+    'api.bilibili.com': 5,
+    'api.cntv.cn': 2,
+    'vdn.apps.cntv.cn': 2,
+}
+# 被限流（412/429）时的状态码
+THROTTLE_STATUSES = (412, 429)
+
+
+class RateLimiter:
+    """令牌桶限速器：平均每秒最多 rate 次，允许 burst 次突发"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        # 被限流后在此时间之前暂停发放令牌
+        self.blocked_until = 0
+        self.lock = Lock()
+
+    def acquire(self):
+        """取得一个令牌，必要时等待；rate<=0 表示不限速"""
+        if not self.rate or self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait_time = self.blocked_until - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class HostRateLimiter:
+    """按域名分别限速，每个域名一个令牌桶
+
+    被限流时该域名暂停一段时间并把速率减半；之后每次成功请求逐步恢复到配置的速率
+    rates 中的配置覆盖 DEFAULT_HOST_RATES 中的同名域名，其他域名仍使用默认速率
+    """
+
+    def __init__(self, rates=None, burst=2, min_rate=0.2):
+        self.rates = dict(DEFAULT_HOST_RATES, **(rates or {}))
+        self.burst = burst
+        self.min_rate = min_rate
+        self.limiters = {}
+        self.lock = Lock()
+
+    def get_limiter(self, host):
+        """返回域名对应的令牌桶，不限速的域名返回None"""
+        if host not in self.rates:
+            return None
+        with self.lock:
+            if host not in self.limiters:
+                self.limiters[host] = RateLimiter(self.rates[host], self.burst)
+            return self.limiters[host]
+
+    def set_rate(self, host, rate):
+        """修改（或新增）某个域名的速率"""
+        with self.lock:
+            self.rates[host] = rate
+            if host in self.limiters:
+                self.limiters[host].rate = rate
+
+    def acquire(self, host):
+        limiter = self.get_limiter(host)
+        if limiter is not None:
+            limiter.acquire()
+
+    def throttled(self, host, delay):
+        """被限流：暂停该域名 delay 秒，速率减半"""
+        limiter = self.get_limiter(host)
+        if limiter is None:
+            return
+        with limiter.lock:
+            limiter.blocked_until = max(limiter.blocked_until, time.monotonic() + delay)
+            limiter.rate = max(self.min_rate, limiter.rate / 2)
+            limiter.tokens = 0
+        print(f"  {host} 请求被限流，暂停 {delay:.1f} 秒，速率降为 {limiter.rate:.2f} 次/秒")
+
+    def succeeded(self, host):
+        """请求成功：速率逐步恢复到配置值"""
+        limiter = self.get_limiter(host)
+        if limiter is None or limiter.rate >= self.rates[host]:
+            return
+        with limiter.lock:
+            limiter.rate = min(self.rates[host], limiter.rate * 1.1)
+
+
+# 进程内共享的域名限速器，所有下载器的会话默认共用
+default_host_limiter = HostRateLimiter()
+
+
+class RateLimitedSession(requests.Session):
+    """按域名限速的 requests 会话
+
+    只对配置了速率的域名限速和重试；被限流（412/429）时按 Retry-After 或指数退避等待后重试
+    """
+
+    def __init__(self, limiter=None, max_retries=3, backoff=2, backoff_max=60):
+        super().__init__()
+        self.limiter = limiter or default_host_limiter
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+
+    def get_throttle_delay(self, response, attempt):
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            return min(self.backoff_max, int(retry_after))
+        delay = min(self.backoff_max, self.backoff * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def request(self, method, url, *args, **kwargs):
+        return self.limited(url, lambda: super(RateLimitedSession, self).request(method, url, *args, **kwargs))
+
+    def limited(self, url, send):
+        """按url的域名限速执行 send()（发出一次请求并返回响应），被限流时等待后重试"""
+        host = urlparse(url).hostname
+        if self.limiter.get_limiter(host) is None:
+            return send()
+
+        attempt = 0
+        while True:
+            self.limiter.acquire(host)
+            response = send()
+            if response.status_code not in THROTTLE_STATUSES:
+                self.limiter.succeeded(host)
+                return response
+            if attempt >= self.max_retries:
+                return response
+            self.limiter.throttled(host, self.get_throttle_delay(response, attempt))
+            response.close()
+            attempt += 1
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Bilibili合集（season）列表分页获取
+功能：
+1. 第1页返回总数后，其余页码都已确定，由线程池并发获取
+2. 按页码顺序返回结果，调用方的处理逻辑与逐页获取时相同
+3. 不知道总数或 workers<=1 时退回逐页获取
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+SEASON_ARCHIVES_API = "https://api.bilibili.com/x/polymer/web-space/seasons_archives_list"
+
+
+def season_params(collection_id, mid=None, page=1, page_size=50):
+    return {
+        'mid': mid or '',
+        'season_id': collection_id,
+        'sort_reverse': 'false',
+        'page_num': page,
+        'page_size': page_size
+    }
+
+
+def season_archives(data):
+    """从接口响应中取出视频列表，兼容不同的数据结构"""
+    data_obj = data.get('data')
+    if isinstance(data_obj, list):
+        return data_obj
+    if not isinstance(data_obj, dict):
+        return []
+    for key in ('archives', 'list', 'vlist'):
+        if key in data_obj:
+            return data_obj[key] or []
+    return []
+
+
+def season_total(data):
+    """接口返回的视频总数（data.page.total，兼容 data.total / total），未知时返回0"""
+    data_obj = data.get('data')
+    if isinstance(data_obj, dict):
+        page_info = data_obj.get('page')
+        if isinstance(page_info, dict) and page_info.get('total'):
+            return page_info['total']
+        if data_obj.get('total'):
+            return data_obj['total']
+    return data.get('total', 0) or 0
+
+
+def iter_season_pages(fetch, collection_id, mid=None, page_size=50, workers=4):
+    """按页码顺序生成 (页码, 响应JSON, 异常)
+
+    fetch(params) 请求一页并返回解析后的JSON；请求失败时该页的响应为None、异常为失败原因。
+    调用方判断到最后一页（或出错）时直接停止迭代即可，尚未开始的请求会被取消。
+    """
+    try:
+        first = fetch(season_params(collection_id, mid, 1, page_size))
+    except Exception as e:
+        yield 1, None, e
+        return
+    yield 1, first, None
+
+    total = season_total(first) if first.get('code') == 0 else 0
+    if workers <= 1 or not total:
+        # 逐页获取，直到调用方停止
+        page = 2
+        while True:
+            try:
+                data = fetch(season_params(collection_id, mid, page, page_size))
+            except Exception as e:
+                yield page, None, e
+                return
+            yield page, data, None
+            page += 1
+
+    # 总数已知：其余页并发获取，按顺序返回
+    page_count = (total + page_size - 1) // page_size
+    if page_count <= 1:
+        return
+    print(f"  共 {total} 个视频、{page_count} 页，其余 {page_count - 1} 页并发获取")
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [(page, executor.submit(fetch, season_params(collection_id, mid, page, page_size)))
+                   for page in range(2, page_count + 1)]
+        for page, future in futures:
+            try:
+                data = future.result()
+            except Exception as e:
+                yield page, None, e
+                return
+            yield page, data, None
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+hls_playlist 的测试：运行 python -m unittest discover tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from hls_playlist import Key, Segment, crypto_available, parse_media_playlist
+
+BASE_URL = 'https://example.com/video/index.m3u8'
+
+# 每个片段前都重复同一个 #EXT-X-KEY，中间换一次密钥
+REPEATED_KEY_PLAYLIST = """#EXTM3U
+#EXT-X-TARGETDURATION:10
+#EXT-X-MEDIA-SEQUENCE:5
+#EXT-X-KEY:METHOD=AES-128,URI="key1.bin"
+#EXTINF:10,
+s0.ts
+#EXT-X-KEY:METHOD=AES-128,URI="key1.bin"
+#EXTINF:10,
+s1.ts
+#EXT-X-KEY:METHOD=AES-128,URI="key2.bin",IV=0x00000000000000000000000000000001
+#EXTINF:10,
+s2.ts
+#EXT-X-KEY:METHOD=AES-128,URI="key1.bin"
+#EXTINF:10,
+s3.ts
+#EXT-X-KEY:METHOD=NONE
+#EXTINF:10,
+s4.ts
+#EXT-X-ENDLIST
+"""
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    """按URL返回固定内容，记录请求过的URL"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requested = []
+
+    def get(self, url, timeout=None):
+        self.requested.append(url)
+        return FakeResponse(self.responses[url])
+
+
+class RepeatedKeyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.playlist = parse_media_playlist(REPEATED_KEY_PLAYLIST, BASE_URL)
+
+    def test_repeated_key_lines_share_one_key(self):
+        s0, s1, s2, s3, s4 = self.playlist.segments
+        self.assertIs(s0.key, s1.key)
+        self.assertIs(s0.key, s3.key)
+        self.assertIsNot(s0.key, s2.key)
+        self.assertIsNone(s4.key)
+        self.assertEqual(s0.key.uri, 'https://example.com/video/key1.bin')
+        self.assertEqual(len(self.playlist.keys), 2)
+
+    def test_loaded_key_is_available_to_every_segment(self):
+        from download_episodes_m3u8 import CCTVDownloader
+
+        session = FakeSession({
+            'https://example.com/video/key1.bin': b'1' * 16,
+            'https://example.com/video/key2.bin': b'2' * 16,
+        })
+        downloader = CCTVDownloader(use_cache=False)
+        downloader.session = session
+        self.assertEqual(downloader.load_playlist_keys(self.playlist), 2)
+        self.assertEqual(len(session.requested), 2)
+        for segment in self.playlist.segments[:4]:
+            self.assertIsNotNone(segment.key.value)
+        self.assertEqual(self.playlist.segments[3].key.value, b'1' * 16)
+
+    def test_iv_defaults_to_sequence_number(self):
+        s0, s1, s2 = self.playlist.segments[:3]
+        self.assertEqual(s0.iv_bytes(), (5).to_bytes(16, 'big'))
+        self.assertEqual(s1.iv_bytes(), (6).to_bytes(16, 'big'))
+        self.assertEqual(s2.iv_bytes(), (1).to_bytes(16, 'big'))
+
+
+# 第一项缺少URL，紧跟着就是下一项的标签；行尾是 \r\n
+MISSING_URI_MASTER_PLAYLIST = (
+    "#EXTM3U\r\n"
+    "#EXT-X-STREAM-INF:BANDWIDTH=100000\r\n"
+    "\r\n"
+    "#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360\r\n"
+    "# 普通注释\r\n"
+    "  mid/index.m3u8  \r\n"
+    "#EXT-X-STREAM-INF:BANDWIDTH=2000000\r\n"
+)
+
+
+class VariantPlaylistTest(unittest.TestCase):
+
+    def test_variant_without_uri_is_skipped(self):
+        from download_episodes_m3u8 import CCTVDownloader
+
+        variants = CCTVDownloader(use_cache=False).parse_variants(MISSING_URI_MASTER_PLAYLIST, BASE_URL)
+        self.assertEqual(len(variants), 1)
+        self.assertEqual(variants[0]['url'], 'https://example.com/video/mid/index.m3u8')
+        self.assertEqual(variants[0]['bandwidth'], 800000)
+        self.assertEqual(variants[0]['height'], 360)
+
+
+# 同一文件中的字节区间，省略偏移的区间紧接同一文件的上一个区间之后
+BYTERANGE_PLAYLIST = """#EXTM3U
+#EXT-X-TARGETDURATION:10
+#EXT-X-BYTERANGE:1000@0
+#EXTINF:10,
+a.ts
+#EXT-X-BYTERANGE:500
+#EXTINF:10,
+a.ts
+#EXT-X-BYTERANGE:300
+#EXTINF:10,
+b.ts
+#EXT-X-BYTERANGE:200
+#EXTINF:10,
+a.ts
+#EXTINF:10,
+c.ts
+#EXT-X-BYTERANGE:400@5000
+#EXTINF:10,
+b.ts
+#EXT-X-BYTERANGE:100
+#EXTINF:10,
+b.ts
+#EXT-X-ENDLIST
+"""
+
+
+class ByteRangeTest(unittest.TestCase):
+
+    def test_omitted_offset_continues_previous_range_of_same_file(self):
+        segments = parse_media_playlist(BYTERANGE_PLAYLIST, BASE_URL).segments
+        self.assertEqual([s.byterange for s in segments],
+                         [(1000, 0), (500, 1000), (300, 0), (200, 1500), None, (400, 5000), (100, 5400)])
+        self.assertEqual(segments[1].request_headers(), {'Range': 'bytes=1000-1499'})
+        self.assertEqual(segments[3].request_headers(), {'Range': 'bytes=1500-1699'})
+        self.assertIsNone(segments[4].request_headers())
+        self.assertEqual(segments[6].request_headers(), {'Range': 'bytes=5400-5499'})
+
+
+class ChunkedResponse:
+    """按给定大小分块返回内容"""
+
+    def __init__(self, content, chunk_sizes):
+        self.content = content
+        self.chunk_sizes = chunk_sizes
+        self.status_code = 200
+        self.headers = {'Content-Length': str(len(content))}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=None):
+        offset = 0
+        i = 0
+        while offset < len(self.content):
+            size = self.chunk_sizes[i % len(self.chunk_sizes)]
+            yield self.content[offset:offset + size]
+            offset += size
+            i += 1
+
+
+class ChunkedSession:
+    def __init__(self, content, chunk_sizes):
+        self.content = content
+        self.chunk_sizes = chunk_sizes
+
+    def get(self, url, **kwargs):
+        return ChunkedResponse(self.content, self.chunk_sizes)
+
+
+@unittest.skipUnless(crypto_available(), "需要 cryptography")
+class ChunkedDecryptionTest(unittest.TestCase):
+    """AES-128片段分块解密：数据块边界不对齐16字节时结果也要和整体解密相同"""
+
+    KEY = bytes(range(16))
+    SEQUENCE = 7
+
+    def setUp(self):
+        from cryptography.hazmat.primitives import padding
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+        # 长度不是16的倍数，最后一块带填充
+        self.plaintext = bytes(i * 31 % 251 for i in range(1000))
+        padder = padding.PKCS7(128).padder()
+        padded = padder.update(self.plaintext) + padder.finalize()
+        encryptor = Cipher(algorithms.AES(self.KEY), modes.CBC(self.SEQUENCE.to_bytes(16, 'big'))).encryptor()
+        self.ciphertext = encryptor.update(padded) + encryptor.finalize()
+
+        key = Key('AES-128', 'https://example.com/video/key.bin')
+        key.value = self.KEY
+        self.segment = Segment('https://example.com/video/s7.ts', sequence=self.SEQUENCE, key=key)
+
+    def decrypt_in_chunks(self, chunk_size):
+        decryptor = self.segment.decryptor()
+        data = b''
+        for offset in range(0, len(self.ciphertext), chunk_size):
+            data += decryptor.update(self.ciphertext[offset:offset + chunk_size])
+        return data + decryptor.finalize()
+
+    def test_any_chunk_size_gives_same_plaintext(self):
+        for chunk_size in (1, 5, 15, 16, 17, 33, 100, 1007, len(self.ciphertext)):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self.decrypt_in_chunks(chunk_size), self.plaintext)
+
+    def test_padding_split_across_last_chunks(self):
+        # 最后一个16字节块（含填充）被拆到两个数据块中
+        decryptor = self.segment.decryptor()
+        data = decryptor.update(self.ciphertext[:-8])
+        data += decryptor.update(self.ciphertext[-8:])
+        self.assertEqual(data + decryptor.finalize(), self.plaintext)
+
+    def test_download_decrypts_unaligned_chunks(self):
+        from download_episodes_m3u8 import CCTVDownloader
+
+        downloader = CCTVDownloader(use_cache=False, range_connections=1)
+        downloader.session = ChunkedSession(self.ciphertext, [100, 7, 250, 1])
+        temp_dir = tempfile.mkdtemp()
+        try:
+            ts_file, ts_index, error, _ = downloader.download_single_ts(self.segment, 0, 1, temp_dir)
+            self.assertIsNone(error)
+            with open(ts_file, 'rb') as f:
+                self.assertEqual(f.read(), self.plaintext)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
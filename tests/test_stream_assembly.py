@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+流式组装（stream_ts_to_mp4）的测试：运行 python -m unittest discover tests
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import requests
+
+from download_episodes_m3u8 import CCTVDownloader
+from hls_playlist import Segment
+
+SEGMENT_SIZE = 400
+
+
+class FakeResponse:
+    """按100字节一块返回片段内容；状态码>=400时 raise_for_status 抛出异常"""
+
+    def __init__(self, url, status_code):
+        self.url = url
+        self.status_code = status_code
+        self.headers = {'Content-Length': str(SEGMENT_SIZE)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error", response=self)
+
+    def iter_content(self, chunk_size=None):
+        for _ in range(SEGMENT_SIZE // 100):
+            yield b'x' * 100
+
+
+class FakeSession:
+    def __init__(self, statuses):
+        self.statuses = statuses
+
+    def get(self, url, **kwargs):
+        return FakeResponse(url, self.statuses.get(url, 200))
+
+
+class MemorySink(io.BytesIO):
+    def close(self):
+        self.size = len(self.getvalue())
+
+
+class StreamAssemblyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.directory, 'out.mp4')
+        self.segments = [Segment(f'https://example.com/s{i}.ts') for i in range(10)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def run_stream(self, statuses, max_inflight_bytes):
+        downloader = CCTVDownloader(assembly_mode='stream', max_inflight_bytes=max_inflight_bytes,
+                                    use_cache=False, range_connections=1, retry_backoff=0.01)
+        downloader.session = FakeSession(statuses)
+        self.sink = MemorySink()
+
+        def open_stream_output(part_path, fragmented=False):
+            open(part_path, 'wb').close()
+            return self.sink, None
+
+        downloader.open_stream_output = open_stream_output
+        result = {}
+        thread = threading.Thread(
+            target=lambda: result.setdefault('ok', downloader.stream_ts_to_mp4(self.segments, self.output_path)),
+            daemon=True)
+        thread.start()
+        thread.join(15)
+        self.assertFalse(thread.is_alive(), "流式组装没有结束")
+        return result['ok'], downloader
+
+    def test_complete_download_within_small_budget(self):
+        ok, downloader = self.run_stream({}, max_inflight_bytes=1000)
+        self.assertTrue(ok)
+        self.assertEqual(self.sink.size, SEGMENT_SIZE * len(self.segments))
+        self.assertEqual(downloader.inflight_budget.used, 0)
+
+    def test_failing_head_segment_with_full_budget_aborts(self):
+        ok, downloader = self.run_stream({'https://example.com/s0.ts': 404}, max_inflight_bytes=1000)
+        self.assertFalse(ok)
+        self.assertFalse(os.path.exists(self.output_path))
+        self.assertEqual(downloader.inflight_budget.used, 0)
+        self.assertEqual(downloader.concurrency.active, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
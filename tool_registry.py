@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+外部工具探测（ffmpeg / ffprobe / yt-dlp）
+功能：
+1. 每个进程只探测一次，缓存可执行文件路径、版本和特性
+2. 线程安全，CCTV下载器和Bilibili下载器共用
+3. yt-dlp优先以当前解释器的模块方式调用（sys.executable -m yt_dlp），其次查找命令行程序
+"""
+
+import re
+import sys
+import shutil
+import subprocess
+import importlib.util
+from threading import Lock
+
+
+class ToolInfo:
+    """已探测到的外部工具"""
+
+    def __init__(self, name, command, version='', features=None):
+        self.name = name
+        self.command = list(command)  # 调用前缀，如 ['ffmpeg'] 或 [sys.executable, '-m', 'yt_dlp']
+        self.version = version
+        self.features = set(features or ())
+
+    def cmd(self, *args):
+        """拼接完整命令行"""
+        return self.command + list(args)
+
+    def __repr__(self):
+        return f"ToolInfo({self.name!r}, {self.command!r}, version={self.version!r})"
+
+
+class ToolRegistry:
+    """外部工具注册表：首次使用时探测，之后直接返回缓存结果"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._tools = {}
+        self._probers = {
+            'ffmpeg': self.probe_ffmpeg,
+            'ffprobe': self.probe_ffprobe,
+            'yt-dlp': self.probe_ytdlp,
+        }
+
+    def get(self, name):
+        """返回工具信息，不可用时返回None"""
+        with self._lock:
+            if name not in self._tools:
+                try:
+                    self._tools[name] = self._probers[name]()
+                except Exception as e:
+                    print(f"  探测 {name} 失败: {e}")
+                    self._tools[name] = None
+            return self._tools[name]
+
+    def available(self, name):
+        return self.get(name) is not None
+
+    def probe_all(self):
+        """一次性探测所有工具（可在启动时调用）"""
+        return {name: self.get(name) for name in self._probers}
+
+    def reset(self):
+        """清空缓存，下次使用时重新探测（例如运行中安装了新工具）"""
+        with self._lock:
+            self._tools.clear()
+
+    @staticmethod
+    def run_version(command, flag):
+        """运行版本命令，返回输出；失败返回None"""
+        try:
+            result = subprocess.run(command + [flag], capture_output=True, timeout=10)
+        except (FileNotFoundError, PermissionError, subprocess.TimeoutExpired):
+            return None
+        if result.returncode != 0:
+            return None
+        return result.stdout.decode('utf-8', errors='ignore')
+
+    def probe_ffmpeg_like(self, name):
+        path = shutil.which(name)
+        if not path:
+            return None
+        output = self.run_version([path], '-version')
+        if output is None:
+            return None
+        match = re.search(rf'{name} version (\S+)', output)
+        # 特性取自编译配置，如 --enable-libx264 -> libx264
+        features = re.findall(r'--enable-([\w-]+)', output)
+        return ToolInfo(name, [path], match.group(1) if match else '', features)
+
+    def probe_ffmpeg(self):
+        return self.probe_ffmpeg_like('ffmpeg')
+
+    def probe_ffprobe(self):
+        return self.probe_ffmpeg_like('ffprobe')
+
+    def probe_ytdlp(self):
+        if importlib.util.find_spec('yt_dlp') is not None:
+            command = [sys.executable, '-m', 'yt_dlp']
+            output = self.run_version(command, '--version')
+            if output is not None:
+                return ToolInfo('yt-dlp', command, output.strip(), {'module'})
+
+        path = shutil.which('yt-dlp')
+        if path:
+            output = self.run_version([path], '--version')
+            if output is not None:
+                return ToolInfo('yt-dlp', [path], output.strip())
+        return None
+
+
+# 进程内共享的注册表
+registry = ToolRegistry()
+
+
+def get_tool(name):
+    """获取工具信息，不可用时返回None"""
+    return registry.get(name)
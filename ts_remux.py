@@ -0,0 +1,641 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+MPEG-TS 转封装为 MP4（纯Python实现，不依赖ffmpeg）
+功能：
+1. 解析TS流（PAT/PMT/PES），提取H.264视频和AAC音频
+2. 边输入边输出分片MP4（fMP4），不重新编码，输出可正常拖动进度
+3. 遇到不支持的编码（如H.265、AC-3）时，自动退回为原样拼接TS数据
+
+限制：假设每个视频PES包含一个完整的访问单元（HLS切片通常如此）
+"""
+
+import struct
+
+TS_PACKET_SIZE = 188
+STREAM_TYPE_H264 = 0x1B
+STREAM_TYPE_AAC = 0x0F
+# 可以安全忽略的流：私有数据、ID3元数据、SCTE-35广告标记
+IGNORED_STREAM_TYPES = {0x05, 0x06, 0x15, 0x86}
+
+VIDEO_TIMESCALE = 90000
+AAC_SAMPLE_RATES = [96000, 88200, 64000, 48000, 44100, 32000, 24000,
+                    22050, 16000, 12000, 11025, 8000, 7350]
+AAC_FRAME_SAMPLES = 1024
+# 纯音频流每个分片包含的音频帧数
+AUDIO_ONLY_FRAGMENT_FRAMES = 200
+# 在输出初始化之前最多缓存的原始TS数据量，超过后放弃转封装
+MAX_PROBE_BYTES = 64 * 1024 * 1024
+
+MATRIX = struct.pack('>9I', 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+
+
+def box(box_type, *payloads):
+    """构造MP4 box"""
+    data = b''.join(payloads)
+    return struct.pack('>I', 8 + len(data)) + box_type + data
+
+
+def full_box(box_type, version, flags, *payloads):
+    """构造带version和flags的MP4 full box"""
+    return box(box_type, struct.pack('>I', (version << 24) | flags), *payloads)
+
+
+def descriptor(tag, payload):
+    """构造esds中的MPEG-4描述符（长度固定用4字节编码）"""
+    length = len(payload)
+    return bytes([tag, 0x80 | (length >> 21) & 0x7F, 0x80 | (length >> 14) & 0x7F,
+                  0x80 | (length >> 7) & 0x7F, length & 0x7F]) + payload
+
+
+def split_nal_units(data):
+    """按起始码 00 00 01 / 00 00 00 01 拆分H.264 Annex B数据"""
+    nals = []
+    length = len(data)
+    start = data.find(b'\x00\x00\x01')
+    while start != -1:
+        start += 3
+        end = data.find(b'\x00\x00\x01', start)
+        if end == -1:
+            nal = data[start:]
+        else:
+            # 4字节起始码的前导0属于下一个起始码
+            nal_end = end
+            while nal_end > start and data[nal_end - 1] == 0:
+                nal_end -= 1
+            nal = data[start:nal_end]
+        if nal:
+            nals.append(nal)
+        start = end
+        if end == -1 or end >= length:
+            break
+    return nals
+
+
+class BitReader:
+    """按位读取H.264 RBSP数据（已去除防竞争字节）"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read_bits(self, count):
+        value = 0
+        for _ in range(count):
+            byte = self.data[self.pos >> 3] if (self.pos >> 3) < len(self.data) else 0
+            value = (value << 1) | ((byte >> (7 - (self.pos & 7))) & 1)
+            self.pos += 1
+        return value
+
+    def read_ue(self):
+        """无符号指数哥伦布编码"""
+        zeros = 0
+        while self.read_bits(1) == 0 and zeros < 32:
+            zeros += 1
+        return (1 << zeros) - 1 + self.read_bits(zeros)
+
+    def read_se(self):
+        """有符号指数哥伦布编码"""
+        value = self.read_ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+def parse_sps(sps):
+    """解析SPS，返回宽、高、色度格式和位深"""
+    # 去除防竞争字节 00 00 03
+    rbsp = bytearray()
+    zeros = 0
+    for byte in sps[1:]:
+        if zeros >= 2 and byte == 3:
+            zeros = 0
+            continue
+        rbsp.append(byte)
+        zeros = zeros + 1 if byte == 0 else 0
+
+    reader = BitReader(rbsp)
+    profile_idc = reader.read_bits(8)
+    reader.read_bits(16)  # constraint_flags + level_idc
+    reader.read_ue()  # seq_parameter_set_id
+
+    chroma_format_idc = 1
+    bit_depth_luma = 8
+    bit_depth_chroma = 8
+    if profile_idc in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+        chroma_format_idc = reader.read_ue()
+        if chroma_format_idc == 3:
+            reader.read_bits(1)  # separate_colour_plane_flag
+        bit_depth_luma = reader.read_ue() + 8
+        bit_depth_chroma = reader.read_ue() + 8
+        reader.read_bits(1)  # qpprime_y_zero_transform_bypass_flag
+        if reader.read_bits(1):  # seq_scaling_matrix_present_flag
+            for i in range(8 if chroma_format_idc != 3 else 12):
+                if reader.read_bits(1):
+                    size = 16 if i < 6 else 64
+                    last_scale = next_scale = 8
+                    for _ in range(size):
+                        if next_scale != 0:
+                            next_scale = (last_scale + reader.read_se()) % 256
+                        last_scale = next_scale if next_scale != 0 else last_scale
+
+    reader.read_ue()  # log2_max_frame_num_minus4
+    pic_order_cnt_type = reader.read_ue()
+    if pic_order_cnt_type == 0:
+        reader.read_ue()
+    elif pic_order_cnt_type == 1:
+        reader.read_bits(1)
+        reader.read_se()
+        reader.read_se()
+        for _ in range(reader.read_ue()):
+            reader.read_se()
+    reader.read_ue()  # max_num_ref_frames
+    reader.read_bits(1)  # gaps_in_frame_num_value_allowed_flag
+    width_in_mbs = reader.read_ue() + 1
+    height_in_map_units = reader.read_ue() + 1
+    frame_mbs_only = reader.read_bits(1)
+    if not frame_mbs_only:
+        reader.read_bits(1)  # mb_adaptive_frame_field_flag
+    reader.read_bits(1)  # direct_8x8_inference_flag
+
+    crop_left = crop_right = crop_top = crop_bottom = 0
+    if reader.read_bits(1):  # frame_cropping_flag
+        crop_left = reader.read_ue()
+        crop_right = reader.read_ue()
+        crop_top = reader.read_ue()
+        crop_bottom = reader.read_ue()
+
+    crop_unit_x = 1 if chroma_format_idc in (0, 3) else 2
+    crop_unit_y = (1 if chroma_format_idc in (0, 2) else 2) * (2 - frame_mbs_only)
+    width = width_in_mbs * 16 - crop_unit_x * (crop_left + crop_right)
+    height = (2 - frame_mbs_only) * height_in_map_units * 16 - crop_unit_y * (crop_top + crop_bottom)
+
+    return {
+        'width': width,
+        'height': height,
+        'chroma_format_idc': chroma_format_idc,
+        'bit_depth_luma': bit_depth_luma,
+        'bit_depth_chroma': bit_depth_chroma,
+    }
+
+
+class Track:
+    """输出MP4中的一条轨道，缓存尚未写出的样本"""
+
+    def __init__(self, track_id, kind, timescale):
+        self.track_id = track_id
+        self.kind = kind  # 'video' 或 'audio'
+        self.timescale = timescale
+        self.samples = []  # (dts, pts, data, is_key)，时间单位为timescale
+        self.config = None  # 视频: (sps, pps, sps_info)；音频: (audio_object_type, sample_rate_index, channels)
+        self.next_decode_time = None
+        self.last_duration = None
+
+
+class TSRemuxer:
+    """MPEG-TS -> 分片MP4 转封装器
+
+    用法与文件对象相同：write() 依次写入TS数据，close() 结束并输出剩余数据。
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.buffer = b''
+        self.pmt_pids = set()
+        self.streams = {}  # pid -> stream_type
+        self.dropped_pids = set()
+        self.pes_buffers = {}  # pid -> bytearray
+        self.last_timestamps = {}  # pid -> 上一个时间戳，用于处理33位回绕
+        self.tracks = {}  # 'video'/'audio' -> Track
+        self.base_time = None
+        self.video_offset = None
+        self.sequence_number = 0
+        self.initialized = False
+        self.passthrough = False
+        self.probe_data = []
+        self.probe_size = 0
+        self.closed = False
+
+    # ---------- 输入 ----------
+
+    def write(self, data):
+        if self.passthrough:
+            self.output.write(data)
+            return
+
+        if not self.initialized:
+            self.probe_data.append(bytes(data))
+            self.probe_size += len(data)
+            if self.probe_size > MAX_PROBE_BYTES:
+                self.fall_back("长时间未能识别出可转封装的音视频流")
+                return
+
+        self.buffer += bytes(data)
+        offset = 0
+        length = len(self.buffer)
+        while offset + TS_PACKET_SIZE <= length:
+            if self.buffer[offset] != 0x47:
+                # 同步丢失，寻找下一个同步字节
+                next_sync = self.buffer.find(b'\x47', offset + 1)
+                if next_sync == -1:
+                    offset = length
+                    break
+                offset = next_sync
+                continue
+            self.handle_packet(self.buffer[offset:offset + TS_PACKET_SIZE])
+            if self.passthrough:
+                return
+            offset += TS_PACKET_SIZE
+        self.buffer = self.buffer[offset:]
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if not self.passthrough:
+            for pid in list(self.pes_buffers):
+                self.flush_pes(pid)
+            if not self.passthrough:
+                self.flush_fragment(final=True)
+                if not self.initialized:
+                    self.fall_back("没有找到可转封装的音视频数据")
+        self.output.close()
+
+    def fall_back(self, reason):
+        """放弃转封装，原样输出TS数据"""
+        print(f"    无法转封装为MP4（{reason}），改为直接拼接TS数据")
+        self.passthrough = True
+        for data in self.probe_data:
+            self.output.write(data)
+        self.probe_data = []
+        self.buffer = b''
+
+    # ---------- TS/PSI/PES 解析 ----------
+
+    def handle_packet(self, packet):
+        pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        payload_unit_start = packet[1] & 0x40
+        adaptation_control = (packet[3] >> 4) & 0x03
+
+        offset = 4
+        if adaptation_control in (2, 3):
+            offset += 1 + packet[4]
+        if adaptation_control == 2 or offset >= TS_PACKET_SIZE:
+            return
+        payload = packet[offset:]
+
+        if pid == 0:
+            if payload_unit_start:
+                self.parse_pat(payload[1 + payload[0]:])
+        elif pid in self.pmt_pids:
+            if payload_unit_start:
+                self.parse_pmt(payload[1 + payload[0]:])
+        elif pid in self.streams:
+            if payload_unit_start:
+                self.flush_pes(pid)
+                self.pes_buffers[pid] = bytearray(payload)
+            elif pid in self.pes_buffers:
+                self.pes_buffers[pid] += payload
+
+    def parse_pat(self, section):
+        if len(section) < 8 or section[0] != 0x00:
+            return
+        section_length = ((section[1] & 0x0F) << 8) | section[2]
+        end = min(3 + section_length - 4, len(section))
+        for i in range(8, end - 3, 4):
+            program_number = (section[i] << 8) | section[i + 1]
+            pid = ((section[i + 2] & 0x1F) << 8) | section[i + 3]
+            if program_number != 0:
+                self.pmt_pids.add(pid)
+
+    def parse_pmt(self, section):
+        if len(section) < 12 or section[0] != 0x02:
+            return
+        section_length = ((section[1] & 0x0F) << 8) | section[2]
+        end = min(3 + section_length - 4, len(section))
+        program_info_length = ((section[10] & 0x0F) << 8) | section[11]
+        i = 12 + program_info_length
+        while i + 5 <= end:
+            stream_type = section[i]
+            pid = ((section[i + 1] & 0x1F) << 8) | section[i + 2]
+            es_info_length = ((section[i + 3] & 0x0F) << 8) | section[i + 4]
+            i += 5 + es_info_length
+
+            if stream_type in IGNORED_STREAM_TYPES or pid in self.streams:
+                continue
+            if self.initialized:
+                # 初始化段已经写出，新出现的流无法再加入，只能丢弃这一路数据
+                if pid not in self.dropped_pids:
+                    self.dropped_pids.add(pid)
+                    print(f"    忽略中途出现的流 PID 0x{pid:04X}（类型 0x{stream_type:02X}）")
+                continue
+            if stream_type == STREAM_TYPE_H264 and 'video' not in self.tracks:
+                self.tracks['video'] = Track(1, 'video', VIDEO_TIMESCALE)
+            elif stream_type == STREAM_TYPE_AAC and 'audio' not in self.tracks:
+                self.tracks['audio'] = Track(2, 'audio', None)
+            elif stream_type not in (STREAM_TYPE_H264, STREAM_TYPE_AAC):
+                self.fall_back(f"不支持的流类型 0x{stream_type:02X}")
+                return
+            else:
+                # 同类型的第二条音/视频流，忽略
+                continue
+            self.streams[pid] = stream_type
+
+    @staticmethod
+    def read_timestamp(data):
+        return (((data[0] >> 1) & 0x07) << 30) | (data[1] << 22) | ((data[2] >> 1) << 15) | \
+               (data[3] << 7) | (data[4] >> 1)
+
+    def unwrap(self, pid, timestamp):
+        """处理33位时间戳回绕"""
+        last = self.last_timestamps.get(pid)
+        if last is not None:
+            while timestamp < last - (1 << 32):
+                timestamp += 1 << 33
+        self.last_timestamps[pid] = timestamp
+        return timestamp
+
+    def flush_pes(self, pid):
+        pes = self.pes_buffers.pop(pid, None)
+        if not pes or len(pes) < 9 or pes[0:3] != b'\x00\x00\x01':
+            return
+        flags = pes[7]
+        header_length = pes[8]
+        pts = dts = None
+        if flags & 0x80 and len(pes) >= 14:
+            pts = self.unwrap(pid, self.read_timestamp(pes[9:14]))
+            dts = pts
+        if flags & 0x40 and len(pes) >= 19:
+            dts = self.read_timestamp(pes[14:19])
+            dts = pts - ((pts - dts) % (1 << 33))
+        payload = bytes(pes[9 + header_length:])
+
+        stream_type = self.streams.get(pid)
+        if stream_type == STREAM_TYPE_H264 and 'video' in self.tracks:
+            self.add_video(pts, dts, payload)
+        elif stream_type == STREAM_TYPE_AAC and 'audio' in self.tracks:
+            self.add_audio(pts, payload)
+
+    # ---------- 音视频样本 ----------
+
+    def add_video(self, pts, dts, payload):
+        track = self.tracks['video']
+        nal_data = []
+        is_key = False
+        for nal in split_nal_units(payload):
+            nal_type = nal[0] & 0x1F
+            if nal_type == 7:
+                if track.config is None:
+                    track.config = [nal, None, parse_sps(nal)]
+                continue
+            if nal_type == 8:
+                if track.config is not None and track.config[1] is None:
+                    track.config[1] = nal
+                continue
+            if nal_type == 9:  # 访问单元分隔符
+                continue
+            if nal_type == 5:
+                is_key = True
+            nal_data.append(struct.pack('>I', len(nal)) + nal)
+
+        if not nal_data:
+            return
+        if pts is None:
+            # 缺少时间戳时按上一帧推算
+            if not track.samples:
+                return
+            last_dts = track.samples[-1][0] + (track.last_duration or 3600)
+            pts = dts = last_dts
+        if self.base_time is None:
+            self.base_time = dts
+        # 输出从第一个关键帧开始
+        if not track.samples and track.next_decode_time is None and not is_key:
+            return
+        if track.config is None or track.config[1] is None:
+            return
+
+        if is_key and track.samples:
+            self.flush_fragment()
+        track.samples.append((dts, pts, b''.join(nal_data), is_key))
+
+    def add_audio(self, pts, payload):
+        track = self.tracks['audio']
+        offset = 0
+        frame_index = 0
+        while offset + 7 <= len(payload):
+            if payload[offset] != 0xFF or (payload[offset + 1] & 0xF0) != 0xF0:
+                offset += 1
+                continue
+            protection_absent = payload[offset + 1] & 0x01
+            audio_object_type = ((payload[offset + 2] >> 6) & 0x03) + 1
+            sample_rate_index = (payload[offset + 2] >> 2) & 0x0F
+            channels = ((payload[offset + 2] & 0x01) << 2) | ((payload[offset + 3] >> 6) & 0x03)
+            frame_length = ((payload[offset + 3] & 0x03) << 11) | (payload[offset + 4] << 3) | \
+                           ((payload[offset + 5] >> 5) & 0x07)
+            header_length = 7 if protection_absent else 9
+            if frame_length < header_length or sample_rate_index >= len(AAC_SAMPLE_RATES):
+                offset += 1
+                continue
+            if offset + frame_length > len(payload):
+                break
+
+            if track.config is None:
+                track.config = (audio_object_type, sample_rate_index, channels)
+                track.timescale = AAC_SAMPLE_RATES[sample_rate_index]
+
+            if pts is not None:
+                frame_pts = pts + frame_index * AAC_FRAME_SAMPLES * 90000 // track.timescale
+                if self.base_time is None and 'video' not in self.tracks:
+                    self.base_time = frame_pts
+            else:
+                frame_pts = None
+            track.samples.append((frame_pts, frame_pts,
+                                  payload[offset + header_length:offset + frame_length], True))
+            offset += frame_length
+            frame_index += 1
+
+        if 'video' not in self.tracks and len(track.samples) >= AUDIO_ONLY_FRAGMENT_FRAMES:
+            self.flush_fragment()
+
+    # ---------- MP4 输出 ----------
+
+    def flush_fragment(self, final=False):
+        """把缓存的样本写成一个 moof+mdat 分片"""
+        video = self.tracks.get('video')
+        audio = self.tracks.get('audio')
+
+        if not self.initialized:
+            # 等待所有轨道的编码参数都已知再写初始化段
+            ready = [t for t in (video, audio) if t is not None and t.config is not None
+                     and (t.kind != 'video' or t.config[1] is not None)]
+            waiting = [t for t in (video, audio) if t is not None and t not in ready]
+            if waiting and not final:
+                return
+            if not ready or self.base_time is None:
+                return
+            for track in waiting:
+                del self.tracks[track.kind]
+                video = None if track.kind == 'video' else video
+                audio = None if track.kind == 'audio' else audio
+            self.output.write(self.build_init_segment())
+            self.initialized = True
+            self.probe_data = []
+
+        trafs = []
+        if video is not None and video.samples:
+            trafs.append((video, self.video_entries(video, video.samples)))
+            video.samples = []
+        if audio is not None and audio.samples:
+            trafs.append((audio, self.audio_entries(audio, audio.samples)))
+            audio.samples = []
+
+        if trafs:
+            self.output.write(self.build_fragment(trafs))
+
+    def video_entries(self, track, samples):
+        """计算视频样本的时长和显示时间偏移"""
+        if track.next_decode_time is None:
+            track.next_decode_time = samples[0][0] - self.base_time
+            self.video_offset = samples[0][1] - samples[0][0]
+        base_decode_time = track.next_decode_time
+
+        entries = []
+        for i, (dts, pts, data, is_key) in enumerate(samples):
+            if i + 1 < len(samples):
+                duration = samples[i + 1][0] - dts
+            else:
+                duration = track.last_duration or 3600
+            duration = max(1, duration)
+            track.last_duration = duration
+            entries.append((duration, data, is_key, (pts - dts) - self.video_offset))
+            track.next_decode_time += duration
+        return base_decode_time, entries
+
+    def audio_entries(self, track, samples):
+        """音频样本时长固定为1024个采样点，起始时间按第一个帧的PTS对齐视频
+
+        视频的显示时间整体提前了 video_offset，音频也要减去同样的偏移才能保持同步。
+        """
+        if track.next_decode_time is None:
+            first_pts = next((s[1] for s in samples if s[1] is not None), self.base_time)
+            offset = max(0, first_pts - self.base_time - (self.video_offset or 0))
+            track.next_decode_time = offset * track.timescale // 90000
+        base_decode_time = track.next_decode_time
+        entries = [(AAC_FRAME_SAMPLES, data, True, 0) for _, _, data, _ in samples]
+        track.next_decode_time += AAC_FRAME_SAMPLES * len(entries)
+        return base_decode_time, entries
+
+    def build_init_segment(self):
+        tracks = [t for t in (self.tracks.get('video'), self.tracks.get('audio')) if t is not None]
+        ftyp = box(b'ftyp', b'iso5', struct.pack('>I', 512), b'iso5', b'iso6', b'mp41')
+        mvhd = full_box(b'mvhd', 0, 0,
+                        struct.pack('>IIII', 0, 0, 1000, 0),
+                        struct.pack('>IH', 0x00010000, 0x0100), b'\x00' * 10,
+                        MATRIX, b'\x00' * 24,
+                        struct.pack('>I', max(t.track_id for t in tracks) + 1))
+        traks = b''.join(self.build_trak(t) for t in tracks)
+        mvex = box(b'mvex', *[full_box(b'trex', 0, 0, struct.pack('>IIIII', t.track_id, 1, 0, 0, 0))
+                              for t in tracks])
+        return ftyp + box(b'moov', mvhd, traks, mvex)
+
+    def build_trak(self, track):
+        if track.kind == 'video':
+            width = track.config[2]['width']
+            height = track.config[2]['height']
+            volume = 0
+            handler = b'vide'
+            media_header = full_box(b'vmhd', 0, 1, b'\x00' * 8)
+            sample_entry = self.build_avc1(track)
+        else:
+            width = height = 0
+            volume = 0x0100
+            handler = b'soun'
+            media_header = full_box(b'smhd', 0, 0, b'\x00' * 4)
+            sample_entry = self.build_mp4a(track)
+
+        tkhd = full_box(b'tkhd', 0, 3,
+                        struct.pack('>IIIII', 0, 0, track.track_id, 0, 0),
+                        b'\x00' * 8, struct.pack('>hhhH', 0, 0, volume, 0),
+                        MATRIX, struct.pack('>II', width << 16, height << 16))
+        mdhd = full_box(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, track.timescale, 0, 0x55C4, 0))
+        hdlr = full_box(b'hdlr', 0, 0, struct.pack('>I', 0), handler, b'\x00' * 12,
+                        (b'VideoHandler' if track.kind == 'video' else b'SoundHandler') + b'\x00')
+        dinf = box(b'dinf', full_box(b'dref', 0, 0, struct.pack('>I', 1), full_box(b'url ', 0, 1)))
+        stbl = box(b'stbl',
+                   full_box(b'stsd', 0, 0, struct.pack('>I', 1), sample_entry),
+                   full_box(b'stts', 0, 0, struct.pack('>I', 0)),
+                   full_box(b'stsc', 0, 0, struct.pack('>I', 0)),
+                   full_box(b'stsz', 0, 0, struct.pack('>II', 0, 0)),
+                   full_box(b'stco', 0, 0, struct.pack('>I', 0)))
+        minf = box(b'minf', media_header, dinf, stbl)
+        return box(b'trak', tkhd, box(b'mdia', mdhd, hdlr, minf))
+
+    def build_avc1(self, track):
+        sps, pps, info = track.config
+        avcc = bytes([1, sps[1], sps[2], sps[3], 0xFF, 0xE1]) + struct.pack('>H', len(sps)) + sps + \
+               bytes([1]) + struct.pack('>H', len(pps)) + pps
+        if sps[1] in (100, 110, 122, 244):
+            avcc += bytes([0xFC | info['chroma_format_idc'],
+                           0xF8 | (info['bit_depth_luma'] - 8),
+                           0xF8 | (info['bit_depth_chroma'] - 8), 0])
+        return box(b'avc1',
+                   b'\x00' * 6, struct.pack('>H', 1),
+                   b'\x00' * 16,
+                   struct.pack('>HHII', info['width'], info['height'], 0x00480000, 0x00480000),
+                   struct.pack('>IH', 0, 1), b'\x00' * 32,
+                   struct.pack('>Hh', 0x0018, -1),
+                   box(b'avcC', avcc))
+
+    def build_mp4a(self, track):
+        audio_object_type, sample_rate_index, channels = track.config
+        audio_specific_config = struct.pack('>H', (audio_object_type << 11) | (sample_rate_index << 7) | (channels << 3))
+        decoder_config = descriptor(0x04, bytes([0x40, 0x15]) + b'\x00\x00\x00' + struct.pack('>II', 0, 0) +
+                                    descriptor(0x05, audio_specific_config))
+        es = descriptor(0x03, struct.pack('>HB', track.track_id, 0) + decoder_config + descriptor(0x06, b'\x02'))
+        sample_rate = track.timescale if track.timescale < 65536 else 0
+        return box(b'mp4a',
+                   b'\x00' * 6, struct.pack('>H', 1),
+                   b'\x00' * 8,
+                   struct.pack('>HHHH', channels or 2, 16, 0, 0),
+                   struct.pack('>I', sample_rate << 16),
+                   full_box(b'esds', 0, 0, es))
+
+    def build_fragment(self, trafs):
+        self.sequence_number += 1
+
+        def build_moof(data_offsets):
+            parts = [full_box(b'mfhd', 0, 0, struct.pack('>I', self.sequence_number))]
+            for (track, (base_decode_time, entries)), data_offset in zip(trafs, data_offsets):
+                tfhd = full_box(b'tfhd', 0, 0x020000, struct.pack('>I', track.track_id))
+                tfdt = full_box(b'tfdt', 1, 0, struct.pack('>Q', base_decode_time))
+                rows = []
+                for duration, data, is_key, composition_offset in entries:
+                    sample_flags = 0x02000000 if is_key else 0x01010000
+                    rows.append(struct.pack('>IIIi', duration, len(data), sample_flags, composition_offset))
+                trun = full_box(b'trun', 1, 0x000F01,
+                                struct.pack('>Ii', len(entries), data_offset), *rows)
+                parts.append(box(b'traf', tfhd, tfdt, trun))
+            return box(b'moof', *parts)
+
+        # 先用占位偏移计算moof大小，再填入各轨道数据在mdat中的实际偏移
+        moof_size = len(build_moof([0] * len(trafs)))
+        data_offsets = []
+        offset = moof_size + 8
+        for _, (_, entries) in trafs:
+            data_offsets.append(offset)
+            offset += sum(len(data) for _, data, _, _ in entries)
+
+        moof = build_moof(data_offsets)
+        mdat_payload = b''.join(data for _, (_, entries) in trafs for _, data, _, _ in entries)
+        return moof + struct.pack('>I', 8 + len(mdat_payload)) + b'mdat' + mdat_payload
+
+
+def remux_ts_files(ts_files, output_path, chunk_size=1024 * 1024):
+    """把多个TS文件依次转封装为一个MP4文件"""
+    remuxer = TSRemuxer(open(output_path, 'wb'))
+    try:
+        for ts_file in ts_files:
+            with open(ts_file, 'rb') as f:
+                for block in iter(lambda: f.read(chunk_size), b''):
+                    remuxer.write(block)
+    finally:
+        remuxer.close()
+    return not remuxer.passthrough